@@ -0,0 +1,87 @@
+"""
+量測匯入時間：以 `python -X importtime` 在乾淨的子行程中匯入各個進入點，
+取多次執行的中位數與預算比較，並檢查不應在匯入時載入的重量級套件。
+
+用法 (在專案資料夾的上一層執行，與 `from src.service import Service` 相同)：
+    python -m src.benchmark.import_time
+    python -m src.benchmark.import_time --budget-ms 300 --repeat 7 --top 15
+
+超過預算或載入了禁止的套件時以狀態碼 1 結束，可直接放進 CI。
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(PACKAGE_ROOT)
+
+# 進入點 -> 匯入時不應被載入的套件
+SCENARIOS: dict[str, tuple[str, ...]] = {
+    f"{PACKAGE}.service": ("torch", "sentence_transformers", "weaviate", "qdrant_client", "chromadb", "openai", "ollama", "serpapi"),
+    f"{PACKAGE}.service.WebService": ("torch", "sentence_transformers", "weaviate", "qdrant_client", "chromadb", "openai", "ollama"),
+    f"{PACKAGE}.service.VectorService": ("torch", "sentence_transformers", "weaviate", "qdrant_client", "chromadb", "openai", "ollama"),
+    f"{PACKAGE}.service.ChatService": ("torch", "sentence_transformers", "weaviate", "qdrant_client", "chromadb", "openai", "ollama"),
+    f"{PACKAGE}.component.typing": ("torch", "sentence_transformers", "openai", "ollama", "PIL"),
+    f"{PACKAGE}.component.utils": ("torch", "sentence_transformers", "openai", "ollama"),
+}
+
+def measure(module: str) -> tuple[float, dict[str, tuple[int, int]]]:
+    """
+    回傳 (匯入 module 的總毫秒數, {模組: (self 微秒, cumulative 微秒)})
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(PACKAGE_ROOT),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    modules: dict[str, tuple[int, int]] = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # 沒有縮排的是 -c 直接觸發的匯入，其 cumulative 已包含所有子匯入
+        if not name[1:].startswith(" ") and name.strip().split(".")[0] == PACKAGE:
+            total += int(cumulative_us)
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return total / 1000, modules
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", "500")))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="列出 self 時間最長的模組數")
+    parser.add_argument("modules", nargs="*", help="只量測指定的進入點，預設為全部")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules or SCENARIOS:
+        try:
+            runs = [measure(module) for _ in range(max(1, args.repeat))]
+        except RuntimeError as e:
+            print(f"[ERROR] {e}")
+            failed = True
+            continue
+        median = statistics.median(total for total, _ in runs)
+        modules = runs[-1][1]
+        forbidden = sorted(
+            name for name in modules
+            if name.split(".")[0] in SCENARIOS.get(module, ())
+        )
+        ok = median <= args.budget_ms and not forbidden
+        failed |= not ok
+        print(f"[{'OK' if ok else 'FAIL'}] {module}: {median:.1f} ms (budget {args.budget_ms:.0f} ms)")
+        if forbidden:
+            print(f"    loaded heavy modules: {', '.join(sorted({name.split('.')[0] for name in forbidden}))}")
+        slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+        for name, (self_us, cumulative_us) in slowest:
+            print(f"    {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
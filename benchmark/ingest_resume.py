@@ -0,0 +1,49 @@
+"""
+檢查重新匯入：同一份純文字檔匯入兩次，第二次應直接從 journal 取回結果，且與第一次的解析結果相同。
+文字頁面不經過 VLM，只需要設定好向量庫 (例如 VECTOR_TYPE=local 與可用的 embedding 模型)。
+
+用法 (在專案資料夾的上一層執行)：
+    python -m src.benchmark.ingest_resume
+
+結果不一致時以狀態碼 1 結束。
+"""
+import os
+import sys
+import tempfile
+
+TEXT = """# 匯入檢查
+
+第一段：這是一份用來檢查重新匯入結果的文件，內容不需要經過 VLM。
+
+| 欄位 | 說明 |
+| --- | --- |
+| doc_id | 由檔案內容 hash 決定 |
+| journal | 記錄每一頁的狀態與解析結果 |
+
+第二段：相同內容的檔案重新匯入時，應該直接回傳先前的結果。
+"""
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        # journal 與快取放在暫存目錄，不影響既有的匯入紀錄
+        os.environ["RAG_JOURNAL_PATH"] = os.path.join(directory, "journal.sqlite")
+        os.environ["RAG_EXTRACTION_CACHE_PATH"] = ""
+        path = os.path.join(directory, "ingest_resume.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(TEXT)
+
+        from src.service.RagService import RagService
+        rag = RagService()
+        first_id, first = rag.invoke(path)
+        second_id, second = rag.invoke(path)
+        rag.journal.close()
+
+    ok = first_id == second_id and first == second and any(page for page in first)
+    print(f"[{'OK' if ok else 'FAIL'}] doc_id {first_id} / {second_id}, {len(first)} / {len(second)} pages")
+    if not ok:
+        print(f"    first:  {first}")
+        print(f"    second: {second}")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
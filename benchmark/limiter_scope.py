@@ -0,0 +1,42 @@
+"""
+檢查 VLM 的並行數控制範圍：解析頁面時的 VLM 請求會經過 AdaptiveLimiter，
+之後對同一 host 的 'chat' (LLM) 呼叫不應再經過該 limiter，也不應把延遲回饋給它。
+不會實際送出請求，只需要能建立 chat 與 vision service (LLM_* / VLM_* 設定)。
+
+用法 (在專案資料夾的上一層執行)：
+    python -m src.benchmark.limiter_scope
+
+chat 呼叫仍受 limiter 影響時以狀態碼 1 結束。
+"""
+import os
+import sys
+
+def main() -> int:
+    from src.component.utils.Concurrency import get_limiter
+    from src.component.utils.Resilience import limit_calls
+    from src.service import Service
+
+    vision = Service().get_service('vision')
+    llm = Service().get_service('chat')
+    # 與 RagService._get_vlm_limiter 相同的 limiter
+    limiter = get_limiter(vision.host, os.getenv("VLM_TYPE", "openai").lower())
+
+    in_flight: dict[str, int] = {}
+    def record(name: str) -> str:
+        in_flight[name] = limiter.in_flight
+        return name
+
+    with limit_calls(limiter):
+        vision.resilience.call(record, "vision")
+    # 解析完頁面後的狀態；之後的 chat 呼叫不應改變 limiter 的基準延遲與上限
+    after_ingest = (limiter.baseline, limiter.limit)
+    llm.resilience.call(record, "chat")
+    after_chat = (limiter.baseline, limiter.limit)
+
+    ok = in_flight["vision"] > 0 and in_flight["chat"] == 0 and after_chat == after_ingest
+    print(f"[{'OK' if ok else 'FAIL'}] vision in flight {in_flight['vision']}, chat in flight {in_flight['chat']}, "
+          f"limiter (baseline, limit) {after_ingest} -> {after_chat}")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
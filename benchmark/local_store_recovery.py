@@ -0,0 +1,84 @@
+"""
+檢查本地向量庫 (VECTOR_TYPE=local) 的 upsert 在中斷後不會遺失資料，以及同一批中重複的 pageId 只留下一列。
+以例外模擬在 meta 寫入前後中斷的行程，再從磁碟重新載入 collection 檢查結果，不需要 embedding 模型。
+
+用法 (在專案資料夾的上一層執行)：
+    python -m src.benchmark.local_store_recovery
+
+任一項檢查失敗時以狀態碼 1 結束。
+"""
+import os
+import sys
+import tempfile
+from uuid import uuid4
+
+import numpy as np
+
+class Crash(Exception):
+    """模擬行程在此中斷"""
+
+def crash(*args, **kwargs):
+    raise Crash()
+
+def main() -> int:
+    from src.component.typing.vectorbase import Document
+    from src.service.VectorService.LocalVectorService import LocalCollection
+
+    def document(doc_id, page_id, content: str) -> Document:
+        return Document(docId=doc_id, pageId=page_id, content=content, metadata={})
+
+    def alive(collection: LocalCollection, page_id) -> list[str]:
+        return [
+            collection._read_record(int(row))["content"]
+            for row in np.flatnonzero(collection.alive[:collection.count])
+            if collection.page_ids[row].tobytes() == page_id.bytes
+        ]
+
+    rng = np.random.default_rng(0)
+    doc_id, page_id = uuid4(), uuid4()
+    results: dict[str, list[str]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # meta 寫入前中斷：新列不生效，舊資料仍在
+        path = os.path.join(directory, "before_meta")
+        collection = LocalCollection(path)
+        collection.upsert([document(doc_id, page_id, "v1")], rng.normal(size=(1, 8)))
+        collection._save_meta = crash
+        try:
+            collection.upsert([document(doc_id, page_id, "v2")], rng.normal(size=(1, 8)))
+        except Crash:
+            pass
+        collection.close()
+        results["crash before meta"] = alive(LocalCollection(path), page_id)
+
+        # meta 寫入後、舊列標記刪除前中斷：重新載入時只保留新列
+        path = os.path.join(directory, "after_meta")
+        collection = LocalCollection(path)
+        collection.upsert([document(doc_id, page_id, "v1")], rng.normal(size=(1, 8)))
+        collection._kill = crash
+        try:
+            collection.upsert([document(doc_id, page_id, "v2")], rng.normal(size=(1, 8)))
+        except Crash:
+            pass
+        collection.close()
+        results["crash after meta"] = alive(LocalCollection(path), page_id)
+
+        # 同一批中重複的 pageId
+        path = os.path.join(directory, "duplicates")
+        collection = LocalCollection(path)
+        collection.upsert(
+            [document(doc_id, page_id, "first"), document(doc_id, uuid4(), "other"), document(doc_id, page_id, "last")],
+            rng.normal(size=(3, 8))
+        )
+        collection.close()
+        results["duplicate pageId in batch"] = alive(LocalCollection(path), page_id)
+
+    expected = {"crash before meta": ["v1"], "crash after meta": ["v2"], "duplicate pageId in batch": ["last"]}
+    failed = False
+    for name, rows in results.items():
+        ok = rows == expected[name]
+        failed |= not ok
+        print(f"[{'OK' if ok else 'FAIL'}] {name}: alive {rows}, expected {expected[name]}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
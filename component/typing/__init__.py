@@ -1,12 +1,40 @@
+from typing import TYPE_CHECKING
 from pydantic import BaseModel
-from .llmbase import *
-from .vectorbase import *
-from .fileManagebase import *
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from .llmbase import ToolCall, ToolCallFunction, Function, Parameters, llmConfig, BaseChatService
+    from .vectorbase import Document, InsertResult, reciprocal_rank_fusion, bootstrapped, BaseVectorService
+    from .fileManagebase import ImageEncodeConfig, TextPage, BaseFileManageService
+
 # Load environment variables
 load_dotenv('config/.env')
 
+_exports = {
+    "ToolCall": ".llmbase",
+    "ToolCallFunction": ".llmbase",
+    "Function": ".llmbase",
+    "Parameters": ".llmbase",
+    "llmConfig": ".llmbase",
+    "BaseChatService": ".llmbase",
+    "Document": ".vectorbase",
+    "InsertResult": ".vectorbase",
+    "reciprocal_rank_fusion": ".vectorbase",
+    "bootstrapped": ".vectorbase",
+    "BaseVectorService": ".vectorbase",
+    "ImageEncodeConfig": ".fileManagebase",
+    "TextPage": ".fileManagebase",
+    "BaseFileManageService": ".fileManagebase",
+}
+
+def __getattr__(name: str):
+    # 延遲載入，只用到 WebService 或向量庫時不會載入 openai / ollama / PIL
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    return getattr(import_module(module, __name__), name)
+
 class SerpApiConfig(BaseModel):
     q:str
     api_key:str
@@ -21,4 +49,4 @@ class SerpResult(BaseModel):
     snippet:str
     position:int
 
-searchResultType = list[SerpResult]
\ No newline at end of file
+searchResultType = list[SerpResult]
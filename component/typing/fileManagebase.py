@@ -2,8 +2,26 @@ from abc import ABC, abstractmethod
 import base64
 from io import BytesIO
 import os
-from typing import Union
-from PIL.Image import Image,open as open_image
+from typing import Container, Iterator, Literal, Union
+from PIL.Image import Image, Resampling, open as open_image
+from pydantic import BaseModel, Field
+
+class ImageEncodeConfig(BaseModel):
+    format: Literal["PNG", "JPEG", "WEBP"] = "PNG"
+    quality: int = 85
+    max_edge: int | None = None
+    grayscale: bool = False
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{self.format.lower()}"
+
+class TextPage(BaseModel):
+    """
+    從 PDF 文字層或純文字檔直接取得的頁面內容，不需要渲染也不需要 VLM
+    """
+    paragraphs: list[str] = Field(default_factory=list)
+    tables: list[str] = Field(default_factory=list)  # markdown 表格
 
 class BaseFileManageService(ABC):
     
@@ -12,11 +30,36 @@ class BaseFileManageService(ABC):
         if not self.soffice_path:
             raise ValueError("SOFFICE_PATH is not set, please set it in the environment variables.")
         self.images:list[Image] = []
+        self.image_config = ImageEncodeConfig(
+            format=os.getenv("IMAGE_ENCODE_FORMAT", "PNG").upper(),
+            quality=int(os.getenv("IMAGE_ENCODE_QUALITY", "85")),
+            max_edge=int(os.getenv("IMAGE_MAX_EDGE", "0")) or None,
+            grayscale=os.getenv("IMAGE_GRAYSCALE", "false").lower() in ("1", "true", "yes")
+        )
     
     @abstractmethod
     def file_to_image(self,input_file: str) -> None:
         pass
 
+    def iter_images(self, input_file: str) -> Iterator[Image]:
+        """
+        逐頁取得檔案轉出的圖片，已交出的頁面不再由本物件持有
+        """
+        self.file_to_image(input_file)
+        images, self.images = self.images, []
+        images.reverse()
+        while images:
+            yield images.pop()
+
+    def iter_pages(self, input_file: str, skip: Container[int] = ()) -> Iterator[tuple[int, Image | TextPage]]:
+        """
+        逐頁回傳 (從 0 開始的頁碼, 圖片)，skip 中的頁碼不回傳；子類別可覆寫以完全不渲染這些頁面，
+        或對可直接取得文字的頁面回傳 TextPage
+        """
+        for idx, image in enumerate(self.iter_images(input_file)):
+            if idx not in skip:
+                yield idx, image
+
     def get_images(self) -> list[Image]:
         try:
             return self.images
@@ -26,20 +69,41 @@ class BaseFileManageService(ABC):
         finally:
             self.images = []
     
-    def get_base64_list(self) -> list[str]:
+    def get_base64_list(self, config: ImageEncodeConfig | None = None) -> Iterator[str]:
+        """
+        逐張將圖片編碼成 base64，呼叫端迭代時才進行編碼
+        """
         if not self.images:
             raise ValueError("Images Not Found Error: Please use file_to_image first!!!")
-        image_b64_list = []
-        for idx, img in enumerate(self.images):
-            b64 = self.parse_Image_to_base64(img)
-            image_b64_list.append(b64)
-        return image_b64_list
+        return (self.parse_Image_to_base64(img, config) for img in self.images)
+
+    def _prepare_image(self, image: Image, config: ImageEncodeConfig) -> Image:
+        if config.max_edge and max(image.size) > config.max_edge:
+            scale = config.max_edge / max(image.size)
+            image = image.resize(
+                (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                Resampling.LANCZOS
+            )
+        if config.grayscale:
+            return image.convert("L")
+        if config.format == "JPEG" and image.mode not in ("RGB", "L"):
+            return image.convert("RGB")
+        if config.format == "WEBP" and image.mode not in ("RGB", "RGBA", "L"):
+            return image.convert("RGBA" if "A" in image.mode else "RGB")
+        return image
 
-    def parse_Image_to_base64(self, image:Image) -> str:
+    def parse_Image_to_base64(self, image:Image, config: ImageEncodeConfig | None = None) -> str:
+        config = config or self.image_config
+        image = self._prepare_image(image, config)
         buf = BytesIO()
-        image.save(buf, format="PNG")
-        buf.seek(0)
-        return base64.b64encode(buf.getvalue()).decode("utf-8")
+        if config.format == "PNG":
+            image.save(buf, format="PNG")
+        else:
+            image.save(buf, format=config.format, quality=config.quality)
+        return base64.b64encode(buf.getbuffer()).decode("ascii")
+
+    def get_data_url(self, b64: str, config: ImageEncodeConfig | None = None) -> str:
+        return f"data:{(config or self.image_config).mime_type};base64,{b64}"
     
     def parse_base64_to_Image(self, b64:str) -> Image:
         return open_image(BytesIO(base64.decodebytes(b64.encode("utf-8"))))
@@ -1,11 +1,14 @@
+import asyncio
 import base64
 from io import BytesIO
+import httpx
 from ollama import Image
 from pydantic import BaseModel
-from typing import Literal
+from typing import AsyncIterator, Iterator, Literal
 from abc import ABC, abstractmethod
 from openai.types.chat import (
     ChatCompletion,
+    ChatCompletionChunk,
     ChatCompletionMessageParam,
     ChatCompletionToolParam,
     ChatCompletionMessage,
@@ -13,6 +16,12 @@ from openai.types.chat import (
 )
 from openai.types.chat.chat_completion_message_tool_call import Function as FunctionParam
 from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import (
+    Choice as ChunkChoice,
+    ChoiceDelta,
+    ChoiceDeltaToolCall,
+    ChoiceDeltaToolCallFunction
+)
 from openai.types import CompletionUsage
 from ollama._types import Message,Tool,ChatResponse
 from datetime import datetime
@@ -174,6 +183,134 @@ class BaseChatService(ABC):
             )
         )
 
+    def _parse_stream_response(
+        self,
+        response:ChatResponse,
+        completion_id:str,
+        created:int,
+        tool_index:int = 0,
+        has_tool_calls:bool = False,
+        first:bool = False
+    ) -> ChatCompletionChunk:
+        """
+        將 Ollama stream=True 回傳的片段轉成 OpenAI 相容的 ChatCompletionChunk，
+        tool_index 為此片段第一個 tool call 在整個串流中的序號，has_tool_calls 表示先前片段已出現 tool call
+        """
+        message = response.message
+        tool_calls = [
+            ChoiceDeltaToolCall(
+                index=tool_index + idx,
+                id=tool.id,
+                type="function",
+                function=ChoiceDeltaToolCallFunction(
+                    name=tool.function.name,
+                    arguments=tool.function.arguments
+                )
+            )
+            for idx, tool in enumerate(self._parse_tool_calls(message.tool_calls))
+        ]
+        finish_reason = None
+        if response.done:
+            if has_tool_calls or tool_calls:
+                finish_reason = "tool_calls"
+            elif response.done_reason == "length":
+                finish_reason = "length"
+            else:
+                finish_reason = "stop"
+        usage = None
+        if response.done:
+            usage = CompletionUsage(
+                prompt_tokens=response.prompt_eval_count or 0,
+                completion_tokens=response.eval_count or 0,
+                total_tokens=(response.prompt_eval_count or 0) + (response.eval_count or 0)
+            )
+        return ChatCompletionChunk(
+            id=completion_id,
+            choices=[
+                ChunkChoice(
+                    index=0,
+                    delta=ChoiceDelta(
+                        role="assistant" if first else None,
+                        content=message.content or None,
+                        tool_calls=tool_calls or None
+                    ),
+                    finish_reason=finish_reason
+                )
+            ],
+            created=created,
+            model=response.model,
+            object="chat.completion.chunk",
+            usage=usage
+        )
+
+    def _parse_completion_chunk(self, completion:ChatCompletion) -> ChatCompletionChunk:
+        """
+        將完整的 ChatCompletion 轉成單一 ChatCompletionChunk，供不支援串流的後端使用
+        """
+        choices = []
+        for choice in completion.choices:
+            tool_calls = [
+                ChoiceDeltaToolCall(
+                    index=idx,
+                    id=tool.id,
+                    type="function",
+                    function=ChoiceDeltaToolCallFunction(
+                        name=tool.function.name,
+                        arguments=tool.function.arguments
+                    )
+                )
+                for idx, tool in enumerate(choice.message.tool_calls or [])
+            ]
+            choices.append(
+                ChunkChoice(
+                    index=choice.index,
+                    delta=ChoiceDelta(
+                        role=choice.message.role,
+                        content=choice.message.content,
+                        tool_calls=tool_calls or None
+                    ),
+                    finish_reason=choice.finish_reason
+                )
+            )
+        return ChatCompletionChunk(
+            id=completion.id,
+            choices=choices,
+            created=completion.created,
+            model=completion.model,
+            object="chat.completion.chunk",
+            usage=completion.usage
+        )
+
+    def _get_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        )
+
+    def close(self) -> None:
+        """
+        關閉 client 持有的連線池
+        """
+        pass
+
     @abstractmethod
     def chat(self, prompt:list[ChatCompletionMessageParam], tools:list[ChatCompletionToolParam] | None = None) -> ChatCompletion:
         pass
+
+    async def achat(self, prompt:list[ChatCompletionMessageParam], tools:list[ChatCompletionToolParam] | None = None) -> ChatCompletion:
+        """
+        非同步版本的 chat，子類別沒有原生實作時改在執行緒中呼叫 chat
+        """
+        return await asyncio.to_thread(self.chat, prompt, tools)
+
+    def chat_stream(self, prompt:list[ChatCompletionMessageParam], tools:list[ChatCompletionToolParam] | None = None) -> Iterator[ChatCompletionChunk]:
+        """
+        串流版本的 chat，逐段回傳 ChatCompletionChunk，子類別沒有原生實作時回傳單一片段
+        """
+        yield self._parse_completion_chunk(self.chat(prompt, tools))
+
+    async def achat_stream(self, prompt:list[ChatCompletionMessageParam], tools:list[ChatCompletionToolParam] | None = None) -> AsyncIterator[ChatCompletionChunk]:
+        """
+        非同步串流版本的 chat
+        """
+        yield self._parse_completion_chunk(await self.achat(prompt, tools))
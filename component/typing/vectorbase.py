@@ -1,10 +1,15 @@
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 import json
 import os
-from typing import Literal
-from uuid import UUID
+import threading
+from typing import Any, Iterator, Literal
+from uuid import UUID, uuid4
 from pydantic import BaseModel
 
+_config_lock = threading.Lock()
+
 
 class Document(BaseModel):
     docId: UUID
@@ -12,6 +17,43 @@ class Document(BaseModel):
     content:str
     metadata: dict
 
+class InsertResult(BaseModel):
+    ids: list[UUID | None]
+    errors: dict[int, str] = {}
+
+    @property
+    def inserted(self) -> int:
+        return len(self.ids) - len(self.errors)
+
+def reciprocal_rank_fusion(
+    rankings: list[list[Document]],
+    weights: list[float] | None = None,
+    k: int = 60,
+    limit: int | None = None
+) -> list[Document]:
+    """
+    Reciprocal Rank Fusion：每份排名中第 r 名得到 weight / (k + r) 分，同一個 pageId 的分數相加後排序，結果不重複
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores: dict[UUID, float] = {}
+    documents: dict[UUID, Document] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc.pageId] = scores.get(doc.pageId, 0.0) + weight / (k + rank)
+            documents.setdefault(doc.pageId, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [documents[pageId] for pageId in ordered[:limit]]
+
+def bootstrapped(method):
+    """
+    需要連線與 collection 的方法在第一次呼叫時才執行 _bootstrap，建構 service 本身不做任何 I/O
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._ensure_ready()
+        return method(self, *args, **kwargs)
+    return wrapper
+
 class BaseVectorService(ABC):
     def __init__(self) -> None:
         self.types = os.getenv("VECTOR_TYPE","weaviate").lower()
@@ -27,28 +69,220 @@ class BaseVectorService(ABC):
             with open(self.config_path, "w") as f:
                 json.dump({}, f)
         self.headers = self._get_headers()
-        self.is_need_recreate = self._check_config_state()
+        self.config = self._load_config()
         self.table_database_name = "TableCollection"
         self.image_database_name = "ImageCollection"
         self.label_database_name = "LabelCollection"
+        self.collections = [self.table_database_name, self.image_database_name, self.label_database_name]
+        self._ready = False
+        self._bootstrapping = False
+        self._bootstrap_lock = threading.RLock()
         os.environ["OPENAI_API_KEY"] = self.api_key
     
     def _save_config(self, data: dict):
-        with open(self.config_path, "w") as f:
-            json.dump(data, f)
+        # 先寫暫存檔再取代，遷移進度與 collection 切換不會因中斷而寫壞設定檔
+        with _config_lock:
+            tmp = f"{self.config_path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.config_path)
     
-    def _check_config_state(self) -> bool:
-        if not os.path.exists(self.config_path):
-            return True
+    def _load_config(self) -> dict:
+        """
+        讀取設定檔；模型是否變更由 _prepare_collections 比對 vector_config_* 判斷
+        """
         with open(self.config_path, "r") as f:
-            self.config = json.load(f)
-            if not self.config.get(self.types):
-                self.config[self.types] = {}
-                return False
-            return (
-                self.config.get(self.types,{}).get("vector_config_type") != self.model_type
-                or self.config.get(self.types,{}).get("vector_config_model") != self.model
-            )
+            config = json.load(f)
+        config.setdefault(self.types, {})
+        return config
+    
+    def _ensure_ready(self):
+        """
+        只執行一次 _bootstrap；同一執行緒在 bootstrap 中再次呼叫 (例如建立 collection) 時直接返回，其他執行緒等待完成
+        """
+        if self._ready:
+            return
+        with self._bootstrap_lock:
+            if self._ready or self._bootstrapping:
+                return
+            self._bootstrapping = True
+            try:
+                self._bootstrap()
+                self._ready = True
+            finally:
+                self._bootstrapping = False
+    
+    def _bootstrap(self):
+        """
+        第一次使用時的初始化：檢查並建立 collection、必要時開始遷移
+        """
+        self._prepare_collections()
+    
+    def _embedding_dimension(self, model_type: str, model: str | None, compute) -> int:
+        """
+        向量維度存在設定檔中，建立 collection 時不必每次都呼叫模型計算
+        """
+        dimensions = self.config.setdefault(self.types, {}).setdefault("dimensions", {})
+        key = f"{model_type}:{model or ''}"
+        if not dimensions.get(key):
+            dimensions[key] = int(compute())
+            self._save_config(self.config)
+        return dimensions[key]
+    
+    def _invalidate_embedding_cache(self, model_type: str | None, model: str | None):
+        """
+        模型變更後清除舊模型的向量快取
+        """
+        from src.component.utils.EmbeddingCache import get_embedding_cache
+        try:
+            get_embedding_cache().invalidate(model_type or "", model or "")
+        except Exception as e:
+            print(f"Failed to invalidate embedding cache: {e}")
+    
+    def _collection_name(self, name: str) -> str:
+        """
+        邏輯 collection 名稱 (TableCollection 等) 對應的實際 collection，遷移切換後指向新的 collection
+        """
+        return self.config.get(self.types, {}).get("collections", {}).get(name, name)
+    
+    def _migration(self) -> dict | None:
+        return self.config.get(self.types, {}).get("migration")
+    
+    def _write_targets(self, name: str) -> list[str]:
+        """
+        寫入時的實際 collection，遷移期間同時寫入目前的 collection 與 shadow collection
+        """
+        targets = [self._collection_name(name)]
+        migration = self._migration()
+        shadow = (migration or {}).get("collections", {}).get(name, {}).get("shadow")
+        if shadow and shadow not in targets:
+            targets.append(shadow)
+        return targets
+    
+    def _model_for(self, physical: str) -> tuple[str, str | None]:
+        """
+        寫入或查詢實際 collection 時應使用的 (model_type, model)：遷移完成前，舊 collection 仍使用舊模型
+        """
+        migration = self._migration()
+        section = self.config.get(self.types, {})
+        if migration is None or "vector_config_type" not in section:
+            return self.model_type, self.model
+        shadows = {state["shadow"] for state in migration["collections"].values()}
+        if physical in shadows:
+            return self.model_type, self.model
+        return section["vector_config_type"], section.get("vector_config_model")
+    
+    def _migration_target(self) -> dict[str, Any]:
+        """
+        目前設定對應的 collection 版本，與設定檔中 vector_config_* 不同時需要遷移
+        """
+        return {"type": self.model_type, "model": self.model}
+    
+    def _prepare_collections(self):
+        """
+        建立缺少的 collection；模型或 collection 格式變更時在背景串流遷移，不在啟動時整批備份重建
+        """
+        for collection in self.collections:
+            self.create_collection(collection, exist_ok=True)
+        section = self.config.setdefault(self.types, {})
+        target = self._migration_target()
+        changed = any(section.get(f"vector_config_{key}") != value for key, value in target.items())
+        if self._migration() is not None or ("vector_config_type" in section and changed):
+            self.start_migration()
+            return
+        section.update({f"vector_config_{key}": value for key, value in target.items()})
+        self._save_config(self.config)
+    
+    def _scan_collection(self, physical: str, cursor: Any, batch_size: int) -> Iterator[tuple[list[Document], Any]]:
+        """
+        以游標分頁讀取實際 collection，回傳 (這一頁的文件, 下一頁的游標)，游標需可存成 JSON
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming migration")
+    
+    def _drop_collection(self, physical: str):
+        """
+        刪除實際 collection (不經過名稱對應)
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming migration")
+    
+    def start_migration(self, background: bool | None = None):
+        """
+        開始 (或續傳) 遷移，VECTOR_MIGRATION_BACKGROUND 為 true (預設) 時在背景執行緒進行，遷移期間仍以舊 collection 提供搜尋
+        """
+        if background is None:
+            background = os.getenv("VECTOR_MIGRATION_BACKGROUND", "true").lower() in ("1", "true", "yes")
+        if not background:
+            self.migrate()
+            return
+        thread = getattr(self, "_migration_thread", None)
+        if thread is not None and thread.is_alive():
+            return
+        self._migration_thread = threading.Thread(target=self.migrate, name=f"{self.types}-migration", daemon=True)
+        self._migration_thread.start()
+    
+    def migrate(self):
+        """
+        串流遷移：以游標分頁讀取目前的 collection，批次用新模型寫入 shadow collection，每批完成後把游標存入設定檔。
+        全部複製完成後一次寫入設定檔切換 collection 對應 (原子操作)，再刪除舊 collection。中斷後重新啟動會從游標續傳。
+        """
+        section = self.config.setdefault(self.types, {})
+        target = self._migration_target()
+        migration = section.get("migration")
+        if migration is None or migration.get("target") != target:
+            suffix = uuid4().hex[:8]
+            migration = {
+                "target": target,
+                "collections": {
+                    name: {"shadow": f"{name}_{suffix}", "cursor": None, "copied": 0, "done": False}
+                    for name in self.collections
+                }
+            }
+            section["migration"] = migration
+            self._save_config(self.config)
+        batch_size = int(os.getenv("VECTOR_MIGRATION_BATCH_SIZE", "256"))
+        try:
+            for name, state in migration["collections"].items():
+                self.create_collection(state["shadow"], exist_ok=True)
+                if state["done"]:
+                    continue
+                source = self._collection_name(name)
+                print(f"migrating {source} -> {state['shadow']} from cursor {state['cursor']}")
+                for documents, cursor in self._scan_collection(source, state["cursor"], batch_size):
+                    result = self.insert_many(documents, state["shadow"], batch_size)
+                    if result.errors:
+                        raise RuntimeError(f"Failed to migrate {len(result.errors)} objects of {source}: {next(iter(result.errors.values()))}")
+                    state["cursor"] = cursor
+                    state["copied"] += len(documents)
+                    self._save_config(self.config)
+                    print(f"migrated {state['copied']} objects of {source}")
+                state["done"] = True
+                self._save_config(self.config)
+        except Exception as e:
+            print(f"Migration stopped, it will resume from the saved cursor on next start: {e}")
+            return
+        old = {name: self._collection_name(name) for name in migration["collections"]}
+        old_model = (section.get("vector_config_type"), section.get("vector_config_model"))
+        section.setdefault("collections", {}).update({name: state["shadow"] for name, state in migration["collections"].items()})
+        section.update({f"vector_config_{key}": value for key, value in target.items()})
+        section.pop("migration", None)
+        self._save_config(self.config)
+        print(f"switched {self.types} collections to {section['collections']}")
+        if old_model != (self.model_type, self.model):
+            self._invalidate_embedding_cache(*old_model)
+        for physical in old.values():
+            try:
+                self._drop_collection(physical)
+            except Exception as e:
+                print(f"Failed to drop old collection {physical}: {e}")
+    
+    def migration_progress(self) -> dict | None:
+        """
+        遷移進度，沒有進行中的遷移時回傳 None
+        """
+        migration = self._migration()
+        if migration is None:
+            return None
+        return {name: {"copied": state["copied"], "done": state["done"]} for name, state in migration["collections"].items()}
     
     def _get_headers(self) -> dict | None:
         if self.model_type == "openai":
@@ -73,20 +307,69 @@ class BaseVectorService(ABC):
         """
         pass
     
-    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"]="multi", limit: int=3) -> list[Document]:
+    def insert_many(self, data: list[Document], collection_name: str, batch_size: int = 100) -> InsertResult:
+        """
+        Insert many documents into the vector collection
+        Args:
+            data: The documents to insert
+            collection_name: The name of the collection to insert into
+            batch_size: The number of documents sent per request
+        Returns:
+            InsertResult with the assigned id of each document (None if failed) and errors keyed by document index
+        """
+        ids: list[UUID | None] = []
+        errors: dict[int, str] = {}
+        for idx, doc in enumerate(data):
+            try:
+                uid = self.insert(doc, collection_name)
+                ids.append(uid if isinstance(uid, UUID) else doc.pageId)
+            except Exception as e:
+                ids.append(None)
+                errors[idx] = str(e)
+        return InsertResult(ids=ids, errors=errors)
+    
+    def warm_up(self):
+        """
+        ENCODER_WARM_UP 開啟時預先載入 embedding 模型並送出一次請求，讓第一個查詢不必等待模型載入；
+        由伺服器端向量化的後端 (prepare_embeddings 不做事) 不受影響
+        """
+        if os.getenv("ENCODER_WARM_UP", "false").lower() in ("1", "true", "yes"):
+            self.prepare_embeddings(["warm up"])
+    
+    def prepare_embeddings(self, texts: list[str]):
+        """
+        Pre-compute embeddings of texts that are about to be inserted, so the following insert hits the embedding cache.
+        Backends that vectorize on the server side do nothing.
+        """
+        pass
+    
+    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"]="multi", limit: int=3, alpha: float=0.5) -> list[Document]:
         """
         Search the vector collection
         Args:
             query: The query to search for
             collection_name: The name of the collection to search in
-            mode: The mode to use for the search, "bm25" for BM25, "similarity" for similarity search, "multi" for both
-            limit: The limit of the search, default is 3, if used multi mode, the limit is the limit of each mode
+            mode: The mode to use for the search, "bm25" for BM25, "similarity" for similarity search, "multi" for hybrid search fusing both
+            limit: The limit of the search, default is 3
+            alpha: The weight of similarity search in multi mode, 0 is pure BM25 and 1 is pure similarity
         Returns:
-            A list of documents
+            A list of documents without duplicates
         can be used collection names are [TableCollection, ImageCollection, LabelCollection]
         """
         pass
     
+    def hybrid_search(self, query: str, collection_name: str, limit: int=3, alpha: float=0.5) -> list[Document]:
+        """
+        Hybrid search for backends without a native hybrid query: run bm25 and similarity search concurrently
+        and fuse them with weighted Reciprocal Rank Fusion, deduplicated by pageId
+        """
+        candidates = max(limit * 4, 20)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            lexical = executor.submit(self.search_knowledge, query, collection_name, "bm25", candidates)
+            semantic = executor.submit(self.search_knowledge, query, collection_name, "similarity", candidates)
+            rankings = [lexical.result(), semantic.result()]
+        return reciprocal_rank_fusion(rankings, weights=[1 - alpha, alpha], limit=limit)
+    
     def update(self, data: Document, collection_name: str):
         """
         Update data in the vector collection
@@ -115,4 +398,10 @@ class BaseVectorService(ABC):
         """
         List all collections
         """
+        pass
+    
+    def close(self):
+        """
+        Release connections held by the vector service
+        """
         pass
\ No newline at end of file
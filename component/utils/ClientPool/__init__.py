@@ -0,0 +1,40 @@
+import asyncio
+import threading
+import weakref
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple, Any]]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+def get_async_client(key: tuple, factory: Callable[[], T]) -> T:
+    """
+    取得目前 event loop 上以 key (通常是 backend 與 host) 共用的非同步 client，
+    同一個 loop 內同一個 host 只會有一個 HTTP 連線池。
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = factory()
+            clients[key] = client
+        return client
+
+async def close_async_clients() -> None:
+    """
+    關閉目前 event loop 上所有共用的非同步 client
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.pop(loop, {})
+    for client in clients.values():
+        close = getattr(client, "close", None) or getattr(client, "aclose", None)
+        if close is None:
+            inner = getattr(client, "_client", None)
+            close = getattr(inner, "aclose", None)
+        if close is not None:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
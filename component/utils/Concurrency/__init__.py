@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from ..Resilience import is_rate_limited
+
+class AdaptiveLimiter:
+    """
+    AIMD 並行數控制：請求成功且延遲正常時每個 RTT 約加 1，遇到 429、逾時或延遲暴增時乘以 backoff_ratio。
+    可再搭配一個行程共用的 global semaphore，讓同時處理的多份文件共享總上限。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int = 2,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        latency_tolerance: float = 2.0,
+        backoff_ratio: float = 0.5,
+        global_limit: threading.BoundedSemaphore | None = None
+    ) -> None:
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.global_limit = global_limit
+        self.in_flight = 0
+        self.baseline: float | None = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def acquire(self) -> None:
+        with self.condition:
+            while self.in_flight >= self.current_limit:
+                self.condition.wait()
+            self.in_flight += 1
+        if self.global_limit is not None:
+            self.global_limit.acquire()
+
+    def release(self, latency: float, error: BaseException | None = None) -> None:
+        if self.global_limit is not None:
+            self.global_limit.release()
+        with self.condition:
+            self.in_flight -= 1
+            overloaded = error is not None and (is_rate_limited(error) or isinstance(error, TimeoutError))
+            if error is None:
+                # 以緩慢回升的最小延遲作為基準，避免一次偶發的快速回應把基準壓得太低
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline = self.baseline * 0.95 + latency * 0.05
+                overloaded = latency > self.baseline * self.latency_tolerance
+            now = time.monotonic()
+            if overloaded:
+                # 同一個 RTT 內只降一次，避免一批同時失敗的請求把上限瞬間壓到最低
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                    self.last_decrease = now
+                    print(f"{self.name} concurrency decreased to {self.current_limit}")
+            elif error is None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(time.monotonic() - start, e)
+            raise
+        self.release(time.monotonic() - start)
+
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+_global_limit: threading.BoundedSemaphore | None = None
+_lock = threading.Lock()
+
+DEFAULT_CONCURRENCY: dict[str, tuple[int, int]] = {
+    # backend: (initial, max)
+    "ollama": (1, 4),
+    "openai": (4, 32),
+}
+
+def get_limiter(host: str | None, backend: str = "openai") -> AdaptiveLimiter:
+    """
+    取得 host 共用的 AdaptiveLimiter，初始值與上限依後端預設，可由 VLM_CONCURRENCY、
+    VLM_MAX_CONCURRENCY 覆寫，所有 host 共享 VLM_GLOBAL_CONCURRENCY 的總上限
+    """
+    global _global_limit
+    key = host or backend
+    with _lock:
+        if _global_limit is None:
+            _global_limit = threading.BoundedSemaphore(int(os.getenv("VLM_GLOBAL_CONCURRENCY", "32")))
+        limiter = _limiters.get(key)
+        if limiter is None:
+            initial, maximum = DEFAULT_CONCURRENCY.get(backend, DEFAULT_CONCURRENCY["openai"])
+            limiter = AdaptiveLimiter(
+                key,
+                initial=int(os.getenv("VLM_CONCURRENCY", str(initial))),
+                max_limit=int(os.getenv("VLM_MAX_CONCURRENCY", str(maximum))),
+                global_limit=_global_limit
+            )
+            _limiters[key] = limiter
+        return limiter
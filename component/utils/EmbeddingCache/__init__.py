@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from hashlib import sha256
+import os
+import sqlite3
+import threading
+from typing import Iterable
+
+import numpy as np
+
+CacheKey = tuple[str, str, str]
+
+class EmbeddingCache:
+    """
+    以 (model_type, model, sha256(text)) 為鍵的向量快取，分為記憶體 LRU 與 SQLite 磁碟兩層。
+    """
+
+    def __init__(self, path: str | None = None, max_items: int = 10000) -> None:
+        self.path = path
+        self.max_items = max(0, max_items)
+        self.memory: OrderedDict[CacheKey, np.ndarray] = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.conn: sqlite3.Connection | None = None
+        if self.path:
+            self._connect()
+
+    def _connect(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_type TEXT NOT NULL,
+                model TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model_type, model, digest)
+            )
+            """
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(model_type: str, model: str | None, text: str) -> CacheKey:
+        return (model_type or "", model or "", sha256(text.encode("utf-8")).hexdigest())
+
+    def _remember(self, key: CacheKey, vector: np.ndarray) -> None:
+        if self.max_items == 0:
+            return
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def get(self, model_type: str, model: str | None, text: str) -> np.ndarray | None:
+        return self.get_many(model_type, model, [text])[0]
+
+    def get_many(self, model_type: str, model: str | None, texts: Iterable[str]) -> list[np.ndarray | None]:
+        keys = [self.make_key(model_type, model, text) for text in texts]
+        results: list[np.ndarray | None] = [None] * len(keys)
+        with self.lock:
+            pending: dict[str, list[int]] = {}
+            for idx, key in enumerate(keys):
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                    results[idx] = vector
+                else:
+                    pending.setdefault(key[2], []).append(idx)
+            if pending and self.conn is not None:
+                digests = list(pending.keys())
+                for start in range(0, len(digests), 500):
+                    part = digests[start:start + 500]
+                    rows = self.conn.execute(
+                        f"SELECT digest, vector FROM embeddings WHERE model_type = ? AND model = ? AND digest IN ({','.join('?' * len(part))})",
+                        (model_type or "", model or "", *part)
+                    ).fetchall()
+                    for digest, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember((model_type or "", model or "", digest), vector)
+                        for idx in pending.pop(digest):
+                            self.disk_hits += 1
+                            results[idx] = vector
+            missed = sum(len(indexes) for indexes in pending.values())
+            self.misses += missed
+            self.hits += len(keys) - missed
+        return results
+
+    def put(self, model_type: str, model: str | None, text: str, vector) -> None:
+        self.put_many(model_type, model, [text], [vector])
+
+    def put_many(self, model_type: str, model: str | None, texts: Iterable[str], vectors: Iterable) -> None:
+        rows = []
+        with self.lock:
+            for text, vector in zip(texts, vectors):
+                key = self.make_key(model_type, model, text)
+                array = np.asarray(vector, dtype=np.float32).reshape(-1)
+                self._remember(key, array)
+                rows.append((*key, array.tobytes()))
+            if rows and self.conn is not None:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model_type, model, digest, vector) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self.conn.commit()
+
+    def invalidate(self, model_type: str | None = None, model: str | None = None) -> None:
+        """
+        清除指定模型的快取，兩個參數皆為 None 時清除全部
+        """
+        with self.lock:
+            for key in list(self.memory.keys()):
+                if (model_type is None or key[0] == model_type) and (model is None or key[1] == (model or "")):
+                    del self.memory[key]
+            if self.conn is None:
+                return
+            if model_type is None and model is None:
+                self.conn.execute("DELETE FROM embeddings")
+            elif model is None:
+                self.conn.execute("DELETE FROM embeddings WHERE model_type = ?", (model_type,))
+            elif model_type is None:
+                self.conn.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+            else:
+                self.conn.execute("DELETE FROM embeddings WHERE model_type = ? AND model = ?", (model_type, model))
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_items": len(self.memory)
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+_default_cache: EmbeddingCache | None = None
+_default_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    取得全域共用的向量快取，設定來自 EMBEDDING_CACHE_PATH 與 EMBEDDING_CACHE_SIZE
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache(
+                path=os.getenv("EMBEDDING_CACHE_PATH", "config/embedding_cache.sqlite") or None,
+                max_items=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+            )
+        return _default_cache
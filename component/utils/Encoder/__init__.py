@@ -1,44 +1,74 @@
-from typing import Literal
-from openai import OpenAI
-from ollama import Client as Ollama
-from sentence_transformers import SentenceTransformer
-from torch.cuda import is_available as cuda_available
-from torch.mps import is_available as mps_available
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Literal
+import numpy as np
+
+from .batcher import MicroBatcher
+from ..EmbeddingCache import EmbeddingCache
 
 class Encoder:
-    
+
     def __init__(
-        self, 
-        types: Literal["openai", "huggingface", "ollama"], 
+        self,
+        types: Literal["openai", "huggingface", "ollama"],
         model: str,
         api_key: str | None = None,
-        api_base: str | None = None
+        api_base: str | None = None,
+        max_batch_size: int = 256,
+        max_batch_chars: int = 200_000,
+        micro_batch: bool = False,
+        micro_batch_wait_ms: float = 5.0,
+        max_queue_size: int = 1024,
+        cache: EmbeddingCache | None = None
     ) -> None:
         self.types = types
         self.model = model
         self.api_key = api_key
         self.api_base = api_base
+        self.cache = cache
+        self.lock = threading.Lock()
+        # 進行中的呼叫數；close 時仍有呼叫在使用 MicroBatcher 就延後到最後一個呼叫結束才關閉
+        self._usage_lock = threading.Lock()
+        self._active = 0
+        self._closing = False
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_chars = max(1, max_batch_chars)
         self._initialize_model()
-        
+        self.batcher: MicroBatcher | None = None
+        if micro_batch:
+            self.batcher = MicroBatcher(
+                self._encode_batch_uncached,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=micro_batch_wait_ms,
+                max_queue_size=max_queue_size
+            )
+
     def _set_device(self) -> None:
+        self.device = "cpu"
+        if self.types != "huggingface":
+            return
+        from torch.cuda import is_available as cuda_available
+        from torch.mps import is_available as mps_available
         if cuda_available():
             self.device = "cuda"
             return
         if mps_available():
             self.device = "mps"
-            return
-        self.device = "cpu"
-        
+
     def _initialize_model(self) -> None:
+        # 各後端的套件在建立對應的 Encoder 時才載入，只用 openai / ollama 時不會載入 torch
         self._set_device()
         if self.types == "openai":
+            from openai import OpenAI
             self.client = OpenAI(api_key=self.api_key, base_url=self.api_base)
         if self.types == "huggingface":
+            from sentence_transformers import SentenceTransformer
             self.client = SentenceTransformer(self.model, device=self.device)
         if self.types == "ollama":
+            from ollama import Client as Ollama
             self.client = Ollama(host=self.api_base)
-        
-    
+
+
     def get_sentence_embedding_dimension(self) -> int:
         if self.types == "openai":
             return len(self.client.embeddings.create(input="Hello, world!", model=self.model).data[0].embedding)
@@ -46,12 +76,114 @@ class Encoder:
             return self.client.get_sentence_embedding_dimension() or 0
         if self.types == "ollama":
             return len(self.client.embed(self.model, "Hello, world!").embeddings[0])
-        
+
     def encode(self, data: any) -> list[float]:
         data = str(data)
+        if self.cache is not None:
+            cached = self.cache.get(self.types, self.model, data)
+            if cached is not None:
+                return cached.tolist()
+        vector = self._encode_uncached(data)
+        if self.cache is not None:
+            self.cache.put(self.types, self.model, data, vector)
+        return vector
+
+    @contextmanager
+    def _in_use(self) -> Iterator[None]:
+        with self._usage_lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._usage_lock:
+                self._active -= 1
+                close = self._closing and self._active == 0
+            if close:
+                self._close_batcher()
+
+    def in_use(self) -> bool:
+        with self._usage_lock:
+            return self._active > 0
+
+    def _encode_uncached(self, data: str) -> list[float]:
+        with self._in_use():
+            batcher = self.batcher
+            if batcher is not None:
+                return batcher.submit(data).result().tolist()
+            if self.types == "openai":
+                return self.client.embeddings.create(input=data, model=self.model).data[0].embedding
+            if self.types == "huggingface":
+                with self.lock:
+                    return self.client.encode(data).tolist()
+            if self.types == "ollama":
+                return self.client.embed(self.model, data).embeddings[0]
+
+    def _split_batches(self, data: list[str]) -> Iterator[list[str]]:
+        """
+        依照筆數 (max_batch_size) 與字元數 (max_batch_chars) 上限切分批次
+        """
+        batch: list[str] = []
+        chars = 0
+        for text in data:
+            if batch and (len(batch) >= self.max_batch_size or chars + len(text) > self.max_batch_chars):
+                yield batch
+                batch, chars = [], 0
+            batch.append(text)
+            chars += len(text)
+        if batch:
+            yield batch
+
+    def _encode_chunk(self, data: list[str]) -> list[list[float]]:
         if self.types == "openai":
-            return self.client.embeddings.create(input=data, model=self.model).data[0].embedding
+            response = self.client.embeddings.create(input=data, model=self.model)
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
         if self.types == "huggingface":
-            return self.client.encode(data).tolist()
+            with self.lock:
+                return self.client.encode(data, batch_size=len(data), convert_to_numpy=True)
         if self.types == "ollama":
-            return self.client.embed(self.model, data).embeddings[0]
\ No newline at end of file
+            return self.client.embed(self.model, data).embeddings
+        raise ValueError(f"Unsupported encoder type: {self.types}")
+
+    def _encode_batch_uncached(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        vectors = [
+            np.asarray(self._encode_chunk(batch), dtype=np.float32)
+            for batch in self._split_batches(texts)
+        ]
+        return np.concatenate(vectors, axis=0)
+
+    def encode_batch(self, data: list[any]) -> np.ndarray:
+        """
+        批次向量化，回傳 shape 為 (len(data), dim) 的 float32 陣列
+        """
+        texts = [str(item) for item in data]
+        if self.cache is None or not texts:
+            return self._encode_batch_uncached(texts)
+        cached = self.cache.get_many(self.types, self.model, texts)
+        missing = [idx for idx, vector in enumerate(cached) if vector is None]
+        if missing:
+            computed = self._encode_batch_uncached([texts[idx] for idx in missing])
+            self.cache.put_many(self.types, self.model, [texts[idx] for idx in missing], computed)
+            for idx, vector in zip(missing, computed):
+                cached[idx] = vector
+        return np.stack(cached).astype(np.float32, copy=False)
+
+    def close(self) -> None:
+        """
+        關閉 MicroBatcher；仍有呼叫進行中時延後到它們結束，之後的呼叫改為直接向量化
+        """
+        with self._usage_lock:
+            self._closing = True
+            if self._active > 0:
+                return
+        self._close_batcher()
+
+    def _close_batcher(self) -> None:
+        with self._usage_lock:
+            batcher, self.batcher = self.batcher, None
+        if batcher is not None:
+            batcher.close()
+
+
+from .registry import EncoderRegistry, get_encoder, get_encoder_registry
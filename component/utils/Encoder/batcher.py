@@ -0,0 +1,77 @@
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Full, Queue
+from typing import Callable
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    將不同執行緒同時送入的單筆 encode 請求合併成一次後端批次請求。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[list[str]], np.ndarray],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        max_queue_size: int = 1024
+    ) -> None:
+        self.handler = handler
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.queue: Queue[tuple[str, Future] | None] = Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="encoder-micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str, timeout: float | None = None) -> Future:
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future: Future = Future()
+        try:
+            self.queue.put((text, future), timeout=timeout)
+        except Full:
+            raise TimeoutError("Encoder work queue is full, please retry later.")
+        return future
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(None)
+        self._worker.join()
+
+    def _collect(self, first: tuple[str, Future]) -> tuple[list[tuple[str, Future]], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch, stop = self._collect(item)
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                vectors = self.handler([text for text, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
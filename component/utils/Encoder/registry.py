@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Literal
+
+from ..EmbeddingCache import get_embedding_cache
+
+if TYPE_CHECKING:
+    from . import Encoder
+
+RegistryKey = tuple[str, str, str | None, str | None]
+
+class EncoderRegistry:
+    """
+    行程內共用的 Encoder 登錄表，同一組設定只會載入一次模型或建立一次 HTTP client。
+    """
+
+    def __init__(self, idle_timeout: float = 0, micro_batch: bool = False) -> None:
+        self.idle_timeout = max(0.0, idle_timeout)
+        self.micro_batch = micro_batch
+        self.encoders: dict[RegistryKey, "Encoder"] = {}
+        self.last_used: dict[RegistryKey, float] = {}
+        self.lock = threading.RLock()
+        self._reaper: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def get(
+        self,
+        types: Literal["openai", "huggingface", "ollama"],
+        model: str,
+        api_key: str | None = None,
+        api_base: str | None = None
+    ) -> "Encoder":
+        key = (types, model, api_key, api_base)
+        with self.lock:
+            encoder = self.encoders.get(key)
+            if encoder is None:
+                from . import Encoder
+                encoder = Encoder(
+                    types=types,
+                    model=model,
+                    api_key=api_key,
+                    api_base=api_base,
+                    micro_batch=self.micro_batch,
+                    cache=get_embedding_cache()
+                )
+                self.encoders[key] = encoder
+                self._start_reaper()
+            self.last_used[key] = time.monotonic()
+            return encoder
+
+    def warm_up(
+        self,
+        types: Literal["openai", "huggingface", "ollama"],
+        model: str,
+        api_key: str | None = None,
+        api_base: str | None = None
+    ) -> "Encoder":
+        """
+        啟動時預先載入模型並送出一次請求，讓第一個查詢不必等待模型載入或連線建立
+        """
+        encoder = self.get(types, model, api_key, api_base)
+        encoder.encode_batch(["warm up"])
+        return encoder
+
+    def release_idle(self, max_idle: float | None = None) -> int:
+        """
+        釋放閒置超過 max_idle 秒且沒有呼叫進行中的 Encoder，回傳釋放數量；
+        已取得該 Encoder 的呼叫端仍可繼續使用 (close 會等進行中的呼叫結束)
+        """
+        max_idle = self.idle_timeout if max_idle is None else max_idle
+        if max_idle <= 0:
+            return 0
+        now = time.monotonic()
+        released = []
+        with self.lock:
+            for key, used in list(self.last_used.items()):
+                if now - used >= max_idle and not self.encoders[key].in_use():
+                    released.append(self.encoders.pop(key))
+                    self.last_used.pop(key)
+        for encoder in released:
+            encoder.close()
+        return len(released)
+
+    def clear(self) -> None:
+        with self.lock:
+            encoders = list(self.encoders.values())
+            self.encoders.clear()
+            self.last_used.clear()
+        for encoder in encoders:
+            encoder.close()
+
+    def close(self) -> None:
+        self._stopped.set()
+        self.clear()
+
+    def _start_reaper(self) -> None:
+        if self.idle_timeout <= 0 or self._reaper is not None:
+            return
+        self._reaper = threading.Thread(target=self._reap, name="encoder-idle-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap(self) -> None:
+        interval = max(1.0, self.idle_timeout / 2)
+        while not self._stopped.wait(interval):
+            released = self.release_idle()
+            if released:
+                print(f"released {released} idle encoder(s)")
+
+
+_default_registry: EncoderRegistry | None = None
+_default_lock = threading.Lock()
+
+def get_encoder_registry() -> EncoderRegistry:
+    """
+    取得全域 Encoder 登錄表，設定來自 ENCODER_IDLE_TIMEOUT 與 ENCODER_MICRO_BATCH
+    """
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = EncoderRegistry(
+                idle_timeout=float(os.getenv("ENCODER_IDLE_TIMEOUT", "0")),
+                micro_batch=os.getenv("ENCODER_MICRO_BATCH", "false").lower() in ("1", "true", "yes")
+            )
+        return _default_registry
+
+def get_encoder(
+    types: Literal["openai", "huggingface", "ollama"],
+    model: str,
+    api_key: str | None = None,
+    api_base: str | None = None
+) -> "Encoder":
+    return get_encoder_registry().get(types, model, api_key, api_base)
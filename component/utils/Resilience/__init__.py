@@ -0,0 +1,309 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+# 目前 context 的並行數控制 (AdaptiveLimiter)，只影響 limit_calls 範圍內的呼叫，不會留在 host 共用的 HostResilience 上
+_call_limiter: ContextVar = ContextVar("resilience_limiter", default=None)
+
+@contextmanager
+def limit_calls(limiter) -> Iterator[None]:
+    """
+    範圍內 (同一執行緒或 task) 的同步呼叫每一次嘗試都經過 limiter，429 與延遲能在重試前就回饋給 AIMD；
+    退避等待時不佔名額。同一 host 的其他呼叫 (例如一般對話) 不受影響
+    """
+    token = _call_limiter.set(limiter)
+    try:
+        yield
+    finally:
+        _call_limiter.reset(token)
+
+class CircuitOpenError(RuntimeError):
+    """後端暫時不可用，斷路器開啟中直接失敗"""
+
+def get_status_code(error: BaseException) -> int | None:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_rate_limited(error: BaseException) -> bool:
+    return get_status_code(error) == 429
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    連線錯誤、逾時、429 與 5xx 視為可重試，其餘 (如 4xx 參數錯誤) 直接拋出
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = get_status_code(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    name = type(error).__name__
+    module = type(error).__module__
+    return name in ("APIConnectionError", "APITimeoutError") or module.startswith(("httpx", "httpcore"))
+
+def get_retry_after(error: BaseException) -> float | None:
+    """
+    讀取回應中的 Retry-After (秒數或 HTTP 日期) 或 retry-after-ms
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return max(0.0, float(value) / 1000)
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+class RetryPolicy:
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30.0) -> None:
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        指數退避加上 full jitter，伺服器有給 Retry-After 時以其為下限
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+class TokenBucket:
+    """
+    每秒補充 rate 個 token、最多累積 capacity 個，rate <= 0 表示不限速
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        預扣 token 並回傳需要等待的秒數
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 1.0) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class RetryBudget:
+    """
+    每個請求存入 ratio 個重試額度，每次重試花費 1 個，避免大量請求同時重試放大流量
+    """
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 10.0, max_tokens: float = 100.0) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+        self.lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class CircuitBreaker:
+    """
+    連續失敗 failure_threshold 次後開啟，reset_timeout 秒後放行一個試探請求 (half-open)，成功即關閉
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+class HostResilience:
+    """
+    單一後端 host 的重試、限速、重試預算與斷路器
+    """
+
+    def __init__(
+        self,
+        host: str,
+        policy: RetryPolicy,
+        bucket: TokenBucket,
+        budget: RetryBudget,
+        breaker: CircuitBreaker
+    ) -> None:
+        self.host = host
+        self.policy = policy
+        self.bucket = bucket
+        self.budget = budget
+        self.breaker = breaker
+
+    def _before_attempt(self) -> None:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit breaker for {self.host} is open, failing fast.")
+
+    def _should_retry(self, error: BaseException, attempt: int, retryable: Callable[[BaseException], bool]) -> bool:
+        if not retryable(error):
+            # 後端有正常回應 (例如 4xx)，不計入斷路器失敗
+            self.breaker.record_success()
+            return False
+        if not is_rate_limited(error):
+            # 429 代表後端正常但限流，只退避不開啟斷路器
+            self.breaker.record_failure()
+        if attempt + 1 >= self.policy.max_attempts:
+            return False
+        if not self.budget.withdraw():
+            print(f"Retry budget for {self.host} exhausted, not retrying.")
+            return False
+        return True
+
+    def call(self, func: Callable[..., T], *args, retryable: Callable[[BaseException], bool] = is_retryable, **kwargs) -> T:
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self._before_attempt()
+            self.bucket.acquire()
+            limiter = _call_limiter.get()
+            if limiter is not None:
+                limiter.acquire()
+            started = time.monotonic()
+            error: Exception | None = None
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                error = e
+            finally:
+                if limiter is not None:
+                    limiter.release(time.monotonic() - started, error)
+            if error is not None:
+                if not self._should_retry(error, attempt, retryable):
+                    raise error
+                delay = self.policy.backoff(attempt, get_retry_after(error))
+                print(f"call to {self.host} failed (attempt {attempt + 1}/{self.policy.max_attempts}): {str(error)[:200]}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, func: Callable[..., Awaitable[T]], *args, retryable: Callable[[BaseException], bool] = is_retryable, **kwargs) -> T:
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self._before_attempt()
+            await self.bucket.aacquire()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(e, attempt, retryable):
+                    raise
+                delay = self.policy.backoff(attempt, get_retry_after(e))
+                print(f"call to {self.host} failed (attempt {attempt + 1}/{self.policy.max_attempts}): {str(e)[:200]}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+
+_hosts: dict[str, HostResilience] = {}
+_lock = threading.Lock()
+
+def get_resilience(host: str | None) -> HostResilience:
+    """
+    取得 host 共用的重試與斷路器設定，參數來自 LLM_RETRY_* / LLM_RATE_* / LLM_CIRCUIT_* 環境變數
+    """
+    key = host or "default"
+    with _lock:
+        resilience = _hosts.get(key)
+        if resilience is None:
+            rate = float(os.getenv("LLM_RATE_LIMIT", "0"))
+            resilience = HostResilience(
+                key,
+                RetryPolicy(
+                    max_attempts=int(os.getenv("LLM_MAX_RETRIES", "4")),
+                    base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+                    max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+                ),
+                TokenBucket(rate, float(os.getenv("LLM_RATE_BURST", "0")) or None),
+                RetryBudget(ratio=float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))),
+                CircuitBreaker(
+                    failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURES", "5")),
+                    reset_timeout=float(os.getenv("LLM_CIRCUIT_RESET", "30"))
+                )
+            )
+            _hosts[key] = resilience
+        return resilience
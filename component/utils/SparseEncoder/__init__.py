@@ -0,0 +1,94 @@
+import heapq
+import math
+import re
+import zlib
+from collections import Counter
+
+# CJK 以單字為詞，其餘以英數字詞為單位並轉小寫
+_TERM_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uac00-\ud7af]|[^\W_]+")
+
+class SparseEncoder:
+    """
+    不需要模型的雜湊詞頻稀疏向量，詞以 crc32 雜湊到 [0, dimensions) 的索引。
+    文件端的值為 1 + log(tf)，查詢端每個詞為 1，搭配後端的 IDF 即近似 BM25。
+    CJK 另外加入相鄰兩字 (bigram)，讓中文詞也能比對。
+    """
+
+    def __init__(self, dimensions: int = 1 << 20) -> None:
+        self.dimensions = dimensions
+
+    def terms(self, text: str) -> list[str]:
+        tokens = [token.lower() for token in _TERM_PATTERN.findall(text)]
+        bigrams = [
+            left + right for left, right in zip(tokens, tokens[1:])
+            if len(left) == 1 and len(right) == 1 and not left.isascii() and not right.isascii()
+        ]
+        return tokens + bigrams
+
+    def _index(self, term: str) -> int:
+        return zlib.crc32(term.encode("utf-8")) % self.dimensions
+
+    def encode(self, text: str) -> tuple[list[int], list[float]]:
+        counts: Counter[int] = Counter(self._index(term) for term in self.terms(text))
+        indices = sorted(counts)
+        return indices, [1.0 + math.log(counts[idx]) for idx in indices]
+
+    def encode_query(self, text: str) -> tuple[list[int], list[float]]:
+        indices = sorted({self._index(term) for term in self.terms(text)})
+        return indices, [1.0] * len(indices)
+
+
+class BM25Index:
+    """
+    記憶體內的 BM25 倒排索引，鍵可以是列號或 id 字串，斷詞與 SparseEncoder 相同。
+    給沒有原生 BM25 的後端使用。
+    """
+
+    def __init__(self, encoder: SparseEncoder | None = None, k1: float = 1.2, b: float = 0.75) -> None:
+        self.encoder = encoder or SparseEncoder()
+        self.k1 = k1
+        self.b = b
+        self.postings: dict[str, dict] = {}
+        self.doc_lengths: dict = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, key, text: str) -> None:
+        if key in self.doc_lengths:
+            self.remove(key, text)
+        terms = self.encoder.terms(text)
+        self.doc_lengths[key] = len(terms)
+        self.total_length += len(terms)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[key] = tf
+
+    def remove(self, key, text: str) -> None:
+        """text 為加入時的內容，用來找出要移除的詞"""
+        length = self.doc_lengths.pop(key, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in set(self.encoder.terms(text)):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[term]
+
+    def search(self, query: str, limit: int) -> list[tuple[object, float]]:
+        total = len(self.doc_lengths)
+        if not total or limit <= 0:
+            return []
+        average = self.total_length / total or 1
+        scores: dict = {}
+        for term in set(self.encoder.terms(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[key] / average)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
@@ -1 +1,25 @@
-from .Encoder import Encoder
\ No newline at end of file
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .Encoder import Encoder, EncoderRegistry, get_encoder, get_encoder_registry
+    from .EmbeddingCache import EmbeddingCache, get_embedding_cache
+    from .SparseEncoder import BM25Index, SparseEncoder
+
+_exports = {
+    "Encoder": ".Encoder",
+    "EncoderRegistry": ".Encoder",
+    "get_encoder": ".Encoder",
+    "get_encoder_registry": ".Encoder",
+    "EmbeddingCache": ".EmbeddingCache",
+    "get_embedding_cache": ".EmbeddingCache",
+    "SparseEncoder": ".SparseEncoder",
+    "BM25Index": ".SparseEncoder",
+}
+
+def __getattr__(name: str):
+    # 延遲載入，避免只用到 ClientPool 等輕量模組時也載入 torch / sentence_transformers
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    return getattr(import_module(module, __name__), name)
@@ -1,11 +1,16 @@
-from src.service.ChatService.ollamaService import OllamaService
-from src.service.ChatService.openaiService import OpenaiService
-from src.component.typing import BaseChatService
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
+import threading
 import os
 
+if TYPE_CHECKING:
+    from src.component.typing.llmbase import BaseChatService
+
 load_dotenv('config/.env')
 
+_instances: dict[tuple, "BaseChatService"] = {}
+_lock = threading.Lock()
+
 class llamaFactory:
     
     def __init__(self) -> None:
@@ -18,18 +23,42 @@ class llamaFactory:
         self.llm_api_key = os.getenv("LLM_API_KEY")
         self.vlm_api_key = os.getenv("VLM_API_KEY")
 
-    def get_llm(self) -> BaseChatService:
-        if self.llm_type == 'openai':
-            return OpenaiService(model=self.llm_model, host=self.llm_host, api_key=self.llm_api_key)
-        elif self.llm_type == 'ollama':
-            return OllamaService(model=self.llm_model, host=self.llm_host, api_key=self.llm_api_key)
-        else:
-            return OpenaiService(model=self.llm_model, host=self.llm_host, api_key=self.llm_api_key)
+    def _create(self, types:str, model:str, host:str | None, api_key:str | None) -> "BaseChatService":
+        # 只載入實際選用的後端
+        if types == 'ollama':
+            from src.service.ChatService.ollamaService import OllamaService
+            return OllamaService(model=model, host=host, api_key=api_key)
+        from src.service.ChatService.openaiService import OpenaiService
+        return OpenaiService(model=model, host=host, api_key=api_key)
+
+    def _get_service(self, types:str, model:str, host:str | None, api_key:str | None) -> "BaseChatService":
+        """
+        同一組設定在行程中只建立一次 client，讓 TLS 連線與 keep-alive socket 可以跨請求重複使用
+        """
+        key = (types if types == 'ollama' else 'openai', model, host, api_key)
+        with _lock:
+            service = _instances.get(key)
+            if service is None:
+                service = self._create(*key)
+                _instances[key] = service
+            return service
+
+    def get_llm(self) -> "BaseChatService":
+        return self._get_service(self.llm_type, self.llm_model, self.llm_host, self.llm_api_key)
         
-    def get_vlm(self) -> BaseChatService:
-        if self.vlm_type == 'openai':
-            return OpenaiService(model=self.vlm_model, host=self.vlm_host, api_key=self.vlm_api_key)
-        elif self.vlm_type == 'ollama':
-            return OllamaService(model=self.vlm_model, host=self.vlm_host, api_key=self.vlm_api_key)
-        else:
-            return OpenaiService(model=self.vlm_model, host=self.vlm_host, api_key=self.vlm_api_key)
\ No newline at end of file
+    def get_vlm(self) -> "BaseChatService":
+        return self._get_service(self.vlm_type, self.vlm_model, self.vlm_host, self.vlm_api_key)
+
+    @staticmethod
+    def reset() -> None:
+        """
+        關閉並清除所有快取的 chat service，下次取得時會依目前環境變數重新建立
+        """
+        with _lock:
+            services = list(_instances.values())
+            _instances.clear()
+        for service in services:
+            try:
+                service.close()
+            except Exception as e:
+                print(f"Failed to close chat service: {e}")
\ No newline at end of file
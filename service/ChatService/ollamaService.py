@@ -1,22 +1,94 @@
-from typing import Literal
+from datetime import datetime
+from itertools import chain
+from typing import AsyncIterator, Iterator
+from uuid import uuid4
 from typing_extensions import override
-from ollama import Client
-from openai.types.chat import ChatCompletion, ChatCompletionToolParam,ChatCompletionMessageParam
+from ollama import AsyncClient, Client
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionToolParam,ChatCompletionMessageParam
 from src.component.typing import BaseChatService
+from src.component.utils.ClientPool import get_async_client
+from src.component.utils.Resilience import get_resilience
 
 class OllamaService(BaseChatService):
 
     def __init__(self, model:str = "llama3.3", host:str = None, api_key:str = None) -> None:
         super().__init__(model=model, host=host, api_key=api_key)
         self.client = Client(host=self.host or None)
+        self.resilience = get_resilience(self.host or "localhost:11434")
         self.system_prompt = "你是一個有用的 AI 助手，請友善且準確地回答用戶的問題。優先以繁體中文回應。"
 
+    @property
+    def async_client(self) -> AsyncClient:
+        return get_async_client(
+            ("ollama", self.host),
+            lambda: AsyncClient(host=self.host or None, limits=self._get_limits())
+        )
+
+    @override
+    def close(self) -> None:
+        self.client._client.close()
+
+    def _with_system_prompt(self, prompt: list[ChatCompletionMessageParam]) -> list[ChatCompletionMessageParam]:
+        return [{"role": "system", "content": self.system_prompt}, *prompt]
+
     @override
     def chat(self, prompt: list[ChatCompletionMessageParam], tools: list[ChatCompletionToolParam] | None = None) -> ChatCompletion:
-        prompt.insert(0, {"role": "system", "content": self.system_prompt})
-        config = self._parse_prompt(prompt, tools)
-        response = self.client.chat(
+        config = self._parse_prompt(self._with_system_prompt(prompt), tools)
+        response = self.resilience.call(
+            self.client.chat,
+            **config.model_dump(),
+            stream=False
+        )
+        return self._parse_response(response)
+
+    @override
+    async def achat(self, prompt: list[ChatCompletionMessageParam], tools: list[ChatCompletionToolParam] | None = None) -> ChatCompletion:
+        config = self._parse_prompt(self._with_system_prompt(prompt), tools)
+        response = await self.resilience.acall(
+            self.async_client.chat,
             **config.model_dump(),
             stream=False
         )
-        return self._parse_response(response)
\ No newline at end of file
+        return self._parse_response(response)
+
+    def _open_stream(self, **kwargs) -> Iterator:
+        # ollama 的串流在迭代時才送出請求，先取第一個 chunk，連線錯誤才會在 resilience 層內發生並重試
+        stream = self.client.chat(**kwargs, stream=True)
+        first = next(stream, None)
+        return stream if first is None else chain([first], stream)
+
+    async def _aopen_stream(self, **kwargs) -> AsyncIterator:
+        stream = await self.async_client.chat(**kwargs, stream=True)
+        try:
+            first = await anext(stream)
+        except StopAsyncIteration:
+            return stream
+        async def rest():
+            yield first
+            async for item in stream:
+                yield item
+        return rest()
+
+    @override
+    def chat_stream(self, prompt: list[ChatCompletionMessageParam], tools: list[ChatCompletionToolParam] | None = None) -> Iterator[ChatCompletionChunk]:
+        config = self._parse_prompt(self._with_system_prompt(prompt), tools)
+        completion_id = uuid4().hex
+        created = int(datetime.now().timestamp())
+        tool_index = 0
+        for idx, response in enumerate(self.resilience.call(self._open_stream, **config.model_dump())):
+            chunk = self._parse_stream_response(response, completion_id, created, tool_index, tool_index > 0, first=idx == 0)
+            tool_index += len(chunk.choices[0].delta.tool_calls or [])
+            yield chunk
+
+    @override
+    async def achat_stream(self, prompt: list[ChatCompletionMessageParam], tools: list[ChatCompletionToolParam] | None = None) -> AsyncIterator[ChatCompletionChunk]:
+        config = self._parse_prompt(self._with_system_prompt(prompt), tools)
+        completion_id = uuid4().hex
+        created = int(datetime.now().timestamp())
+        tool_index = 0
+        first = True
+        async for response in await self.resilience.acall(self._aopen_stream, **config.model_dump()):
+            chunk = self._parse_stream_response(response, completion_id, created, tool_index, tool_index > 0, first=first)
+            first = False
+            tool_index += len(chunk.choices[0].delta.tool_calls or [])
+            yield chunk
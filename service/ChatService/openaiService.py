@@ -1,14 +1,22 @@
-from typing import Literal
+from typing import AsyncIterator, Iterator, Literal
 from typing_extensions import override
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, InternalServerError, OpenAI
 from src.component.typing import BaseChatService
-from openai.types.chat import ChatCompletion,ChatCompletionMessageParam,ChatCompletionToolParam
+from src.component.utils.ClientPool import get_async_client
+from src.component.utils.Resilience import get_resilience
+from openai.types.chat import ChatCompletion,ChatCompletionChunk,ChatCompletionMessageParam,ChatCompletionToolParam
 from openai._types import NotGiven
 
 class OpenaiService(BaseChatService):
     def __init__(self, model:str = "gpt-3.5-turbo", host:str = None, api_key:str = None) -> None:
         super().__init__(model=model, host=host, api_key=api_key)
-        self.client = OpenAI(api_key=self.api_key, base_url=self.host)
+        # 重试交给 resilience 层统一处理，关闭 SDK 自带的重试避免重复重试
+        self.client = OpenAI(api_key=self.api_key, base_url=self.host, max_retries=0)
+        self.resilience = get_resilience(self.host or "api.openai.com")
+
+    @override
+    def close(self) -> None:
+        self.client.close()
 
     def _get_tool_info(self, tool: ChatCompletionToolParam) -> tuple[str, str]:
         """获取工具的名称和描述"""
@@ -189,94 +197,151 @@ class OpenaiService(BaseChatService):
         
         return valid_tools
 
+    def _build_request(self, prompt: list[ChatCompletionMessageParam], tools: list[ChatCompletionToolParam] | None = None) -> dict:
+        """组装 chat.completions.create 所需参数"""
+        # 验证和清理消息列表
+        messages = self._validate_and_clean_messages(prompt)
+        
+        if not messages:
+            raise ValueError("No valid messages in prompt")
+        
+        print(f"Messages after validation: {len(messages)}")
+        
+        # 准备参数
+        kwargs = {
+            "model": self.model,
+            "messages": messages,
+        }
+        
+        # 如果有工具，添加系统提示引导使用工具
+        if tools and len(tools) > 0:
+            self._print_tool_info(tools)
+            
+            # 确保工具格式正确，转换为字典格式
+            valid_tools = self._ensure_tools_format(tools)
+            
+            if valid_tools:
+                # 调试：打印工具结构
+                if valid_tools:
+                    print(f"Tool structure sample: type={valid_tools[0].get('type')}, has_function={('function' in valid_tools[0])}")
+                    if 'function' in valid_tools[0]:
+                        func = valid_tools[0]['function']
+                        print(f"Function: name={func.get('name')}, has_params={('parameters' in func)}")
+                
+                # 如果没有系统消息，添加简化的系统提示
+                if not self._has_system_message(messages):
+                    system_prompt = self._get_system_prompt(tools)
+                    messages.insert(0, {"role": "system", "content": system_prompt})
+                    kwargs["messages"] = messages  # 更新消息列表
+                    print("Added system prompt to guide tool usage")
+                
+                # 使用转换后的字典格式工具
+                kwargs["tools"] = valid_tools
+                # 注意：不设置 tool_choice，让模型自己决定，某些 API 可能不支持此参数
+                print(f"Passing {len(valid_tools)} tool(s) to OpenAI API")
+            else:
+                print("Warning: No valid tools to pass, continuing without tools")
+        
+        # 调试：打印最终参数（不包含敏感信息）
+        print(f"API call params: model={kwargs.get('model')}, messages_count={len(kwargs.get('messages', []))}, tools_count={len(kwargs.get('tools', []))}")
+        return kwargs
+
+    def _print_error(self, e: Exception, kwargs: dict | None, tools: list[ChatCompletionToolParam] | None) -> None:
+        """打印调用失败时的调试信息"""
+        import traceback
+        print(f"Error in chat: {e}")
+        print(f"Error type: {type(e).__name__}")
+        traceback.print_exc()
+        messages = (kwargs or {}).get("messages")
+        if messages is not None:
+            print(f"Messages count: {len(messages)}")
+            if messages:
+                print(f"First message: {messages[0]}")
+        if tools:
+            print(f"Tools count: {len(tools)}")
+            if tools:
+                print(f"First tool type: {type(tools[0])}")
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """当前 event loop 上按 host 共用的 AsyncOpenAI client"""
+        return get_async_client(
+            ("openai", self.host, self.api_key),
+            lambda: AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.host,
+                http_client=DefaultAsyncHttpxClient(limits=self._get_limits()),
+                max_retries=0
+            )
+        )
+
     @override
     def chat(self, prompt: list[ChatCompletionMessageParam], tools: list[ChatCompletionToolParam] | None = None) -> ChatCompletion:
         print("chat with openai")
         print(f"tools count: {len(tools) if tools else 0}")
         
+        kwargs = None
         try:
-            # 验证和清理消息列表
-            messages = self._validate_and_clean_messages(prompt)
-            
-            if not messages:
-                raise ValueError("No valid messages in prompt")
+            kwargs = self._build_request(prompt, tools)
             
-            print(f"Messages after validation: {len(messages)}")
-            
-            # 准备参数
-            kwargs = {
-                "model": self.model,
-                "messages": messages,
-            }
-            
-            # 如果有工具，添加系统提示引导使用工具
-            if tools and len(tools) > 0:
-                self._print_tool_info(tools)
-                
-                # 确保工具格式正确，转换为字典格式
-                valid_tools = self._ensure_tools_format(tools)
-                
-                if valid_tools:
-                    # 调试：打印工具结构
-                    if valid_tools:
-                        print(f"Tool structure sample: type={valid_tools[0].get('type')}, has_function={('function' in valid_tools[0])}")
-                        if 'function' in valid_tools[0]:
-                            func = valid_tools[0]['function']
-                            print(f"Function: name={func.get('name')}, has_params={('parameters' in func)}")
-                    
-                    # 如果没有系统消息，添加简化的系统提示
-                    if not self._has_system_message(messages):
-                        system_prompt = self._get_system_prompt(tools)
-                        messages.insert(0, {"role": "system", "content": system_prompt})
-                        kwargs["messages"] = messages  # 更新消息列表
-                        print("Added system prompt to guide tool usage")
-                    
-                    # 使用转换后的字典格式工具
-                    kwargs["tools"] = valid_tools
-                    # 注意：不设置 tool_choice，让模型自己决定，某些 API 可能不支持此参数
-                    print(f"Passing {len(valid_tools)} tool(s) to OpenAI API")
-                else:
-                    print("Warning: No valid tools to pass, continuing without tools")
-            
-            # 调试：打印最终参数（不包含敏感信息）
-            print(f"API call params: model={kwargs.get('model')}, messages_count={len(kwargs.get('messages', []))}, tools_count={len(kwargs.get('tools', []))}")
-            
-            # 尝试调用 API，如果失败则重试或降级
-            max_retries = 2
-            for attempt in range(max_retries):
+            # 调用 API，可重试的错误由共用的 resilience 层以指数退避重试
+            try:
+                return self.resilience.call(self.client.chat.completions.create, **kwargs)
+            except InternalServerError as api_error:
+                # 如果重试后仍是 500 错误，尝试不带工具调用
+                if 'tools' not in kwargs:
+                    raise
+                print("API call failed with tools, attempting without tools as fallback...")
+                # 创建不带工具的副本
+                fallback_kwargs = {k: v for k, v in kwargs.items() if k != 'tools'}
                 try:
-                    return self.client.chat.completions.create(**kwargs)
-                except Exception as api_error:
-                    error_type = type(api_error).__name__
-                    # 如果是 500 错误且是最后一次尝试，尝试不带工具调用
-                    if attempt == max_retries - 1 and 'InternalServerError' in error_type and 'tools' in kwargs:
-                        print("API call failed with tools, attempting without tools as fallback...")
-                        # 创建不带工具的副本
-                        fallback_kwargs = {k: v for k, v in kwargs.items() if k != 'tools'}
-                        try:
-                            return self.client.chat.completions.create(**fallback_kwargs)
-                        except Exception as fallback_error:
-                            print(f"Fallback without tools also failed: {fallback_error}")
-                            raise api_error  # 抛出原始错误
-                    elif attempt < max_retries - 1:
-                        print(f"API call failed (attempt {attempt + 1}/{max_retries}): {api_error}, retrying...")
-                        import time
-                        time.sleep(0.5)  # 短暂等待后重试
-                        continue
-                    else:
-                        raise
+                    return self.client.chat.completions.create(**fallback_kwargs)
+                except Exception as fallback_error:
+                    print(f"Fallback without tools also failed: {fallback_error}")
+                    raise api_error  # 抛出原始错误
             
         except Exception as e:
-            import traceback
-            print(f"Error in chat: {e}")
-            print(f"Error type: {type(e).__name__}")
-            traceback.print_exc()
-            if 'messages' in locals():
-                print(f"Messages count: {len(messages)}")
-                if messages:
-                    print(f"First message: {messages[0]}")
-            if tools:
-                print(f"Tools count: {len(tools)}")
-                if tools:
-                    print(f"First tool type: {type(tools[0])}")
-            raise
\ No newline at end of file
+            self._print_error(e, kwargs, tools)
+            raise
+
+    @override
+    async def achat(self, prompt: list[ChatCompletionMessageParam], tools: list[ChatCompletionToolParam] | None = None) -> ChatCompletion:
+        kwargs = None
+        try:
+            kwargs = self._build_request(prompt, tools)
+            try:
+                return await self.resilience.acall(self.async_client.chat.completions.create, **kwargs)
+            except InternalServerError as api_error:
+                if 'tools' not in kwargs:
+                    raise
+                print("API call failed with tools, attempting without tools as fallback...")
+                fallback_kwargs = {k: v for k, v in kwargs.items() if k != 'tools'}
+                try:
+                    return await self.async_client.chat.completions.create(**fallback_kwargs)
+                except Exception as fallback_error:
+                    print(f"Fallback without tools also failed: {fallback_error}")
+                    raise api_error
+        except Exception as e:
+            self._print_error(e, kwargs, tools)
+            raise
+
+    @override
+    def chat_stream(self, prompt: list[ChatCompletionMessageParam], tools: list[ChatCompletionToolParam] | None = None) -> Iterator[ChatCompletionChunk]:
+        kwargs = None
+        try:
+            kwargs = self._build_request(prompt, tools)
+            yield from self.resilience.call(self.client.chat.completions.create, **kwargs, stream=True)
+        except Exception as e:
+            self._print_error(e, kwargs, tools)
+            raise
+
+    @override
+    async def achat_stream(self, prompt: list[ChatCompletionMessageParam], tools: list[ChatCompletionToolParam] | None = None) -> AsyncIterator[ChatCompletionChunk]:
+        kwargs = None
+        try:
+            kwargs = self._build_request(prompt, tools)
+            async for chunk in await self.resilience.acall(self.async_client.chat.completions.create, **kwargs, stream=True):
+                yield chunk
+        except Exception as e:
+            self._print_error(e, kwargs, tools)
+            raise
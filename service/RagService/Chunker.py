@@ -0,0 +1,189 @@
+import math
+import os
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# CJK 字元各算一個 token，其餘單字約 4 個字元一個 token，標點各算一個
+_TOKEN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uac00-\ud7af]|\w+|[^\w\s]")
+_SENTENCE_PATTERN = re.compile(r".+?(?:[。！？!?；;]+|\.(?=\s)|\n|$)\s*", re.S)
+_TABLE_SEPARATOR = re.compile(r"\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?")
+
+class Chunker:
+    """
+    在向量化之前把 VLM 解析出的段落、圖片描述與表格切成大小可預期的 chunk：
+    文字依句子打包到 max_tokens 並保留 overlap_tokens 的重疊，markdown 表格依列切分並在每個 chunk 重複表頭，
+    小於 min_tokens 的相鄰片段會合併。
+    """
+
+    def __init__(self, max_tokens: int = 512, overlap_tokens: int = 64, min_tokens: int = 32, encoding: str | None = None) -> None:
+        self.max_tokens = max(16, max_tokens)
+        self.overlap_tokens = min(max(0, overlap_tokens), self.max_tokens // 2)
+        self.min_tokens = max(0, min(min_tokens, self.max_tokens))
+        self.encoding = None
+        if encoding and tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding)
+            except Exception as e:
+                print(f"Failed to load tokenizer {encoding}, using estimated token counts: {e}")
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        切分設定的摘要，設定改變時 chunk 的內容與數量也會改變
+        """
+        encoding = self.encoding.name if self.encoding is not None else "estimate"
+        return f"{self.max_tokens}:{self.overlap_tokens}:{self.min_tokens}:{encoding}"
+
+    def count_tokens(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return sum(
+            math.ceil(len(token) / 4) if token[0].isascii() and token[0].isalnum() else 1
+            for token in _TOKEN_PATTERN.findall(text)
+        )
+
+    def _split_long(self, text: str) -> list[str]:
+        """單一句子超過 max_tokens 時直接依 token 切開"""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text)
+            return [self.encoding.decode(tokens[i:i + self.max_tokens]) for i in range(0, len(tokens), self.max_tokens)]
+        pieces: list[str] = []
+        start = 0
+        size = 0
+        for match in _TOKEN_PATTERN.finditer(text):
+            token = match.group()
+            weight = math.ceil(len(token) / 4) if token[0].isascii() and token[0].isalnum() else 1
+            if weight > self.max_tokens:
+                # 沒有分隔的超長字串 (例如 base64、長網址) 依字元數切開
+                if match.start() > start:
+                    pieces.append(text[start:match.start()])
+                step = self.max_tokens * 4
+                pieces.extend(token[i:i + step] for i in range(0, len(token), step))
+                start, size = match.end(), 0
+                continue
+            if size + weight > self.max_tokens and match.start() > start:
+                pieces.append(text[start:match.start()])
+                start, size = match.start(), 0
+            size += weight
+        if start < len(text):
+            pieces.append(text[start:])
+        return pieces
+
+    def _units(self, text: str) -> list[tuple[str, int]]:
+        units: list[tuple[str, int]] = []
+        for sentence in _SENTENCE_PATTERN.findall(text):
+            count = self.count_tokens(sentence)
+            if count <= self.max_tokens:
+                units.append((sentence, count))
+            else:
+                units.extend((piece, self.count_tokens(piece)) for piece in self._split_long(sentence))
+        return units
+
+    def chunk_text(self, text: str) -> list[str]:
+        chunks: list[str] = []
+        current: list[tuple[str, int]] = []
+        size = 0
+        for unit, count in self._units(text):
+            if current and size + count > self.max_tokens:
+                chunks.append("".join(part for part, _ in current).strip())
+                # 下一個 chunk 以上一個 chunk 結尾不超過 overlap_tokens 的句子開頭
+                keep: list[tuple[str, int]] = []
+                kept = 0
+                for part, part_count in reversed(current):
+                    if kept + part_count > self.overlap_tokens or kept + part_count + count > self.max_tokens:
+                        break
+                    keep.insert(0, (part, part_count))
+                    kept += part_count
+                current, size = keep, kept
+            current.append((unit, count))
+            size += count
+        if current:
+            chunks.append("".join(part for part, _ in current).strip())
+        return [chunk for chunk in chunks if chunk]
+
+    def chunk_table(self, table: str) -> list[str]:
+        lines = [line for line in table.strip().splitlines() if line.strip()]
+        if len(lines) < 2 or not _TABLE_SEPARATOR.fullmatch(lines[1].strip()):
+            return self.chunk_text(table)
+        header = "\n".join(lines[:2])
+        budget = max(self.max_tokens - self.count_tokens(header), self.max_tokens // 4)
+        chunks: list[str] = []
+        rows: list[str] = []
+        size = 0
+        for row in lines[2:]:
+            count = self.count_tokens(row)
+            if rows and size + count > budget:
+                chunks.append("\n".join([header, *rows]))
+                rows, size = [], 0
+            rows.append(row)
+            size += count
+        if rows or not chunks:
+            chunks.append("\n".join([header, *rows]))
+        return chunks
+
+    @staticmethod
+    def _merge_xy(boxes: list) -> list:
+        valid = [box for box in boxes if isinstance(box, (list, tuple)) and len(box) == 4]
+        if not valid:
+            return []
+        try:
+            return [
+                min(box[0] for box in valid), min(box[1] for box in valid),
+                max(box[2] for box in valid), max(box[3] for box in valid)
+            ]
+        except TypeError:
+            return list(valid[0])
+
+    def _merge_small(self, items: list[dict]) -> list[dict]:
+        """只合併未被切開的完整項目，被切開的長段落各 chunk 保持獨立"""
+        merged: list[dict] = []
+        sizes: list[int] = []
+        for item in items:
+            count = self.count_tokens(item["content"])
+            if (
+                merged and merged[-1]["chunks"] == 1 and item["chunks"] == 1
+                and (sizes[-1] < self.min_tokens or count < self.min_tokens)
+                and sizes[-1] + count <= self.max_tokens
+            ):
+                last = merged[-1]
+                last["content"] = last["content"] + "\n\n" + item["content"]
+                last["xy"] = self._merge_xy([last.get("xy"), item.get("xy")])
+                last["merged"] = last.get("merged", 1) + 1
+                sizes[-1] += count
+                continue
+            merged.append(dict(item))
+            sizes.append(count)
+        return merged
+
+    def chunk_items(self, items: list[dict], kind: str) -> list[dict]:
+        """
+        將同一頁同一類別的解析結果切成 chunk，保留原本的欄位 (名稱、docPage、xy)，
+        並加上 chunk / chunks 表示在原本項目中的位置
+        """
+        chunked: list[dict] = []
+        for item in items:
+            content = str(item.get("content") or "").strip()
+            if not content:
+                continue
+            pieces = self.chunk_table(content) if kind == "tables" else self.chunk_text(content)
+            for idx, piece in enumerate(pieces):
+                chunked.append({**item, "content": piece, "chunk": idx, "chunks": len(pieces)})
+        if kind != "tables" and self.min_tokens > 0:
+            chunked = self._merge_small(chunked)
+        return chunked
+
+
+def get_chunker() -> Chunker:
+    """
+    設定來自 CHUNK_MAX_TOKENS、CHUNK_OVERLAP_TOKENS、CHUNK_MIN_TOKENS 與 CHUNK_TOKENIZER (tiktoken 編碼名稱，未設定時以估算計數)
+    """
+    return Chunker(
+        max_tokens=int(os.getenv("CHUNK_MAX_TOKENS", "512")),
+        overlap_tokens=int(os.getenv("CHUNK_OVERLAP_TOKENS", "64")),
+        min_tokens=int(os.getenv("CHUNK_MIN_TOKENS", "32")),
+        encoding=os.getenv("CHUNK_TOKENIZER") or None
+    )
@@ -0,0 +1,217 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from hashlib import sha256
+
+from PIL.Image import Image, Resampling
+
+def dhash(image: Image, size: int = 8) -> int:
+    """
+    64 位元的 difference hash：縮成 (size+1)xsize 灰階後比較相鄰像素，版面相同的頁面 hash 距離很小
+    """
+    pixels = list(image.convert("L").resize((size + 1, size), Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def _to_signed(value: int) -> int:
+    # SQLite INTEGER 為有號 64 位元
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+# dHash 切成 4 段 16 位元；漢明距離 <= 3 的兩個 hash 至少有一段完全相同 (鴿籠原理)，只需比對同段相同的候選
+_BANDS = 4
+_BAND_BITS = 64 // _BANDS
+
+def _bands(phash: int) -> list[int]:
+    return [(phash >> (_BAND_BITS * i)) & ((1 << _BAND_BITS) - 1) for i in range(_BANDS)]
+
+class ExtractionCache:
+    """
+    VLM 解析結果的磁碟快取，鍵為 (頁面圖片 sha256, prompt 模板 sha256, VLM 模型)，
+    總大小超過 max_bytes 時依最後使用時間淘汰 (LRU)。
+    perceptual 模式下找不到完全相同的圖片時，會以 dHash 漢明距離 <= max_distance (最大 3) 的頁面作為命中。
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, perceptual: bool = False, max_distance: int = 0) -> None:
+        self.path = path
+        self.max_bytes = max(0, max_bytes)
+        self.perceptual = perceptual
+        if max_distance >= _BANDS:
+            print(f"Extraction cache distance {max_distance} is too large for {_BANDS} dHash bands, using {_BANDS - 1}")
+        self.max_distance = min(max(0, max_distance), _BANDS - 1)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS extractions (
+                namespace TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                phash INTEGER,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (namespace, digest)
+            );
+            CREATE INDEX IF NOT EXISTS extractions_last_used ON extractions (last_used);
+            """
+        )
+        self._migrate_bands()
+        # 總大小只在啟動時計算一次，之後於寫入與淘汰時增減
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        self.conn.commit()
+
+    def _migrate_bands(self) -> None:
+        """
+        舊版的快取檔沒有 dHash 分段欄位，補上欄位與索引並由既有的 phash 回填
+        """
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(extractions)")}
+        missing = [i for i in range(_BANDS) if f"band{i}" not in columns]
+        for i in missing:
+            self.conn.execute(f"ALTER TABLE extractions ADD COLUMN band{i} INTEGER")
+        for i in range(_BANDS):
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS extractions_band{i} ON extractions (namespace, band{i})")
+        if missing:
+            rows = self.conn.execute("SELECT namespace, digest, phash FROM extractions WHERE phash IS NOT NULL").fetchall()
+            self.conn.executemany(
+                f"UPDATE extractions SET {', '.join(f'band{i} = ?' for i in range(_BANDS))} WHERE namespace = ? AND digest = ?",
+                [(*_bands(phash & ((1 << 64) - 1)), namespace, digest) for namespace, digest, phash in rows]
+            )
+
+    @staticmethod
+    def make_namespace(template: str, model: str | None) -> str:
+        return f"{model or ''}:{sha256(template.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def make_digest(payload: str | bytes) -> str:
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        return sha256(payload).hexdigest()
+
+    def get(self, namespace: str, digest: str, phash: int | None = None) -> dict | None:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest, data FROM extractions WHERE namespace = ? AND digest = ?", (namespace, digest)
+            ).fetchone()
+            near = False
+            if row is None and self.perceptual and phash is not None:
+                row = self._find_similar(namespace, phash)
+                near = row is not None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE extractions SET last_used = ? WHERE namespace = ? AND digest = ?", (time.time(), namespace, row[0])
+            )
+            self.conn.commit()
+            self.hits += 1
+            self.near_hits += near
+        return json.loads(row[1])
+
+    def _find_similar(self, namespace: str, phash: int) -> tuple[str, str] | None:
+        best: tuple[int, str] | None = None
+        bands = _bands(phash)
+        # 只取至少一段相同的候選，不掃描整個 namespace
+        for digest, value in self.conn.execute(
+            f"SELECT digest, phash FROM extractions WHERE namespace = ? AND phash IS NOT NULL AND ({' OR '.join(f'band{i} = ?' for i in range(_BANDS))})",
+            (namespace, *bands)
+        ):
+            distance = bin((value & ((1 << 64) - 1)) ^ phash).count("1")
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, digest)
+        if best is None:
+            return None
+        return self.conn.execute(
+            "SELECT digest, data FROM extractions WHERE namespace = ? AND digest = ?", (namespace, best[1])
+        ).fetchone()
+
+    def put(self, namespace: str, digest: str, data: dict, phash: int | None = None) -> None:
+        text = json.dumps(data, ensure_ascii=False)
+        size = len(text.encode("utf-8"))
+        bands = [None] * _BANDS if phash is None else _bands(phash)
+        with self.lock:
+            replaced = self.conn.execute(
+                "SELECT size FROM extractions WHERE namespace = ? AND digest = ?", (namespace, digest)
+            ).fetchone()
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO extractions (namespace, digest, phash, data, size, last_used, {', '.join(f'band{i}' for i in range(_BANDS))}) "
+                f"VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' * _BANDS)})",
+                (namespace, digest, None if phash is None else _to_signed(phash), text, size, time.time(), *bands)
+            )
+            self.total_bytes += size - (replaced[0] if replaced else 0)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        # 依最後使用時間分批取出，只讀到足夠淘汰的列為止
+        cursor = self.conn.execute("SELECT namespace, digest, size FROM extractions ORDER BY last_used")
+        expired = []
+        while self.total_bytes > self.max_bytes:
+            row = cursor.fetchone()
+            if row is None:
+                break
+            expired.append(row[:2])
+            self.total_bytes -= row[2]
+        cursor.close()
+        self.conn.executemany("DELETE FROM extractions WHERE namespace = ? AND digest = ?", expired)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM extractions")
+            self.conn.commit()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            items = self.conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "items": items,
+                "bytes": self.total_bytes
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+_default_cache: ExtractionCache | None = None
+_default_lock = threading.Lock()
+
+def get_extraction_cache() -> ExtractionCache | None:
+    """
+    取得行程共用的 VLM 解析快取，設定來自 RAG_EXTRACTION_CACHE_PATH (空字串為停用)、
+    RAG_EXTRACTION_CACHE_MB、RAG_EXTRACTION_CACHE_PERCEPTUAL 與 RAG_EXTRACTION_CACHE_DISTANCE
+    """
+    global _default_cache
+    path = os.getenv("RAG_EXTRACTION_CACHE_PATH", "config/extraction_cache.sqlite")
+    if not path:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ExtractionCache(
+                path,
+                max_bytes=int(float(os.getenv("RAG_EXTRACTION_CACHE_MB", "256")) * 1024 * 1024),
+                perceptual=os.getenv("RAG_EXTRACTION_CACHE_PERCEPTUAL", "false").lower() in ("1", "true", "yes"),
+                max_distance=int(os.getenv("RAG_EXTRACTION_CACHE_DISTANCE", "0"))
+            )
+        return _default_cache
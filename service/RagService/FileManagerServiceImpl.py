@@ -1,20 +1,40 @@
 import os
+import re
 import subprocess
 import mimetypes
 import tempfile
-from typing import Literal, Union
+from collections import deque
+from contextlib import contextmanager
+from typing import Container, Iterator, Literal, Union
 from io import BytesIO
 from typing_extensions import override
 from PIL.Image import Image,open as open_image, new as new_image
 from PIL import ImageFont, ImageDraw
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_path, pdfinfo_from_path
 
-from src.component.typing.fileManagebase import BaseFileManageService
+from src.component.typing.fileManagebase import BaseFileManageService, TextPage
+from src.service.RagService.OfficeWorkerPool import get_office_pool, uno_available
+
+TEXT_EXTENSIONS = [".txt", ".md", ".py", ".js", ".html", ".css", ".json", ".xml", ".yaml", ".yml"]
 
 class FileManageService(BaseFileManageService):
     
     def __init__(self):
         super().__init__()
+        self.dpi = int(os.getenv("PDF_DPI", "200"))
+        self.render_format = os.getenv("PDF_RENDER_FORMAT", "ppm").lower()
+        self.render_threads = int(os.getenv("PDF_RENDER_THREADS", "1"))
+        self.pages_per_render = max(1, int(os.getenv("PDF_PAGES_PER_RENDER", "1")))
+        self.soffice_workers = int(os.getenv("SOFFICE_WORKERS", "2"))
+        if self.soffice_workers > 0 and not uno_available():
+            # 常駐 worker 需要透過 UNO 轉檔，沒有 pyuno 時維持每份文件啟動一次 soffice
+            print("pyuno is not available, SOFFICE_WORKERS is ignored and soffice runs once per document")
+            self.soffice_workers = 0
+        self.text_layer = os.getenv("PDF_TEXT_LAYER", "true").lower() in ("1", "true", "yes")
+        self.text_min_chars = int(os.getenv("PDF_TEXT_MIN_CHARS", "200"))
+        self.text_max_image_ratio = float(os.getenv("PDF_TEXT_MAX_IMAGE_RATIO", "0.1"))
+        self.text_page_chars = int(os.getenv("TEXT_PAGE_CHARS", "4000"))
+        self.text_font = os.getenv("TEXT_RENDER_FONT")
 
     @override
     def file_to_image(self,input_file: str) -> None:
@@ -25,16 +45,13 @@ class FileManageService(BaseFileManageService):
             self.images = self._convert_pdf_to_image(input_file)
             return
         
-        if ext in [".xls", ".xlsx"]:
-            self.images = self._convert_office_to_image(input_file,types="calc")
-            return
-        
-        if ext in [".doc", ".docx", ".odt", ".ods", ".odp",".txt", ".md", ".py", ".js", ".html", ".css", ".json", ".xml", ".yaml", ".yml"]:
-            self.images = self._convert_office_to_image(input_file,types="writer")
+        if ext in TEXT_EXTENSIONS:
+            self.images = [self._render_text(chunk) for chunk in self._iter_text_chunks(input_file)]
             return
         
-        if ext in [".ppt", ".pptx"]:
-            self.images = self._convert_office_to_image(input_file,types="impress")
+        office_type = self._get_office_type(ext)
+        if office_type is not None:
+            self.images = self._convert_office_to_image(input_file,types=office_type)
             return
         
         if ext in [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".ico", ".webp"]:
@@ -44,27 +61,292 @@ class FileManageService(BaseFileManageService):
         raise ValueError(f"不支援的格式: {ext}")
 
     @override
-    def _convert_pdf_to_image(self, pdf: bytes | str) -> list[Image]:
-        """將 PDF bytes 或圖片 bytes 轉換為 Image 列表"""
+    def iter_images(self, input_file: str) -> Iterator[Image]:
+        """逐頁渲染 PDF、Office 與純文字檔案，其他格式沿用 file_to_image"""
+        ext = os.path.splitext(input_file)[1].lower()
+        if ext in TEXT_EXTENSIONS:
+            for chunk in self._iter_text_chunks(input_file):
+                yield self._render_text(chunk)
+            return
+        office_type = self._get_office_type(ext)
+        if ext == ".pdf":
+            yield from self.iter_pdf_pages(input_file)
+            return
+        if office_type is not None:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                pdf_path = self._convert_office_to_pdf(input_file, office_type, tmpdir)
+                yield from self.iter_pdf_pages(pdf_path)
+            return
+        yield from super().iter_images(input_file)
+
+    @override
+    def iter_pages(self, input_file: str, skip: Container[int] = ()) -> Iterator[tuple[int, Image | TextPage]]:
+        """
+        PDF 與 Office 檔案只渲染不在 skip 中的頁面，有可用文字層的頁面直接回傳 TextPage；
+        純文字格式不經過 LibreOffice，直接切成 TextPage
+        """
+        ext = os.path.splitext(input_file)[1].lower()
+        if ext in TEXT_EXTENSIONS:
+            for idx, page in enumerate(self.iter_text_pages(input_file)):
+                if idx not in skip:
+                    yield idx, page
+            return
+        office_type = self._get_office_type(ext)
+        if ext == ".pdf":
+            yield from self.iter_pdf_pages_indexed(input_file, skip=skip, text_layer=self.text_layer)
+            return
+        if office_type is not None:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                pdf_path = self._convert_office_to_pdf(input_file, office_type, tmpdir)
+                yield from self.iter_pdf_pages_indexed(pdf_path, skip=skip, text_layer=self.text_layer)
+            return
+        yield from super().iter_pages(input_file, skip)
+
+    def iter_text_pages(self, input_file: str) -> Iterator[TextPage]:
+        """
+        純文字檔以行為單位切成每頁約 text_page_chars 字的 TextPage，markdown 表格會獨立成表格
+        """
+        for chunk in self._iter_text_chunks(input_file):
+            yield self._parse_text_page(chunk, layout=False)
+
+    def _iter_text_chunks(self, input_file: str) -> Iterator[str]:
+        buffer: list[str] = []
+        size = 0
+        with open(input_file, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                buffer.append(line)
+                size += len(line)
+                # 不在 markdown 表格中間換頁
+                if size >= self.text_page_chars and not line.lstrip().startswith("|"):
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+        if buffer:
+            yield "".join(buffer)
+
+    def _render_text(self, text: str, width: int = 1240, margin: int = 60, font_size: int = 24) -> Image:
+        """
+        純文字檔需要圖片時 (file_to_image / iter_images) 直接以 PIL 繪製，不經過 LibreOffice；
+        中文需要以 TEXT_RENDER_FONT 指定支援的字型 (TrueType / OpenType)
+        """
+        font = ImageFont.truetype(self.text_font, font_size) if self.text_font else ImageFont.load_default()
+        measure = ImageDraw.Draw(new_image("L", (1, 1)))
+        max_width = width - 2 * margin
+        lines: list[str] = []
+        for raw in text.expandtabs(4).splitlines() or [""]:
+            line = ""
+            for char in raw:
+                if line and measure.textlength(line + char, font=font) > max_width:
+                    lines.append(line)
+                    line = ""
+                line += char
+            lines.append(line)
+        left, top, right, bottom = measure.textbbox((0, 0), "Ag中", font=font)
+        line_height = int((bottom - top) * 1.4) or font_size
+        image = new_image("RGB", (width, 2 * margin + line_height * len(lines)), "white")
+        draw = ImageDraw.Draw(image)
+        for idx, line in enumerate(lines):
+            draw.text((margin, margin + idx * line_height), line, fill="black", font=font)
+        return image
+
+    def _parse_text_page(self, text: str, layout: bool = True) -> TextPage:
+        """
+        以空行切段落；markdown 表格，以及 (layout 模式下) 連續 3 行以上欄數相同 (3 欄以上)、以多個空白分隔的欄位轉成 markdown 表格
+        """
+        page = TextPage()
+        paragraph: list[str] = []
+        rows: list[list[str]] = []
+
+        def flush_paragraph() -> None:
+            content = "\n".join(line.strip() for line in paragraph).strip()
+            if content:
+                page.paragraphs.append(content)
+            paragraph.clear()
+
+        def flush_rows() -> None:
+            if len(rows) >= 3:
+                header, *body = rows
+                lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+                lines += ["| " + " | ".join(row) + " |" for row in body]
+                page.tables.append("\n".join(lines))
+            else:
+                paragraph.extend("  ".join(row) for row in rows)
+            rows.clear()
+
+        markdown: list[str] = []
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("|") and stripped.endswith("|"):
+                flush_rows()
+                flush_paragraph()
+                markdown.append(stripped)
+                continue
+            if markdown:
+                page.tables.append("\n".join(markdown))
+                markdown = []
+            cells = [cell for cell in re.split(r"\s{2,}", stripped) if cell] if layout else []
+            # 兩欄的排版 (例如雙欄論文) 不視為表格
+            if len(cells) >= 3 and (not rows or len(cells) == len(rows[0])):
+                if not rows:
+                    flush_paragraph()
+                rows.append(cells)
+                continue
+            flush_rows()
+            if not stripped:
+                flush_paragraph()
+            else:
+                paragraph.append(stripped)
+        if markdown:
+            page.tables.append("\n".join(markdown))
+        flush_rows()
+        flush_paragraph()
+        return page
+
+    def _usable_text(self, text: str) -> bool:
+        """文字層夠長且不是亂碼 (無法對應 unicode 的字形) 才視為可用"""
+        content = "".join(text.split())
+        if len(content) < self.text_min_chars:
+            return False
+        garbage = content.count("\ufffd") + content.count("(cid:") * 5
+        return garbage / len(content) < 0.01
+
+    def _classify_pdf_pages(self, path: str, pages: int) -> dict[int, TextPage]:
+        """
+        以 poppler 的 pdftotext / pdfimages 一次取得整份 PDF 的文字層與圖片清單，
+        回傳文字可用且圖片佔頁面比例不超過 text_max_image_ratio 的頁面 (從 0 開始的頁碼)，其餘頁面交給 VLM
+        """
         try:
-            # 嘗試作為 PDF 處理
-            if isinstance(pdf, str):
-                with open(pdf, "rb") as f:
-                    pdf = f.read()
-            images = convert_from_bytes(pdf)
-            return images
+            text = subprocess.run(
+                ["pdftotext", "-layout", "-enc", "UTF-8", path, "-"],
+                capture_output=True, check=True, timeout=300
+            ).stdout.decode("utf-8", errors="replace")
+            listing = subprocess.run(
+                ["pdfimages", "-list", path],
+                capture_output=True, check=True, timeout=300
+            ).stdout.decode("utf-8", errors="replace")
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Failed to read PDF text layer, sending all pages to VLM: {e}")
+            return {}
+        width, height = 612.0, 792.0
+        try:
+            size = re.search(r"([\d.]+) x ([\d.]+)", pdfinfo_from_path(path).get("Page size", ""))
+            if size:
+                width, height = float(size.group(1)), float(size.group(2))
         except Exception:
+            pass
+        image_ratio: dict[int, float] = {}
+        # page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio
+        for line in listing.splitlines()[2:]:
+            cols = line.split()
             try:
-                # 如果 PDF 轉換失敗，嘗試作為圖片處理
-                image = open_image(BytesIO(pdf))
-                return [image]
-            except Exception as e:
-                print(f"無法將資料轉換為圖片: {e}")
-                raise ValueError("無法處理的檔案格式")
+                if cols[2] != "image":
+                    continue
+                idx = int(cols[0]) - 1
+                area = (int(cols[3]) / float(cols[12]) * 72) * (int(cols[4]) / float(cols[13]) * 72)
+            except (IndexError, ValueError, ZeroDivisionError):
+                continue
+            image_ratio[idx] = image_ratio.get(idx, 0.0) + area / (width * height)
+        result: dict[int, TextPage] = {}
+        for idx, page_text in enumerate(text.split("\f")[:pages]):
+            if image_ratio.get(idx, 0.0) > self.text_max_image_ratio or not self._usable_text(page_text):
+                continue
+            result[idx] = self._parse_text_page(page_text)
+        return result
+
+    def _get_office_type(self, ext: str) -> Literal["calc", "impress", "writer"] | None:
+        if ext in [".xls", ".xlsx"]:
+            return "calc"
+        if ext in [".doc", ".docx", ".odt", ".ods", ".odp"]:
+            return "writer"
+        if ext in [".ppt", ".pptx"]:
+            return "impress"
+        return None
+
+    @contextmanager
+    def _pdf_path(self, pdf: bytes | str) -> Iterator[str]:
+        """PDF 路徑直接使用，bytes 則寫入暫存檔一次，讓 poppler 從磁碟讀取"""
+        if isinstance(pdf, str):
+            yield pdf
+            return
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            tmp.write(pdf)
+            tmp.flush()
+            yield tmp.name
+
+    def iter_pdf_pages(
+        self,
+        pdf: bytes | str,
+        first_page: int = 1,
+        last_page: int | None = None,
+        dpi: int | None = None,
+        fmt: str | None = None
+    ) -> Iterator[Image]:
+        """
+        逐頁 (或每次 pages_per_render 頁) 將 PDF 渲染成圖片，記憶體中只保留正在處理的頁面。
+        若不是 PDF 則嘗試當作單張圖片開啟。
+        """
+        for _, image in self.iter_pdf_pages_indexed(pdf, first_page, last_page, dpi, fmt):
+            yield image
+
+    def iter_pdf_pages_indexed(
+        self,
+        pdf: bytes | str,
+        first_page: int = 1,
+        last_page: int | None = None,
+        dpi: int | None = None,
+        fmt: str | None = None,
+        skip: Container[int] = (),
+        text_layer: bool = False
+    ) -> Iterator[tuple[int, Image | TextPage]]:
+        """
+        同 iter_pdf_pages，但回傳 (從 0 開始的頁碼, 圖片)，skip 中的頁碼 (從 0 開始) 不會被渲染。
+        text_layer 為 True 時，有可用文字層的頁面回傳 TextPage 而不渲染。
+        """
+        with self._pdf_path(pdf) as path:
+            try:
+                pages = int(pdfinfo_from_path(path)["Pages"])
+            except Exception:
+                try:
+                    # 如果 PDF 轉換失敗，嘗試作為圖片處理
+                    image = open_image(path)
+                    image.load()
+                except Exception as e:
+                    print(f"無法將資料轉換為圖片: {e}")
+                    raise ValueError("無法處理的檔案格式")
+                if 0 not in skip:
+                    yield 0, image
+                return
+            last_page = min(last_page or pages, pages)
+            text_pages = self._classify_pdf_pages(path, pages) if text_layer else {}
+            if text_pages:
+                print(f"{len(text_pages)}/{pages} pages have a usable text layer, skipping VLM for them")
+            wanted = deque(page for page in range(max(1, first_page), last_page + 1) if page - 1 not in skip)
+            while wanted:
+                if wanted[0] - 1 in text_pages:
+                    page = wanted.popleft()
+                    yield page - 1, text_pages.pop(page - 1)
+                    continue
+                # 每次渲染一段連續且不超過 pages_per_render 的頁面
+                start = end = wanted.popleft()
+                while wanted and wanted[0] == end + 1 and wanted[0] - 1 not in text_pages and end - start + 1 < self.pages_per_render:
+                    end = wanted.popleft()
+                images = convert_from_path(
+                    path,
+                    dpi=dpi or self.dpi,
+                    fmt=fmt or self.render_format,
+                    first_page=start,
+                    last_page=end,
+                    thread_count=self.render_threads
+                )
+                for offset, image in enumerate(images):
+                    yield start - 1 + offset, image
 
     @override
-    def _convert_office_to_image(self, office: Union[bytes, str], types: Literal["calc", "impress", "writer"]) -> list[Image]:
-        """Word / PowerPoint → 圖片"""
+    def _convert_pdf_to_image(self, pdf: bytes | str) -> list[Image]:
+        """將 PDF 路徑、PDF bytes 或圖片轉換為 Image 列表"""
+        return list(self.iter_pdf_pages(pdf))
+
+    def _convert_office_to_pdf(self, office: Union[bytes, str], types: Literal["calc", "impress", "writer"], outdir: str) -> str:
+        """Word / Excel / PowerPoint → PDF，回傳 outdir 中的 PDF 路徑"""
         methods = {
             "calc":"calc_pdf_Export",
             "impress":"impress_pdf_Export",
@@ -73,24 +355,32 @@ class FileManageService(BaseFileManageService):
         method = methods.get(types)
         if not method:
             raise ValueError(f"不支援的格式: {types}")
+        # 儲存檔案
+        if isinstance(office, bytes):
+            input_file = os.path.join(outdir, "input_file.docx")
+            with open(input_file, "wb") as f:
+                f.write(office)
+        else:
+            input_file = office
+        if self.soffice_workers > 0:
+            # 交給常駐的 LibreOffice worker 池轉 PDF，避免每份文件都重新啟動 soffice
+            return get_office_pool(self.soffice_path).convert(input_file, types, outdir)
+        # 用 LibreOffice 轉 PDF
+        subprocess.run([
+            self.soffice_path, "--headless", "--norestore", "--convert-to", f"pdf:{method}",
+            "--outdir", outdir, input_file
+        ], check=True)
+
+        print(f"saved to temp directory: {outdir}")
+        print("temp path files: ", os.listdir(outdir))
+        pdf_file = os.path.splitext(os.path.basename(input_file))[0] + ".pdf"
+        return os.path.join(outdir, pdf_file)
+
+    @override
+    def _convert_office_to_image(self, office: Union[bytes, str], types: Literal["calc", "impress", "writer"]) -> list[Image]:
+        """Word / PowerPoint → 圖片"""
         with tempfile.TemporaryDirectory() as tmpdir:
-            # 儲存檔案
-            if isinstance(office, bytes):
-                input_file = os.path.join(tmpdir, "input_file.docx")
-                with open(input_file, "wb") as f:
-                    f.write(office)
-            else:
-                input_file = office
-            # 用 LibreOffice 轉 PDF
-            subprocess.run([
-                self.soffice_path, "--headless", "--norestore", "--convert-to", f"pdf:{method}",
-                "--outdir", tmpdir, input_file
-            ], check=True)
-
-            print(f"saved to temp directory: {tmpdir}")
-            print("temp path files: ", os.listdir(tmpdir))
-            pdf_file = os.path.splitext(os.path.basename(input_file))[0] + ".pdf"
-            pdf_path = os.path.join(tmpdir, pdf_file)
+            pdf_path = self._convert_office_to_pdf(office, types, tmpdir)
             # 轉成圖片
             images = self._convert_pdf_to_image(pdf_path)
             return images
@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from hashlib import sha256
+from typing import Literal
+from uuid import NAMESPACE_URL, UUID, uuid5
+
+PageState = Literal["rendered", "extracted", "inserted"]
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    以串流方式計算檔案的 sha256，不會把整個檔案讀進記憶體
+    """
+    digest = sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_namespace() -> UUID:
+    try:
+        return UUID(os.getenv("VECTOR_NAMESPACE") or "")
+    except ValueError:
+        return NAMESPACE_URL
+
+def document_id(content_hash: str) -> UUID:
+    """
+    相同內容的檔案永遠得到相同的 doc_id，重新匯入時會覆寫而不是產生重複向量
+    """
+    return uuid5(get_namespace(), content_hash)
+
+def object_id(doc_id: UUID | str, page: int, kind: str, index: int, chunk: int = 0) -> UUID:
+    return uuid5(UUID(str(doc_id)), f"{page}:{kind}:{index}:{chunk}")
+
+class IngestJournal:
+    """
+    以檔案內容 hash 為鍵的 SQLite 進度紀錄，記錄每一頁已渲染、已解析、已寫入的狀態，
+    中斷後重新執行可跳過已完成的頁面，未變更的檔案重新匯入時直接略過。
+    每份文件記錄寫入目標 (向量庫、collection 與 chunk 設定的 fingerprint)，目標改變時已寫入的頁面需要重新寫入，
+    VLM 解析結果仍可沿用。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                content_hash TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                file_path TEXT,
+                total_pages INTEGER,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                content_hash TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                extracted TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, page)
+            );
+            """
+        )
+        # 舊版的 journal 沒有 target / objects 欄位
+        for table, column in (("documents", "target"), ("pages", "objects")):
+            if column not in {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+        self.conn.commit()
+
+    def start(self, content_hash: str, file_path: str | None = None, target: str | None = None) -> tuple[str, bool]:
+        """
+        開始 (或續傳) 一份文件，回傳 (doc_id, 是否已全部完成)。
+        target 與上次寫入時不同時，已寫入的頁面改回已解析狀態，讓它們重新切 chunk 並寫入
+        """
+        doc_id = document_id(content_hash).hex
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, target FROM documents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row is None:
+                self.conn.execute(
+                    "INSERT INTO documents (content_hash, doc_id, file_path, status, target, updated_at) VALUES (?, ?, ?, 'running', ?, ?)",
+                    (content_hash, doc_id, file_path, target, time.time())
+                )
+                self.conn.commit()
+                return doc_id, False
+            status, previous = row
+            if target is None or previous == target:
+                return doc_id, status == "done"
+            if previous is None:
+                # 舊版 journal 沒有記錄目標，視為以目前的設定寫入
+                self.conn.execute("UPDATE documents SET target = ? WHERE content_hash = ?", (target, content_hash))
+                self.conn.commit()
+                return doc_id, status == "done"
+            print(f"ingest target of {doc_id} changed, pages will be inserted again")
+            self._invalidate(content_hash)
+            self.conn.execute("UPDATE documents SET target = ? WHERE content_hash = ?", (target, content_hash))
+            self.conn.commit()
+            return doc_id, False
+
+    def invalidate(self, content_hash: str) -> None:
+        """
+        向量庫中的資料已不存在 (例如 collection 被刪除) 時，讓已寫入的頁面重新寫入
+        """
+        with self.lock:
+            self._invalidate(content_hash)
+            self.conn.commit()
+
+    def _invalidate(self, content_hash: str) -> None:
+        self.conn.execute(
+            "UPDATE pages SET state = 'extracted', updated_at = ? WHERE content_hash = ? AND state = 'inserted'",
+            (time.time(), content_hash)
+        )
+        self.conn.execute(
+            "UPDATE documents SET status = 'running', updated_at = ? WHERE content_hash = ?", (time.time(), content_hash)
+        )
+
+    def page_states(self, content_hash: str) -> dict[int, PageState]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT page, state FROM pages WHERE content_hash = ?", (content_hash,)
+            ).fetchall()
+        return {page: state for page, state in rows}
+
+    def extracted(self, content_hash: str, states: tuple[PageState, ...] = ("extracted", "inserted")) -> dict[int, dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT page, extracted FROM pages WHERE content_hash = ? AND state IN ({','.join('?' * len(states))})",
+                (content_hash, *states)
+            ).fetchall()
+        return {page: json.loads(data or "{}") for page, data in rows}
+
+    def page_objects(self, content_hash: str, page: int) -> dict[str, list[str]]:
+        """
+        上次寫入這一頁時的物件 id (依 collection)，重新寫入時用來刪除不再產生的 chunk
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT objects FROM pages WHERE content_hash = ? AND page = ?", (content_hash, page)
+            ).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def mark(
+        self,
+        content_hash: str,
+        page: int,
+        state: PageState,
+        extracted: dict | None = None,
+        objects: dict[str, list[str]] | None = None
+    ) -> None:
+        with self.lock:
+            if objects is not None:
+                self.conn.execute(
+                    """
+                    INSERT INTO pages (content_hash, page, state, objects, updated_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (content_hash, page) DO UPDATE SET
+                        state = excluded.state, objects = excluded.objects, updated_at = excluded.updated_at
+                    """,
+                    (content_hash, page, state, json.dumps(objects), time.time())
+                )
+            elif extracted is None:
+                self.conn.execute(
+                    """
+                    INSERT INTO pages (content_hash, page, state, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (content_hash, page) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+                    """,
+                    (content_hash, page, state, time.time())
+                )
+            else:
+                self.conn.execute(
+                    """
+                    INSERT INTO pages (content_hash, page, state, extracted, updated_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (content_hash, page) DO UPDATE SET
+                        state = excluded.state, extracted = excluded.extracted, updated_at = excluded.updated_at
+                    """,
+                    (content_hash, page, state, json.dumps(extracted, ensure_ascii=False), time.time())
+                )
+            self.conn.commit()
+
+    def finish(self, content_hash: str, total_pages: int) -> bool:
+        """
+        所有頁面都寫入後將文件標記為完成，回傳是否完成
+        """
+        with self.lock:
+            inserted = self.conn.execute(
+                "SELECT COUNT(*) FROM pages WHERE content_hash = ? AND state = 'inserted'", (content_hash,)
+            ).fetchone()[0]
+            done = inserted >= total_pages
+            self.conn.execute(
+                "UPDATE documents SET total_pages = ?, status = ?, updated_at = ? WHERE content_hash = ?",
+                (total_pages, "done" if done else "running", time.time(), content_hash)
+            )
+            self.conn.commit()
+        return done
+
+    def reset(self, content_hash: str) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM pages WHERE content_hash = ?", (content_hash,))
+            self.conn.execute("DELETE FROM documents WHERE content_hash = ?", (content_hash,))
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
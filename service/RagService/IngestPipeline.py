@@ -0,0 +1,142 @@
+import threading
+import time
+from queue import Empty, Full, Queue
+from typing import Any, Callable, Generic, Iterable, Iterator, TypeVar
+
+from PIL.Image import Image
+from pydantic import BaseModel, ConfigDict, Field
+
+from src.component.typing.vectorbase import Document
+
+T = TypeVar("T")
+
+_DONE = object()
+
+class PageTask(BaseModel):
+    """
+    流水線中一頁的工作項目，每個階段會填入自己的輸出並釋放前一階段不再需要的資料
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: int
+    sequence: int = 0  # 進入流水線的順序，完成後依此順序回報
+    image: Image | None = None
+    payload: str | None = None
+    extracted: dict | None = None
+    documents: dict[str, list[Document]] = Field(default_factory=dict)
+    inserted: dict[str, int] = Field(default_factory=dict)
+    timings: dict[str, float] = Field(default_factory=dict)
+
+class PageProgress(BaseModel):
+    """
+    單頁完成時的進度回報，index 為從 0 開始的頁碼，timings 為各階段耗時 (秒)
+    """
+    index: int
+    completed: int
+    inserted: dict[str, int] = Field(default_factory=dict)
+    timings: dict[str, float] = Field(default_factory=dict)
+    elapsed: float = 0.0
+    extracted: dict = Field(default_factory=dict)
+
+class PipelineStage(Generic[T]):
+
+    def __init__(self, name: str, handler: Callable[[T], T | None], workers: int = 1) -> None:
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+
+class IngestPipeline(Generic[T]):
+    """
+    以有界佇列串接多個階段，每個階段有自己的執行緒，讓第 N+1 頁渲染時第 N 頁在跑 VLM、第 N-1 頁在寫入。
+    任一階段拋出例外時整條流水線停止，例外會在呼叫端重新拋出。
+    """
+
+    def __init__(self, stages: list[PipelineStage[T]], queue_size: int = 4) -> None:
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+
+    def run(self, source: Iterable[T]) -> Iterator[T]:
+        queues: list[Queue] = [Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+        errors: list[BaseException] = []
+        threads: list[threading.Thread] = []
+
+        def put(queue: Queue, item: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def fail(e: BaseException) -> None:
+            errors.append(e)
+            stop.set()
+
+        def feed() -> None:
+            try:
+                for item in source:
+                    if not put(queues[0], item):
+                        return
+            except BaseException as e:
+                fail(e)
+                return
+            put(queues[0], _DONE)
+
+        def work(stage: PipelineStage[T], inbox: Queue, outbox: Queue, remaining: list[int], lock: threading.Lock) -> None:
+            while not stop.is_set():
+                try:
+                    item = inbox.get(timeout=0.1)
+                except Empty:
+                    continue
+                if item is _DONE:
+                    # 讓同階段其他 worker 也能收到結束訊號
+                    put(inbox, _DONE)
+                    with lock:
+                        remaining[0] -= 1
+                        last = remaining[0] == 0
+                    if last:
+                        put(outbox, _DONE)
+                    return
+                start = time.perf_counter()
+                try:
+                    result = stage.handler(item)
+                except BaseException as e:
+                    print(f"pipeline stage {stage.name} failed: {e}")
+                    fail(e)
+                    return
+                timings = getattr(result, "timings", None)
+                if isinstance(timings, dict):
+                    timings[stage.name] = time.perf_counter() - start
+                if result is not None and not put(outbox, result):
+                    return
+
+        threads.append(threading.Thread(target=feed, name="pipeline-source", daemon=True))
+        for idx, stage in enumerate(self.stages):
+            remaining, lock = [stage.workers], threading.Lock()
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=work,
+                    args=(stage, queues[idx], queues[idx + 1], remaining, lock),
+                    name=f"pipeline-{stage.name}-{worker}",
+                    daemon=True
+                ))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while not stop.is_set():
+                try:
+                    item = queues[-1].get(timeout=0.1)
+                except Empty:
+                    continue
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
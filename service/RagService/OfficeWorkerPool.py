@@ -0,0 +1,243 @@
+import atexit
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from queue import Queue
+from typing import Literal
+
+try:
+    import uno
+except ImportError:
+    uno = None
+
+OfficeType = Literal["calc", "impress", "writer"]
+
+PDF_FILTERS: dict[str, str] = {
+    "calc": "calc_pdf_Export",
+    "impress": "impress_pdf_Export",
+    "writer": "writer_pdf_Export",
+}
+
+class OfficeJob:
+
+    def __init__(self, input_file: str, types: OfficeType, outdir: str) -> None:
+        self.input_file = input_file
+        self.types = types
+        self.outdir = outdir
+        self.future: Future = Future()
+
+class OfficeWorker:
+    """
+    一個常駐的 soffice --headless 程序，使用自己的 profile 目錄並在 socket 上監聽，透過 UNO 轉檔。
+    (許多版本的 soffice --convert-to 遇到 profile 已被常駐程序使用時會直接結束而不轉檔，因此不以 CLI 轉交。)
+    """
+
+    def __init__(self, soffice_path: str, worker_id: int, timeout: float = 120.0, startup_timeout: float = 60.0) -> None:
+        self.soffice_path = soffice_path
+        self.worker_id = worker_id
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.profile_dir = tempfile.mkdtemp(prefix=f"soffice-profile-{worker_id}-")
+        self.profile_url = Path(self.profile_dir).as_uri()
+        self.port = 0
+        self.process: subprocess.Popen | None = None
+        self.desktop = None
+
+    def _free_port(self) -> int:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def _wait_ready(self) -> None:
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"soffice worker {self.worker_id} exited with code {self.process.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        raise TimeoutError(f"soffice worker {self.worker_id} did not start in {self.startup_timeout}s")
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self) -> None:
+        self.port = self._free_port()
+        self.process = subprocess.Popen([
+            self.soffice_path, "--headless", "--invisible", "--nologo", "--nodefault",
+            "--norestore", "--nolockcheck",
+            f"-env:UserInstallation={self.profile_url}",
+            f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._wait_ready()
+        self.desktop = None
+        print(f"soffice worker {self.worker_id} started on port {self.port}")
+
+    def stop(self) -> None:
+        self.desktop = None
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def restart(self) -> None:
+        print(f"restarting soffice worker {self.worker_id}")
+        self.stop()
+        self.start()
+
+    def close(self) -> None:
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def _get_desktop(self):
+        if self.desktop is None:
+            local = uno.getComponentContext()
+            resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+            context = resolver.resolve(f"uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext")
+            self.desktop = context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        return self.desktop
+
+    def _property(self, name: str, value):
+        prop = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+        prop.Name = name
+        prop.Value = value
+        return prop
+
+    def _convert_with_uno(self, input_file: str, pdf_path: str, filter_name: str) -> None:
+        desktop = self._get_desktop()
+        document = desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(input_file)), "_blank", 0,
+            (self._property("Hidden", True), self._property("ReadOnly", True))
+        )
+        if document is None:
+            raise ValueError(f"LibreOffice 無法開啟檔案: {input_file}")
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(os.path.abspath(pdf_path)),
+                (self._property("FilterName", filter_name),)
+            )
+        finally:
+            document.close(True)
+
+    def convert(self, job: OfficeJob) -> str:
+        if not self.alive():
+            self.start()
+        filter_name = PDF_FILTERS.get(job.types)
+        if not filter_name:
+            raise ValueError(f"不支援的格式: {job.types}")
+        pdf_path = os.path.join(job.outdir, os.path.splitext(os.path.basename(job.input_file))[0] + ".pdf")
+        # UNO 呼叫無法中斷，逾時由 watchdog 直接結束 soffice 程序
+        watchdog = threading.Timer(self.timeout, self.stop)
+        watchdog.start()
+        started = time.monotonic()
+        try:
+            self._convert_with_uno(job.input_file, pdf_path, filter_name)
+        except Exception as e:
+            if time.monotonic() - started >= self.timeout:
+                raise TimeoutError(f"LibreOffice 轉檔逾時 ({self.timeout}s): {job.input_file}") from e
+            raise
+        finally:
+            watchdog.cancel()
+        if not os.path.exists(pdf_path):
+            raise RuntimeError(f"LibreOffice 沒有產生 PDF: {job.input_file}")
+        return pdf_path
+
+class OfficeWorkerPool:
+    """
+    常駐 LibreOffice worker 池，以工作佇列分派轉檔，每個工作有逾時限制，worker 當掉或逾時後會自動重啟。
+    需要 pyuno，沒有時請以 uno_available() 判斷並改用一次性的 soffice --convert-to。
+    """
+
+    def __init__(self, soffice_path: str, size: int = 2, timeout: float = 120.0) -> None:
+        if uno is None:
+            raise RuntimeError("OfficeWorkerPool requires pyuno (the uno module)")
+        self.queue: Queue[OfficeJob | None] = Queue()
+        self.workers = [OfficeWorker(soffice_path, idx, timeout=timeout) for idx in range(max(1, size))]
+        self.threads = [
+            threading.Thread(target=self._run, args=(worker,), name=f"soffice-worker-{worker.worker_id}", daemon=True)
+            for worker in self.workers
+        ]
+        self.closed = False
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self, worker: OfficeWorker) -> None:
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                job.future.set_result(worker.convert(job))
+            except Exception as e:
+                job.future.set_exception(e)
+                if not worker.alive() or isinstance(e, TimeoutError):
+                    try:
+                        worker.restart()
+                    except Exception as restart_error:
+                        print(f"Failed to restart soffice worker {worker.worker_id}: {restart_error}")
+        worker.close()
+
+    def submit(self, input_file: str, types: OfficeType, outdir: str) -> Future:
+        if self.closed:
+            raise RuntimeError("OfficeWorkerPool is closed")
+        job = OfficeJob(input_file, types, outdir)
+        self.queue.put(job)
+        return job.future
+
+    def convert(self, input_file: str, types: OfficeType, outdir: str) -> str:
+        return self.submit(input_file, types, outdir).result()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def uno_available() -> bool:
+    return uno is not None
+
+_pools: dict[str, OfficeWorkerPool] = {}
+_pools_lock = threading.Lock()
+
+def get_office_pool(soffice_path: str) -> OfficeWorkerPool:
+    """
+    取得行程共用的 LibreOffice worker 池，大小與逾時來自 SOFFICE_WORKERS 與 SOFFICE_TIMEOUT
+    """
+    with _pools_lock:
+        pool = _pools.get(soffice_path)
+        if pool is None or pool.closed:
+            pool = OfficeWorkerPool(
+                soffice_path,
+                size=int(os.getenv("SOFFICE_WORKERS", "2")),
+                timeout=float(os.getenv("SOFFICE_TIMEOUT", "120"))
+            )
+            _pools[soffice_path] = pool
+        return pool
+
+@atexit.register
+def close_office_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -1,17 +1,33 @@
-from concurrent.futures import as_completed
-from concurrent.futures.thread import ThreadPoolExecutor
 import json
-from uuid import uuid4
+import os
+import time
+from hashlib import sha256
+from typing import Callable, Iterable, Iterator
+from uuid import UUID
 
 from PIL.Image import Image
+from src.component.typing.fileManagebase import TextPage
+from src.component.typing.vectorbase import Document
+from src.component.utils.Concurrency import AdaptiveLimiter, get_limiter
+from src.component.utils.Resilience import CircuitOpenError, RetryPolicy, limit_calls
 from src.service import Service
+from src.service.RagService.Chunker import get_chunker
+from src.service.RagService.ExtractionCache import dhash, get_extraction_cache
 from src.service.RagService.FileManagerServiceImpl import FileManageService
+from src.service.RagService.IngestJournal import IngestJournal, hash_file, object_id
+from src.service.RagService.IngestPipeline import IngestPipeline, PageProgress, PageTask, PipelineStage
 
 
 class RagService:
     def __init__(self) -> None:
         self.file_manager = FileManageService()
         self.vector_service = Service().get_service('vector')
+        self.vlm_type = os.getenv("VLM_TYPE", "openai").lower()
+        self.queue_size = int(os.getenv("RAG_QUEUE_SIZE", "4"))
+        self.retry_policy = RetryPolicy(max_attempts=int(os.getenv("VLM_MAX_RETRIES", "4")))
+        self.extraction_cache = get_extraction_cache()
+        self.chunker = get_chunker()
+        self.journal = IngestJournal(os.getenv("RAG_JOURNAL_PATH", "config/ingest_journal.sqlite"))
         self.vlm_template = """
             你是一個擅長從一張圖片中分類出裡面包含圖片、表格、文字三大類並提供區域座標的助手，使用者會提供圖片，你的任務是抓出該三大類的座標，並回傳一個 JSON。
             
@@ -56,25 +72,74 @@ class RagService:
             }
         """
 
-    def invoke(self, file_path:str) -> tuple[str,list[dict]]:
+    def invoke(
+        self,
+        file_path:str,
+        on_progress:Callable[[PageProgress], None] | None = None
+    ) -> tuple[str,list[dict]]:
         """
-        這個用於調用整個 RAG 流程，回傳 doc_id UUID 和 圖片 list[Image]。
+        這個用於調用整個 RAG 流程，以串流方式逐頁處理，回傳 doc_id UUID 和 依頁碼排序的 VLM 解析結果 list[dict]。
+        doc_id 由檔案內容 hash 決定，進度記錄在 journal 中：中斷後重新執行只處理尚未寫入的頁面，
+        已完整匯入且內容未變更的檔案直接回傳先前的結果。
         """
-        doc_id = uuid4().hex
-        self.file_manager.file_to_image(file_path)
-        images = self.file_manager.get_images()
-        self.insert_images(doc_id, images)
-        return doc_id, images
+        content_hash = hash_file(file_path)
+        doc_id, done = self.journal.start(content_hash, file_path, self._ingest_target())
+        if done and not self._collections_present():
+            print(f"collections of {doc_id} no longer exist, inserting it again")
+            self.journal.invalidate(content_hash)
+            done = False
+        results = self.journal.extracted(content_hash)
+        if done:
+            print(f"{file_path} is already ingested as {doc_id}, skipping")
+            return doc_id, [results[idx] for idx in sorted(results)]
+        states = self.journal.page_states(content_hash)
+        # 已解析但尚未寫入的頁面不必重新渲染與呼叫 VLM
+        pending = {idx: data for idx, data in results.items() if states.get(idx) == "extracted"}
+        if results:
+            print(f"resuming {doc_id}: {len(results) - len(pending)} pages inserted, {len(pending)} pages extracted")
+        pages = self.file_manager.iter_pages(file_path, skip=frozenset(results))
+        for progress in self.iter_insert_pages(doc_id, pages, pending, content_hash):
+            results[progress.index] = progress.extracted
+            if on_progress is not None:
+                on_progress(progress)
+        if not self.journal.finish(content_hash, len(results)):
+            print(f"some pages of {doc_id} failed, run again to retry them")
+        return doc_id, [results[idx] for idx in sorted(results)]
         
-    def process_image(self, image:Image | str, idx:int, retried:int = 0) -> dict:
-        if retried > 3:
-            return {}
-        client = Service().get_service('vision')
-        if isinstance(image, Image):
-            image_base64 = self.file_manager.parse_Image_to_base64(image)
+    def _ingest_target(self) -> str:
+        """
+        寫入目標的 fingerprint：向量庫位置、collection 與 chunk 設定，任一項改變時 journal 中已完成的文件會重新寫入
+        """
+        types = os.getenv("VECTOR_TYPE", "weaviate").lower()
+        if types == "local":
+            location = [os.path.abspath(os.getenv("VECTOR_LOCAL_PATH", "config/vector_store"))]
         else:
-            image_base64 = image
-        message = [{
+            location = [self.vector_service.host, self.vector_service.port]
+        target = [types, *location, sorted(self._collections().values()), self.chunker.fingerprint]
+        return sha256(json.dumps(target).encode("utf-8")).hexdigest()
+
+    def _collections_present(self) -> bool:
+        """
+        檢查寫入目標的 collection 是否都還存在 (例如沒有被刪除後重建)
+        """
+        try:
+            existing = set(self.vector_service.list_collections())
+            return all(
+                self.vector_service._collection_name(name) in existing
+                for name in self._collections().values()
+            )
+        except Exception as e:
+            print(f"Failed to list collections, assuming they exist: {e}")
+            return True
+
+    def _get_vlm_limiter(self) -> AdaptiveLimiter:
+        """
+        依 VLM host 取得共用的自適應並行數控制，同時處理的多份文件會共享同一個上限
+        """
+        return get_limiter(Service().get_service('vision').host, self.vlm_type)
+    
+    def _build_vlm_message(self, image_base64:str, idx:int) -> list[dict]:
+        return [{
             "role": "user",
             "content": [
                 {
@@ -84,36 +149,261 @@ class RagService:
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{image_base64}"
+                        "url": self.file_manager.get_data_url(image_base64)
                     }
                 }
             ]
         }]
-        try:
-            response = client.chat(message)
-            image_content = response.choices[0].message.content.replace("```json","").replace("```","").replace("\\\"","\"")
-            data = json.loads(image_content)
-            return data
-        except Exception as e:
-            print(f"Failed to get image content: {str(e)[:300]}")
-            # print(f"vlm output: {image_content or ''}")
-            print("skipping page...")
-            return self.process_image(image, idx, retried + 1)
     
-    def insert_images(self, doc_id:str, images:list[Image | str]):
-        objects:list[dict] = []
-        with ThreadPoolExecutor(max_workers=3) as executer:
-            futures = [executer.submit(self.process_image, image, idx) for idx, image in enumerate(images)]
-            for result in as_completed(futures):
-                objects.append(result.result())
-        for obj in objects:
-            for table in obj.get("tables", []):
-                table["docId"] = doc_id
-                self.vector_service.insert(table, self.vector_service.table_database_name)
-            for image in obj.get("images", []):
-                image["docId"] = doc_id
-                self.vector_service.insert(image, self.vector_service.image_database_name)
-            for label in obj.get("labels", []):
-                label["docId"] = doc_id
-                self.vector_service.insert(label, self.vector_service.label_database_name)
-        print(f"inserted {len(objects)} objects to vector collection")
\ No newline at end of file
+    def process_image(self, image:Image | str, idx:int) -> dict:
+        """
+        請 VLM 解析一頁圖片。連線層錯誤由 chat service 的 resilience 層退避重試，
+        VLM 輸出不是合法 JSON 時以指數退避重送同一則訊息，斷路器開啟時直接略過該頁。
+        相同圖片、模板與模型的解析結果會從 extraction cache 取得，不再呼叫 VLM。
+        """
+        client = Service().get_service('vision')
+        if isinstance(image, Image):
+            image_base64 = self.file_manager.parse_Image_to_base64(image)
+        else:
+            image_base64 = image
+        cache = self.extraction_cache
+        if cache is not None:
+            namespace = cache.make_namespace(self.vlm_template, client.model)
+            digest = cache.make_digest(image_base64)
+            phash = None
+            if cache.perceptual:
+                phash = dhash(image if isinstance(image, Image) else self.file_manager.parse_base64_to_Image(image_base64))
+            cached = cache.get(namespace, digest, phash)
+            if cached is not None:
+                return cached
+        message = self._build_vlm_message(image_base64, idx)
+        for attempt in range(self.retry_policy.max_attempts):
+            try:
+                # 只有這次 VLM 請求的每一次嘗試經過 limiter，同一 host 的一般對話不受限
+                with limit_calls(self._get_vlm_limiter()):
+                    response = client.chat(message)
+                image_content = response.choices[0].message.content.replace("```json","").replace("```","").replace("\\\"","\"")
+                data = json.loads(image_content)
+                if cache is not None and data:
+                    cache.put(namespace, digest, data, phash)
+                return data
+            except CircuitOpenError as e:
+                print(f"{e} skipping page {idx+1}...")
+                return {}
+            except json.JSONDecodeError as e:
+                print(f"Failed to parse image content: {str(e)[:300]}")
+            except Exception as e:
+                print(f"Failed to get image content: {str(e)[:300]}")
+                print("skipping page...")
+                return {}
+            if attempt + 1 < self.retry_policy.max_attempts:
+                time.sleep(self.retry_policy.backoff(attempt))
+        return {}
+    
+    def _to_documents(self, doc_id:str, items:list[dict], page:int, kind:str) -> list[Document]:
+        """
+        items 為切好的 chunk，pageId 由 doc_id、頁碼、類別與 chunk 序號決定，同一頁重新寫入時會覆寫而不會產生重複的向量
+        """
+        documents:list[Document] = []
+        for idx, item in enumerate(items):
+            metadata = {key: value for key, value in item.items() if key != "content"}
+            # 以流水線的頁碼為準，不使用 VLM 自行推測的頁碼；與先前寫入的資料相同，從 1 開始
+            metadata["docPage"] = page + 1
+            documents.append(Document(
+                docId=UUID(doc_id),
+                pageId=object_id(doc_id, page, kind, idx),
+                content=str(item.get("content") or ""),
+                metadata=metadata
+            ))
+        return documents
+    
+    def _text_page_to_extraction(self, page:TextPage, idx:int) -> dict:
+        """
+        將文字層 / 純文字頁面轉成與 VLM 輸出相同的格式，沒有座標資訊時 xy 為空
+        """
+        return {
+            "tables": [
+                {"tableName": f"table {i+1} of page {idx+1}", "docPage": idx + 1, "content": table, "xy": []}
+                for i, table in enumerate(page.tables)
+            ],
+            "images": [],
+            "labels": [
+                {"labelName": paragraph.splitlines()[0][:50], "docPage": idx + 1, "content": paragraph, "xy": []}
+                for paragraph in page.paragraphs
+            ]
+        }
+    
+    def _collections(self) -> dict[str, str]:
+        return {
+            "tables": self.vector_service.table_database_name,
+            "images": self.vector_service.image_database_name,
+            "labels": self.vector_service.label_database_name,
+        }
+    
+    def _render_stage(
+        self,
+        pages:Iterable[tuple[int, Image | TextPage | str]],
+        extracted:dict[int, dict] | None = None,
+        content_hash:str | None = None
+    ) -> Iterator[PageTask]:
+        # 先送出已解析過的頁面，它們會直接略過 VLM
+        sequence = 0
+        for idx in sorted(extracted or {}):
+            yield PageTask(index=idx, sequence=sequence, extracted=extracted[idx])
+            sequence += 1
+        pages = iter(pages)
+        while True:
+            start = time.perf_counter()
+            item = next(pages, None)
+            if item is None:
+                return
+            idx, page = item
+            task = PageTask(index=idx, sequence=sequence, timings={"render": time.perf_counter() - start})
+            sequence += 1
+            if isinstance(page, TextPage):
+                # 文字層頁面不經過編碼與 VLM
+                task.extracted = self._text_page_to_extraction(page, idx)
+            elif isinstance(page, Image):
+                task.image = page
+            else:
+                task.payload = page
+            if content_hash is not None:
+                # 文字頁面在這裡就完成解析，結果需存入 journal，重新執行或續傳時才取得回
+                if task.extracted is not None:
+                    self.journal.mark(content_hash, idx, "extracted", task.extracted)
+                else:
+                    self.journal.mark(content_hash, idx, "rendered")
+            yield task
+    
+    def _encode_stage(self, task:PageTask) -> PageTask:
+        if task.extracted is None and task.image is not None:
+            task.payload = self.file_manager.parse_Image_to_base64(task.image)
+            task.image = None
+        return task
+    
+    def _extract_stage(self, task:PageTask, content_hash:str | None = None) -> PageTask:
+        if task.extracted is not None:
+            return task
+        task.extracted = self.process_image(task.payload, task.index)
+        task.payload = None
+        # 解析失敗 (空結果) 不記錄，下次執行會重試該頁
+        if content_hash is not None and task.extracted:
+            self.journal.mark(content_hash, task.index, "extracted", task.extracted)
+        return task
+    
+    def _chunk_stage(self, doc_id:str, task:PageTask) -> PageTask:
+        for key in self._collections():
+            chunks = self.chunker.chunk_items((task.extracted or {}).get(key, []), key)
+            task.documents[key] = self._to_documents(doc_id, chunks, task.index, key)
+        return task
+    
+    def _embed_stage(self, task:PageTask) -> PageTask:
+        texts = [doc.content for documents in task.documents.values() for doc in documents]
+        self.vector_service.prepare_embeddings(texts)
+        return task
+    
+    def _insert_stage(self, task:PageTask, content_hash:str | None = None) -> PageTask:
+        failed = not task.extracted
+        objects: dict[str, list[str]] = {}
+        for key, collection_name in self._collections().items():
+            documents = task.documents.get(key) or []
+            objects[collection_name] = [doc.pageId.hex for doc in documents]
+            if not documents:
+                continue
+            result = self.vector_service.insert_many(documents, collection_name)
+            task.inserted[key] = result.inserted
+            for idx, error in result.errors.items():
+                failed = True
+                print(f"Failed to insert {key} object {idx} of page {task.index + 1}: {error[:300]}")
+        task.documents = {}
+        if content_hash is not None and not failed:
+            self._delete_stale(content_hash, task.index, objects)
+            self.journal.mark(content_hash, task.index, "inserted", objects=objects)
+        return task
+
+    def _delete_stale(self, content_hash:str, page:int, objects:dict[str, list[str]]) -> None:
+        """
+        chunk 設定改變後同一頁產生的 chunk 可能變少，刪除上次寫入但這次沒有產生的物件
+        """
+        for collection_name, ids in self.journal.page_objects(content_hash, page).items():
+            for uid in set(ids) - set(objects.get(collection_name, [])):
+                try:
+                    self.vector_service.delete(collection_name, UUID(uid))
+                except Exception as e:
+                    print(f"Failed to delete stale object {uid} from {collection_name}: {e}")
+    
+    def ingest(
+        self,
+        doc_id:str,
+        pages:Iterable[tuple[int, Image | TextPage | str]],
+        extracted:dict[int, dict] | None = None,
+        content_hash:str | None = None
+    ) -> Iterator[PageTask]:
+        """
+        以流水線處理 (頁碼, 頁面)：渲染 → PNG/base64 → VLM 解析 → 切 chunk → 向量化 → 批次寫入，各階段以有界佇列串接，
+        記憶體只保留佇列中的少數頁面。各頁依完成順序寫入向量庫，回傳的 PageTask 則依進入流水線的順序
+        (先完成的後面頁面會等前面的頁面完成後才回傳)。
+        extracted 為已解析過的頁面，會略過 VLM；有 content_hash 時各階段完成會記錄到 journal。
+        """
+        pipeline = IngestPipeline([
+            PipelineStage("encode", self._encode_stage),
+            # worker 數量取上限，實際同時送出的請求數由 AdaptiveLimiter 動態調整
+            PipelineStage("extract", lambda task: self._extract_stage(task, content_hash), workers=self._get_vlm_limiter().max_limit),
+            PipelineStage("chunk", lambda task: self._chunk_stage(doc_id, task)),
+            PipelineStage("embed", self._embed_stage),
+            PipelineStage("insert", lambda task: self._insert_stage(task, content_hash)),
+        ], queue_size=self.queue_size)
+        pages_count = 0
+        inserted = 0
+        waiting: dict[int, PageTask] = {}
+        next_sequence = 0
+        for task in pipeline.run(self._render_stage(pages, extracted, content_hash)):
+            pages_count += 1
+            inserted += sum(task.inserted.values())
+            waiting[task.sequence] = task
+            while next_sequence in waiting:
+                yield waiting.pop(next_sequence)
+                next_sequence += 1
+        for sequence in sorted(waiting):
+            yield waiting[sequence]
+        print(f"inserted {inserted} objects from {pages_count} pages to vector collection")
+    
+    def iter_insert_pages(
+        self,
+        doc_id:str,
+        pages:Iterable[tuple[int, Image | TextPage | str]],
+        extracted:dict[int, dict] | None = None,
+        content_hash:str | None = None
+    ) -> Iterator[PageProgress]:
+        """
+        逐頁寫入並回傳進度，每頁完成時即可被搜尋到，不必等整份文件處理完
+        """
+        started = time.perf_counter()
+        for completed, task in enumerate(self.ingest(doc_id, pages, extracted, content_hash), start=1):
+            yield PageProgress(
+                index=task.index,
+                completed=completed,
+                inserted=task.inserted,
+                timings=task.timings,
+                elapsed=time.perf_counter() - started,
+                extracted=task.extracted or {}
+            )
+    
+    def iter_insert_images(self, doc_id:str, images:Iterable[Image | str]) -> Iterator[PageProgress]:
+        return self.iter_insert_pages(doc_id, enumerate(images))
+    
+    def insert_images(
+        self,
+        doc_id:str,
+        images:Iterable[Image | str],
+        on_progress:Callable[[PageProgress], None] | None = None
+    ) -> list[dict]:
+        """
+        寫入所有頁面，每完成一頁呼叫 on_progress，回傳依頁碼排序的 VLM 解析結果
+        """
+        results:dict[int, dict] = {}
+        for progress in self.iter_insert_images(doc_id, images):
+            results[progress.index] = progress.extracted
+            if on_progress is not None:
+                on_progress(progress)
+        return [results[idx] for idx in sorted(results)]
\ No newline at end of file
@@ -0,0 +1,200 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Literal
+from uuid import UUID
+
+import numpy as np
+
+from src.component.typing.vectorbase import BaseVectorService, Document, InsertResult
+
+CacheKey = tuple[str, str, int, float, str]
+
+class CacheEntry:
+
+    def __init__(self, results: list[Document], expires_at: float, embedding: np.ndarray | None = None) -> None:
+        self.results = results
+        self.expires_at = expires_at
+        self.embedding = embedding
+
+class CachedVectorService:
+    """
+    包在任一 BaseVectorService 外的搜尋結果快取 (TTL + LRU)，鍵為 (collection, mode, limit, alpha, 正規化後的 query)。
+    insert / update / delete / delete_collection 會清除該 collection 的快取。
+    semantic_threshold > 0 時，query 向量與快取中的 query 餘弦相似度達門檻即視為命中。
+    其餘屬性與方法 (包含遷移與 bootstrap) 直接轉給被包裝的 service。
+    不繼承 BaseVectorService，否則基底類別的方法會綁在包裝層上，而不會經過 __getattr__ 轉給實際的 service。
+    """
+
+    def __init__(
+        self,
+        service: BaseVectorService,
+        max_items: int = 1024,
+        ttl: float = 300.0,
+        semantic_threshold: float = 0.0
+    ) -> None:
+        # 設定檢查與連線都由被包裝的 service 負責
+        self.service = service
+        self.max_items = max(1, max_items)
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.entries: OrderedDict[CacheKey, CacheEntry] = OrderedDict()
+        self.generations: dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name: str):
+        return getattr(self.service, name)
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query)).strip().casefold()
+
+    def _embed(self, query: str) -> np.ndarray | None:
+        """
+        以被包裝的 service 本身的 encoder (含其預設模型與位址) 計算 query 向量，沒有時才依設定建立
+        """
+        try:
+            if hasattr(self.service, "_get_encoder"):
+                vector = self.service._get_encoder().encode(query)
+            elif hasattr(self.service, "_get_embedding_function"):
+                vector = self.service._get_embedding_function()([query])[0]
+            else:
+                from src.component.utils import get_encoder
+                vector = get_encoder(
+                    types=self.service.model_type,
+                    model=self.service.model,
+                    api_key=self.service.api_key,
+                    api_base=self.service.baseUrl
+                ).encode(query)
+            vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        except Exception as e:
+            print(f"Failed to embed query for semantic cache: {e}")
+            return None
+        return vector / (np.linalg.norm(vector) or 1)
+
+    def _lookup(self, key: CacheKey, embedding: np.ndarray | None) -> list[Document] | None:
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires_at <= now:
+            del self.entries[key]
+            entry = None
+        if entry is None and embedding is not None:
+            best = self.semantic_threshold
+            for other_key, other in self.entries.items():
+                if other_key[:4] != key[:4] or other.embedding is None or other.expires_at <= now:
+                    continue
+                score = float(other.embedding @ embedding)
+                if score >= best:
+                    best, entry, key = score, other, other_key
+            if entry is not None:
+                self.semantic_hits += 1
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return list(entry.results)
+
+    def _invalidate(self, collection_name: str) -> None:
+        with self.lock:
+            self.generations[collection_name] = self.generations.get(collection_name, 0) + 1
+            for key in [key for key in self.entries if key[0] == collection_name]:
+                del self.entries[key]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            for name in self.generations:
+                self.generations[name] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "items": len(self.entries)
+            }
+
+    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"]="multi", limit: int=3, alpha: float=0.5) -> list[Document]:
+        key: CacheKey = (collection_name, mode, limit, float(alpha), self.normalize_query(query))
+        with self.lock:
+            results = self._lookup(key, None)
+            if results is not None:
+                self.hits += 1
+                return results
+        # 完全相同的 query 未命中時才計算向量做語意比對；關鍵字搜尋的結果取決於字面，不使用語意命中
+        embedding = self._embed(query) if self.semantic_threshold > 0 and mode != "bm25" else None
+        with self.lock:
+            results = self._lookup(key, embedding) if embedding is not None else None
+            if results is not None:
+                self.hits += 1
+                return results
+            self.misses += 1
+            generation = self.generations.get(collection_name, 0)
+        results = self.service.search_knowledge(query, collection_name, mode=mode, limit=limit, alpha=alpha)
+        with self.lock:
+            # 搜尋期間 collection 有寫入時不存入，避免快取到舊資料
+            if self.generations.get(collection_name, 0) == generation:
+                self.entries[key] = CacheEntry(list(results), time.monotonic() + self.ttl, embedding)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_items:
+                    self.entries.popitem(last=False)
+        return results
+
+    def hybrid_search(self, query: str, collection_name: str, limit: int=3, alpha: float=0.5) -> list[Document]:
+        return self.search_knowledge(query, collection_name, mode="multi", limit=limit, alpha=alpha)
+
+    def connect(self):
+        return self.service.connect()
+
+    def insert(self, data: Document, collection_name: str):
+        try:
+            return self.service.insert(data, collection_name)
+        finally:
+            self._invalidate(collection_name)
+
+    def insert_many(self, data: list[Document], collection_name: str, batch_size: int = 100) -> InsertResult:
+        try:
+            return self.service.insert_many(data, collection_name, batch_size)
+        finally:
+            self._invalidate(collection_name)
+
+    def prepare_embeddings(self, texts: list[str]):
+        return self.service.prepare_embeddings(texts)
+
+    def update(self, data: Document, collection_name: str):
+        try:
+            return self.service.update(data, collection_name)
+        finally:
+            self._invalidate(collection_name)
+
+    def delete(self, collection_name: str, uid: UUID):
+        try:
+            return self.service.delete(collection_name, uid)
+        finally:
+            self._invalidate(collection_name)
+
+    def create_collection(self, name: str, exist_ok: bool=False):
+        try:
+            return self.service.create_collection(name, exist_ok)
+        finally:
+            self._invalidate(name)
+
+    def delete_collection(self, name: str):
+        try:
+            return self.service.delete_collection(name)
+        finally:
+            self._invalidate(name)
+
+    def list_collections(self) -> list[str]:
+        return self.service.list_collections()
+
+    def close(self):
+        self.clear()
+        return self.service.close()
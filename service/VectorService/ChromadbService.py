@@ -1,81 +1,145 @@
-from typing import Literal
+import json
+import threading
+from typing import Any, Iterator, Literal
+import numpy as np
 from uuid import UUID
 from typing_extensions import override
-from src.component.typing.vectorbase import BaseVectorService, Document
+from src.component.typing.vectorbase import BaseVectorService, bootstrapped, Document, InsertResult
+from src.component.utils.EmbeddingCache import EmbeddingCache, get_embedding_cache
+from src.component.utils.SparseEncoder import BM25Index
 import chromadb
+from chromadb.api.types import Documents, Embeddings
 from chromadb.utils.embedding_functions import OllamaEmbeddingFunction, OpenAIEmbeddingFunction, HuggingFaceEmbeddingFunction
 
+class CachedEmbeddingFunction:
+    """
+    包裝 Chromadb embedding function，先查詢共用向量快取，只對未命中的文字呼叫模型
+    """
+
+    def __init__(self, function, cache: EmbeddingCache, model_type: str, model: str | None) -> None:
+        self.function = function
+        self.cache = cache
+        self.model_type = model_type
+        self.model = model
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        vectors = self.cache.get_many(self.model_type, self.model, texts)
+        missing = [idx for idx, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.function([texts[idx] for idx in missing])
+            self.cache.put_many(self.model_type, self.model, [texts[idx] for idx in missing], computed)
+            for idx, vector in zip(missing, computed):
+                vectors[idx] = vector
+        return [np.asarray(vector, dtype=np.float32) for vector in vectors]
+
+    def __getattr__(self, name: str):
+        return getattr(self.function, name)
+
 class ChromadbService(BaseVectorService):
     
     def __init__(self) -> None:
         super().__init__()
-        self.connect()
-        self.collections = [self.table_database_name, self.image_database_name, self.label_database_name]
-        self.backup_data = None
-        if self.is_need_recreate:
-            print("start to recreate database")
-            self._backup_data()
-            for collection in self.collections:
-                self.delete_collection(collection)
-        for collection in self.collections:
-            self.create_collection(collection, exist_ok=True)
-        if self.backup_data:
-            for collection in self.collections:
-                for item in self.backup_data[collection]:
-                    self.insert(item, collection)
-        self.config["chromadb"]["vector_config_type"] = self.model_type
-        self.config["chromadb"]["vector_config_model"] = self.model
-        self._save_config(self.config)
+        # Chromadb 沒有 BM25，關鍵字搜尋用行程內的倒排索引：{實際 collection: (建立時的筆數, 索引)}
+        self.bm25_indexes: dict[str, tuple[int, BM25Index]] = {}
+        self.bm25_lock = threading.Lock()
         print("ChromadbServiceImpl initialized.")
     
-    def _backup_data(self):
-        try:
-            data = {}
-            for collection in self.collections:
-                coll = self.client.get_collection(collection)
-                data[collection] = []
-                try:
-                    obj = coll.get()
-                    for key in obj.keys():
-                        obj[key] = [obj[key]]
-                    parsed_data = self._parse_result(obj)
-                    data[collection] = parsed_data
-                except Exception as e:
-                    print(f"Failed to get data from collection: {e}")
-                    print(f"skip this collection {collection} no data found")
-                    continue
-            print("backup data completed.")
-            self.backup_data = data
-        except Exception as e:
-            print(f"Failed to backup data: {e}")
-            raise e
+    @override
+    def _bootstrap(self):
+        # HttpClient 建立時就會連線到伺服器，延到第一次使用
+        self.connect()
+        super()._bootstrap()
+    
+    @override
+    def _scan_collection(self, physical: str, cursor: Any, batch_size: int) -> Iterator[tuple[list[Document], Any]]:
+        collection = self.client.get_collection(physical)
+        offset = cursor or 0
+        while True:
+            obj = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+            count = len(obj.get("ids") or [])
+            if count == 0:
+                return
+            offset += count
+            # get() 回傳單層 list，包成 query() 的格式後共用 _parse_result
+            yield self._parse_result({key: [obj.get(key)] for key in ("ids", "documents", "metadatas")}), offset
+            if count < batch_size:
+                return
+    
+    def _get_bm25_index(self, physical: str, collection) -> BM25Index:
+        """
+        第一次關鍵字搜尋時分頁讀出整個 collection 建立索引；本行程寫入後或筆數改變 (其他行程寫入) 時重建
+        """
+        count = collection.count()
+        with self.bm25_lock:
+            cached = self.bm25_indexes.get(physical)
+            if cached is not None and cached[0] == count:
+                return cached[1]
+            index = BM25Index()
+            offset = 0
+            while True:
+                obj = collection.get(limit=1000, offset=offset, include=["documents"])
+                ids = obj.get("ids") or []
+                for uid, content in zip(ids, obj.get("documents") or []):
+                    index.add(uid, content or "")
+                if len(ids) < 1000:
+                    break
+                offset += len(ids)
+            self.bm25_indexes[physical] = (count, index)
+            return index
+    
+    def _invalidate_bm25(self, physical: str):
+        with self.bm25_lock:
+            self.bm25_indexes.pop(physical, None)
+    
+    def _bm25(self, physical: str, collection, query: str, limit: int) -> list[Document]:
+        top = self._get_bm25_index(physical, collection).search(query, limit)
+        if not top:
+            return []
+        obj = collection.get(ids=[uid for uid, _ in top], include=["documents", "metadatas"])
+        documents = {
+            doc.pageId.hex: doc
+            for doc in self._parse_result({key: [obj.get(key)] for key in ("ids", "documents", "metadatas")})
+        }
+        return [documents[uid] for uid, _ in top if uid in documents]
     
-    def _get_embedding_function(self):
-        if self.model_type == "openai":
+    def _get_embedding_function(self, physical: str | None = None) -> CachedEmbeddingFunction:
+        """
+        指定 physical 時使用該集合建立時的模型 (遷移期間舊集合仍使用舊模型)
+        """
+        model_type, model = self._model_for(physical) if physical else (self.model_type, self.model)
+        return CachedEmbeddingFunction(
+            self._get_model_embedding_function(model_type, model),
+            get_embedding_cache(),
+            model_type,
+            model
+        )
+    
+    def _get_model_embedding_function(self, model_type: str, model: str | None):
+        if model_type == "openai":
             return OpenAIEmbeddingFunction(
                 api_key=self.api_key,
-                model_name=self.model or "text-embedding-3-small",
+                model_name=model or "text-embedding-3-small",
                 api_base=self.baseUrl
             )
-        if self.model_type == "huggingface":
-            print(f"using huggingface embedding function: {self.model}")
+        if model_type == "huggingface":
+            print(f"using huggingface embedding function: {model}")
             return HuggingFaceEmbeddingFunction(
                 api_key=self.api_key,
-                model_name=self.model or "sentence-transformers/all-MiniLM-L6-v2"
+                model_name=model or "sentence-transformers/all-MiniLM-L6-v2"
             )
-        if self.model_type == "ollama":
+        if model_type == "ollama":
             return OllamaEmbeddingFunction(
-                model=self.model,
+                model=model,
                 url=self.baseUrl or "http://localhost:11434"
             )
         return OllamaEmbeddingFunction(
-            model=self.model, 
+            model=model, 
             url=self.baseUrl or "http://localhost:11434"
         )
     
     def _parse_result(self, result: dict) -> list[Document]:
         docs = []
-        print(result)
         for i in range(len(result.get("ids",[]))):
             for j in range(len(result.get("ids")[i] or [])):
                 docId = result.get("metadatas")[i][j].get("docId")
@@ -86,53 +150,108 @@ class ChromadbService(BaseVectorService):
                     content=result.get("documents")[i][j],
                     metadata=result.get("metadatas")[i][j]
                 ))
+        return docs
+    
+    def _parse_metadata(self, data: Document) -> dict:
+        """
+        Chromadb 的 metadata 只接受 str、int、float、bool，其餘型別轉成 JSON 字串
+        """
+        metadata = {
+            key: value if isinstance(value, (str, int, float, bool)) else json.dumps(value, ensure_ascii=False)
+            for key, value in data.metadata.items()
+            if value is not None
+        }
+        metadata["docId"] = data.docId.hex
+        return metadata
         
     @override
     def connect(self):
         self.client  = chromadb.HttpClient(host=self.host or "localhost", port=self.port or 8000, headers=self.headers)
     
     @override
+    @bootstrapped
     def create_collection(self, name: str, exist_ok: bool=False):
+        physical = self._collection_name(name)
         try:
             if exist_ok:
                 self.client.get_or_create_collection(
-                    name=name,
-                    embedding_function=self._get_embedding_function()
+                    name=physical,
+                    embedding_function=self._get_embedding_function(physical)
                 )
                 return
             self.client.create_collection(
-                name=name,
-                embedding_function=self._get_embedding_function()
+                name=physical,
+                embedding_function=self._get_embedding_function(physical)
             )   
         except Exception as e:
             print(f"Failed to create collection: {e}")
             raise e
         
     @override
+    @bootstrapped
     def delete_collection(self, name: str):
-        self.client.delete_collection(name)
+        for physical in self._write_targets(name):
+            self._drop_collection(physical)
+    
+    @override
+    def _drop_collection(self, physical: str):
+        self._invalidate_bm25(physical)
+        self.client.delete_collection(physical)
         
     @override
+    @bootstrapped
     def list_collections(self) -> list[str]:
         return [item.name for item in self.client.list_collections()]
     
     @override
+    @bootstrapped
     def insert(self, data: Document, collection_name: str):
-        metadata = {
-            **data.metadata,
-            "docId": data.docId.hex
-        }
-        self.client.get_collection(collection_name).upsert(
-            documents=[data.content],
-            metadatas=[metadata],
-            ids=[data.pageId.hex]
-        )
+        for target in self._write_targets(collection_name):
+            self._invalidate_bm25(target)
+            self.client.get_collection(target, embedding_function=self._get_embedding_function(target)).upsert(
+                documents=[data.content],
+                metadatas=[self._parse_metadata(data)],
+                ids=[data.pageId.hex]
+            )
+    
+    @override
+    @bootstrapped
+    def insert_many(self, data: list[Document], collection_name: str, batch_size: int = 100) -> InsertResult:
+        ids: list[UUID | None] = [doc.pageId for doc in data]
+        errors: dict[int, str] = {}
+        batch_size = max(1, batch_size)
+        for target in self._write_targets(collection_name):
+            self._invalidate_bm25(target)
+            collection = self.client.get_collection(target, embedding_function=self._get_embedding_function(target))
+            for start in range(0, len(data), batch_size):
+                batch = data[start:start + batch_size]
+                try:
+                    collection.upsert(
+                        documents=[doc.content for doc in batch],
+                        metadatas=[self._parse_metadata(doc) for doc in batch],
+                        ids=[doc.pageId.hex for doc in batch]
+                    )
+                except Exception as e:
+                    print(f"Failed to insert batch {start}-{start + len(batch)} into {target}: {e}")
+                    for idx in range(start, start + len(batch)):
+                        ids[idx] = None
+                        errors[idx] = str(e)
+        return InsertResult(ids=ids, errors=errors)
+    
+    @override
+    def prepare_embeddings(self, texts: list[str]):
+        if texts:
+            self._get_embedding_function()(texts)
     
     @override
+    @bootstrapped
     def delete(self, collection_name: str, uid: UUID):
-        self.client.get_collection(collection_name).delete(ids=[uid.hex])
+        for target in self._write_targets(collection_name):
+            self._invalidate_bm25(target)
+            self.client.get_collection(target).delete(ids=[uid.hex])
     
     @override
+    @bootstrapped
     def update(self, data: Document, collection_name: str):
         """
         Use insert to update data
@@ -140,21 +259,26 @@ class ChromadbService(BaseVectorService):
         pass
     
     @override
-    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"] = "multi", limit: int = 3) -> list[Document]:
+    @bootstrapped
+    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"] = "multi", limit: int = 3, alpha: float = 0.5) -> list[Document]:
         """
         Search the knowledge base
         Args:
             query: The query to search for
             collection_name: The name of the collection to search in
-            mode: The mode to use for the search, "bm25" for BM25, "similarity" for similarity search, "multi" for both
-            limit: The limit of the search, default is 3, if used multi mode, the limit is the limit of each mode
+            mode: The mode to use for the search, "bm25" for BM25 keyword search (in-process index), "similarity" for similarity search, "multi" for both fused with Reciprocal Rank Fusion
+            limit: The limit of the search, default is 3
+            alpha: The weight of similarity search in multi mode, 0 is pure keyword search and 1 is pure similarity
         Returns:
             A list of documents
         """
+        if mode == "multi":
+            return self.hybrid_search(query, collection_name, limit=limit, alpha=alpha)
         try:
             # 尝试获取集合，如果不存在则列出可用的集合
             try:
-                collection = self.client.get_collection(collection_name)
+                physical = self._collection_name(collection_name)
+                collection = self.client.get_collection(physical, embedding_function=self._get_embedding_function(physical))
             except Exception as collection_error:
                 # 如果集合不存在，列出所有可用的集合
                 available_collections = self.list_collections()
@@ -168,15 +292,9 @@ class ChromadbService(BaseVectorService):
                 raise ValueError(error_msg) from collection_error
             
             if mode == "bm25":
-                bm25 = collection.query(n_results=limit , query_texts=[query], where_document={"$contains":query})
-                bm25.pop("included")
-                return self._parse_result(bm25)
-            if mode == "similarity":
-                similar = collection.query(n_results=limit , query_texts=[query])
-                return [self._parse_result(result) for result in similar]
-            if mode == "multi":
-                bm25_results = self.search_knowledge(query, collection_name, "bm25", limit=limit)
-                return bm25_results
+                return self._bm25(physical, collection, query, limit)
+            similar = collection.query(n_results=limit , query_texts=[query])
+            return self._parse_result(similar)
         except ValueError:
             # 重新抛出 ValueError（集合不存在）
             raise
@@ -0,0 +1,562 @@
+import json
+import os
+import shutil
+import threading
+from typing import Any, Iterator, Literal
+from uuid import UUID
+
+import numpy as np
+from typing_extensions import override
+
+from src.component.typing.vectorbase import BaseVectorService, bootstrapped, Document, InsertResult
+from src.component.utils import BM25Index, Encoder, SparseEncoder, get_encoder
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    """以倍數擴充陣列容量，讓逐批 append 的成本攤平為 O(1)"""
+    if len(array) >= size:
+        return array
+    grown = np.zeros((max(size, len(array) * 2, 1024), *array.shape[1:]), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+_COMPACT_SUFFIX = ".compact"
+_OLD_SUFFIX = ".old"
+
+def _recover_compaction(path: str) -> None:
+    """
+    壓縮中斷時的復原：已改名為 .old 但新目錄尚未換上時，換上已完整寫好的 .compact (沒有則還原 .old)；
+    collection 目錄存在時，殘留的 .compact (未完成) 與 .old (已被取代) 直接刪除
+    """
+    path = path.rstrip(os.sep)
+    tmp, old = path + _COMPACT_SUFFIX, path + _OLD_SUFFIX
+    if not os.path.isdir(path) and os.path.isdir(old):
+        # .compact 在舊目錄改名前就已寫完並關閉，可以直接使用
+        os.replace(tmp if os.path.isdir(tmp) else old, path)
+        print(f"recovered interrupted compaction of {path}")
+    if os.path.isdir(path):
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+
+class LocalCollection:
+    """
+    單一 collection 的本地儲存，目錄內每個欄位一個檔案：
+    vectors.f32 (正規化後的 float32 向量，memmap)、page_ids / doc_ids (UUID bytes)、alive (刪除標記)、
+    offsets / lengths (records.jsonl 中每列的位置)，meta.json 最後寫入，以其中的 count 為準。
+    相似度搜尋為精確的內積 (BLAS)，可選擇 IVF 索引；BM25 倒排索引在第一次關鍵字搜尋時建立。
+    同一個目錄只能由一個行程寫入。
+    """
+
+    def __init__(self, path: str, ivf_lists: int = 0, ivf_probes: int = 8) -> None:
+        self.path = path
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = max(1, ivf_probes)
+        self.lock = threading.RLock()
+        self.sparse_encoder = SparseEncoder()
+        _recover_compaction(path)
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self) -> None:
+        meta_path = self._file("meta.json")
+        meta = {"dim": 0, "count": 0, "epoch": 0}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        self.dim = int(meta["dim"])
+        self.count = int(meta["count"])
+        # 每次壓縮加一，壓縮後列號改變，舊的掃描游標需從頭開始
+        self.epoch = int(meta.get("epoch", 0))
+
+        def column(name: str, dtype, width: int = 0) -> np.ndarray:
+            shape = (-1, width) if width else (-1,)
+            if not os.path.exists(self._file(name)):
+                return np.zeros((0, width) if width else (0,), dtype=dtype)
+            # 中斷時檔案結尾可能有寫了一半的列，先依 meta 的 count 截取位元組再 reshape
+            row_bytes = np.dtype(dtype).itemsize * max(width, 1)
+            data = np.fromfile(self._file(name), dtype=np.uint8, count=self.count * row_bytes)
+            data = data[:len(data) - len(data) % row_bytes]
+            return data.view(dtype).reshape(shape).copy()
+
+        self.page_ids = column("page_ids.u8", np.uint8, 16)
+        self.doc_ids = column("doc_ids.u8", np.uint8, 16)
+        self.alive = column("alive.u8", np.uint8).astype(bool)
+        self.offsets = column("offsets.i64", np.int64)
+        self.lengths = column("lengths.i64", np.int64)
+        # 中斷時可能只寫了一部分，依 meta 的 count 截斷各欄位檔案
+        for name, size in (
+            ("page_ids.u8", 16), ("doc_ids.u8", 16), ("alive.u8", 1), ("offsets.i64", 8), ("lengths.i64", 8)
+        ):
+            if os.path.exists(self._file(name)):
+                os.truncate(self._file(name), self.count * size)
+        self.rows: dict[bytes, int] = {}
+        stale = []
+        for row in np.flatnonzero(self.alive):
+            key = self.page_ids[row].tobytes()
+            if key in self.rows:
+                stale.append(self.rows[key])
+            self.rows[key] = int(row)
+        self.vectors: np.memmap | None = None
+        self.bm25_index: BM25Index | None = None
+        self.labels: np.ndarray | None = None
+        # upsert 在 meta 寫入後、舊列標記刪除前中斷時，同一 pageId 會有多列有效，只保留最新的一列
+        for row in stale:
+            self._kill(row)
+        self.capacity = 0
+        if self.dim:
+            self._open_vectors()
+        self.centroids: np.ndarray | None = None
+        self.ivf_count = 0
+
+    def _open_vectors(self, capacity: int = 0) -> None:
+        path = self._file("vectors.f32")
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        capacity = max(capacity, size // (4 * self.dim), 1)
+        if capacity * 4 * self.dim != size:
+            with open(path, "ab") as f:
+                f.truncate(capacity * 4 * self.dim)
+        if self.vectors is not None:
+            self.vectors.flush()
+        self.vectors = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def _save_meta(self) -> None:
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"dim": self.dim, "count": self.count, "epoch": self.epoch}, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def _append_column(self, name: str, values: np.ndarray) -> None:
+        with open(self._file(name), "ab") as f:
+            f.write(np.ascontiguousarray(values).tobytes())
+
+    def _read_record(self, row: int) -> dict:
+        with open(self._file("records.jsonl"), "rb") as f:
+            f.seek(int(self.offsets[row]))
+            return json.loads(f.read(int(self.lengths[row])))
+
+    def _to_document(self, row: int) -> Document:
+        record = self._read_record(row)
+        return Document(
+            docId=UUID(bytes=self.doc_ids[row].tobytes()),
+            pageId=UUID(bytes=self.page_ids[row].tobytes()),
+            content=record["content"],
+            metadata=record["metadata"]
+        )
+
+    def _kill(self, row: int) -> None:
+        """將一列標記為刪除，原地改寫 alive 檔案中的一個位元組"""
+        self.alive[row] = False
+        with open(self._file("alive.u8"), "r+b") as f:
+            f.seek(row)
+            f.write(b"\x00")
+        if self.bm25_index is not None:
+            self.bm25_index.remove(row, self._read_record(row)["content"])
+        if self.labels is not None:
+            self.labels[row] = -1
+
+    def upsert(self, documents: list[Document], vectors: np.ndarray) -> None:
+        if not documents:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(documents), -1)
+        # 同一批中重複的 pageId 只保留最後一筆
+        last = {doc.pageId.bytes: idx for idx, doc in enumerate(documents)}
+        if len(last) < len(documents):
+            keep = sorted(last.values())
+            documents = [documents[idx] for idx in keep]
+            vectors = vectors[keep]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        with self.lock:
+            if not self.dim:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"向量維度 {vectors.shape[1]} 與 collection 的 {self.dim} 不符")
+            start = self.count
+            end = start + len(documents)
+            if self.vectors is None or self.capacity < end:
+                self._open_vectors(max(end, self.capacity * 2, 1024))
+            self.vectors[start:end] = vectors
+            self.vectors.flush()
+
+            records_path = self._file("records.jsonl")
+            position = os.path.getsize(records_path) if os.path.exists(records_path) else 0
+            offsets = np.empty(len(documents), dtype=np.int64)
+            lengths = np.empty(len(documents), dtype=np.int64)
+            with open(records_path, "ab") as f:
+                for idx, doc in enumerate(documents):
+                    line = json.dumps({"content": doc.content, "metadata": doc.metadata}, ensure_ascii=False).encode("utf-8") + b"\n"
+                    f.write(line)
+                    offsets[idx] = position
+                    lengths[idx] = len(line)
+                    position += len(line)
+            page_ids = np.frombuffer(b"".join(doc.pageId.bytes for doc in documents), dtype=np.uint8).reshape(-1, 16)
+            doc_ids = np.frombuffer(b"".join(doc.docId.bytes for doc in documents), dtype=np.uint8).reshape(-1, 16)
+            self._append_column("page_ids.u8", page_ids)
+            self._append_column("doc_ids.u8", doc_ids)
+            self._append_column("alive.u8", np.ones(len(documents), dtype=np.uint8))
+            self._append_column("offsets.i64", offsets)
+            self._append_column("lengths.i64", lengths)
+            self.page_ids = _grow(self.page_ids, end)
+            self.doc_ids = _grow(self.doc_ids, end)
+            self.alive = _grow(self.alive, end)
+            self.offsets = _grow(self.offsets, end)
+            self.lengths = _grow(self.lengths, end)
+            self.page_ids[start:end] = page_ids
+            self.doc_ids[start:end] = doc_ids
+            self.alive[start:end] = True
+            self.offsets[start:end] = offsets
+            self.lengths[start:end] = lengths
+            if self.labels is not None and self.centroids is not None:
+                self.labels = _grow(self.labels, end)
+                self.labels[start:end] = np.argmax(vectors @ self.centroids.T, axis=1)
+            # 先寫入 meta 讓新列生效，再標記舊列刪除；兩者之間中斷時由 _load 清掉重複的舊列，資料不會遺失
+            self.count = end
+            self._save_meta()
+
+            # 相同 pageId 的舊資料標記刪除 (upsert)
+            for idx, doc in enumerate(documents):
+                row = self.rows.get(doc.pageId.bytes)
+                if row is not None:
+                    self._kill(row)
+                self.rows[doc.pageId.bytes] = start + idx
+                if self.bm25_index is not None:
+                    self.bm25_index.add(start + idx, doc.content)
+            self._maybe_compact()
+
+    def delete(self, uid: UUID) -> None:
+        with self.lock:
+            row = self.rows.pop(uid.bytes, None)
+            if row is not None:
+                self._kill(row)
+                self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        if self.count >= 1024 and len(self.rows) < self.count // 2:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        刪除或覆寫過半時，把仍有效的資料重寫到新目錄後替換，回收向量檔與 records 的空間
+        """
+        with self.lock:
+            tmp = self.path.rstrip(os.sep) + _COMPACT_SUFFIX
+            shutil.rmtree(tmp, ignore_errors=True)
+            target = LocalCollection(tmp)
+            # epoch 先寫進新目錄，中斷後由 .compact 復原時舊的掃描游標也會失效
+            target.epoch = self.epoch + 1
+            target._save_meta()
+            rows = np.flatnonzero(self.alive[:self.count])
+            for start in range(0, len(rows), 1024):
+                part = rows[start:start + 1024]
+                target.upsert([self._to_document(int(row)) for row in part], np.asarray(self.vectors[part]))
+            target.close()
+            self.close()
+            old = self.path.rstrip(os.sep) + _OLD_SUFFIX
+            os.replace(self.path, old)
+            os.replace(tmp, self.path)
+            shutil.rmtree(old, ignore_errors=True)
+            self._load()
+
+    def iter_documents(self) -> Iterator[Document]:
+        """
+        依列號分頁讀取所有有效資料，期間發生壓縮時會從頭重新讀取 (可能重複回傳)
+        """
+        cursor = None
+        while True:
+            documents, cursor = self.scan(cursor, 1024)
+            if cursor is None:
+                return
+            yield from documents
+
+    def scan(self, cursor: list[int] | None, limit: int) -> tuple[list[Document], list[int] | None]:
+        """
+        依列號分頁讀取有效資料，游標為 [epoch, 下一列]，回傳 (這一頁的文件, 下一頁的游標)，讀完時游標為 None
+        """
+        with self.lock:
+            epoch, start = cursor or (self.epoch, 0)
+            if epoch != self.epoch:
+                start = 0
+            rows = (np.flatnonzero(self.alive[start:self.count]) + start)[:limit]
+            if len(rows) == 0:
+                return [], None
+            documents = [self._to_document(int(row)) for row in rows]
+            return documents, [self.epoch, int(rows[-1]) + 1]
+
+    def _build_ivf(self) -> None:
+        """以 spherical k-means 建立 IVF 分群，資料量不足時維持精確搜尋"""
+        self.centroids, self.labels = None, None
+        rows = np.flatnonzero(self.alive[:self.count])
+        if self.ivf_lists <= 0 or len(rows) < self.ivf_lists * 39:
+            return
+        rng = np.random.default_rng(0)
+        sample = np.asarray(self.vectors[rng.choice(rows, size=min(len(rows), self.ivf_lists * 256), replace=False)])
+        centroids = sample[rng.choice(len(sample), size=self.ivf_lists, replace=False)]
+        for _ in range(10):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(self.ivf_lists):
+                members = sample[assign == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1)
+        labels = np.full(self.count, -1, dtype=np.int32)
+        for start in range(0, len(rows), 65536):
+            part = rows[start:start + 65536]
+            labels[part] = np.argmax(self.vectors[part] @ centroids.T, axis=1)
+        self.centroids, self.labels, self.ivf_count = centroids, labels, self.count
+        print(f"built IVF index with {self.ivf_lists} lists for {len(rows)} vectors in {self.path}")
+
+    def search(self, query: np.ndarray, limit: int) -> list[Document]:
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / (np.linalg.norm(query) or 1)
+        while True:
+            with self.lock:
+                if not self.count or self.vectors is None:
+                    return []
+                if self.ivf_lists > 0 and (self.labels is None or self.count > self.ivf_count * 2):
+                    self._build_ivf()
+                count = self.count
+                epoch = self.epoch
+                alive = self.alive[:count].copy()
+                labels = None if self.labels is None else self.labels[:count].copy()
+                centroids = self.centroids
+                vectors = self.vectors
+            # 內積在鎖外計算，不阻擋寫入
+            if labels is not None and centroids is not None:
+                probes = np.argsort(centroids @ query)[-self.ivf_probes:]
+                candidates = np.flatnonzero(np.isin(labels, probes) & alive)
+            else:
+                candidates = None
+            if candidates is None:
+                scores = vectors[:count] @ query
+                scores[~alive] = -np.inf
+                rows = np.arange(count)
+            else:
+                scores = vectors[candidates] @ query
+                rows = candidates
+            limit = min(limit, int(np.isfinite(scores).sum()))
+            if limit <= 0:
+                return []
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+            with self.lock:
+                # 計算期間發生壓縮時列號已改變，重新搜尋
+                if self.epoch == epoch:
+                    return [self._to_document(int(rows[idx])) for idx in top]
+
+    def _build_bm25(self) -> None:
+        self.bm25_index = BM25Index(self.sparse_encoder)
+        for row in np.flatnonzero(self.alive[:self.count]):
+            self.bm25_index.add(int(row), self._read_record(int(row))["content"])
+
+    def bm25(self, query: str, limit: int) -> list[Document]:
+        with self.lock:
+            if self.bm25_index is None:
+                self._build_bm25()
+            return [self._to_document(row) for row, _ in self.bm25_index.search(query, limit)]
+
+    def close(self) -> None:
+        with self.lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+                self.vectors = None
+
+class LocalVectorService(BaseVectorService):
+    """
+    不需要外部伺服器的內嵌向量庫，資料存放在 VECTOR_LOCAL_PATH 下，每個 collection 一個目錄。
+    適合邊緣部署與 CI 基準測試。
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.connect()
+        print("LocalVectorServiceImpl initialized.")
+
+    @override
+    def _scan_collection(self, physical: str, cursor: Any, batch_size: int) -> Iterator[tuple[list[Document], Any]]:
+        collection = self._get_collection(physical)
+        while True:
+            documents, cursor = collection.scan(cursor, batch_size)
+            if cursor is None:
+                return
+            yield documents, cursor
+
+    def _get_encoder(self, physical: str | None = None) -> Encoder:
+        model_type, model = self._model_for(physical) if physical else (self.model_type, self.model)
+        if model_type == "openai":
+            return get_encoder(
+                types=model_type,
+                model=model or "text-embedding-3-small",
+                api_key=self.api_key,
+                api_base=self.baseUrl
+            )
+        if model_type == "huggingface":
+            return get_encoder(
+                types=model_type,
+                model=model or "sentence-transformers/all-MiniLM-L6-v2",
+                api_key=self.api_key
+            )
+        return get_encoder(
+            types="ollama",
+            model=model,
+            api_base=self.baseUrl or "http://localhost:11434"
+        )
+
+    def _collection_path(self, name: str) -> str:
+        """
+        collection 的目錄，尚未開啟時先復原中斷的壓縮 (已開啟的 collection 可能正在壓縮，不能動它的暫存目錄)
+        """
+        path = os.path.join(self.path, name)
+        with self.lock:
+            if name not in self.stores:
+                _recover_compaction(path)
+        return path
+
+    def _get_collection(self, name: str) -> LocalCollection:
+        with self.lock:
+            collection = self.stores.get(name)
+            if collection is None:
+                if not os.path.isdir(self._collection_path(name)):
+                    raise ValueError(f"Collection {name} does not exist")
+                collection = LocalCollection(os.path.join(self.path, name), self.ivf_lists, self.ivf_probes)
+                self.stores[name] = collection
+            return collection
+
+    @override
+    def connect(self):
+        self.path = os.getenv("VECTOR_LOCAL_PATH", "config/vector_store")
+        self.ivf_lists = int(os.getenv("VECTOR_LOCAL_IVF_LISTS", "0"))
+        self.ivf_probes = int(os.getenv("VECTOR_LOCAL_IVF_PROBES", "8"))
+        self.lock = threading.RLock()
+        self.stores: dict[str, LocalCollection] = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    @override
+    def close(self):
+        with self.lock:
+            stores = list(self.stores.values())
+            self.stores.clear()
+        for store in stores:
+            store.close()
+
+    @override
+    @bootstrapped
+    def create_collection(self, name: str, exist_ok: bool=False):
+        physical = self._collection_name(name)
+        if os.path.isdir(self._collection_path(physical)):
+            if exist_ok:
+                return
+            raise ValueError(f"Collection {physical} already exists")
+        os.makedirs(os.path.join(self.path, physical))
+
+    @override
+    @bootstrapped
+    def delete_collection(self, name: str):
+        for physical in self._write_targets(name):
+            self._drop_collection(physical)
+
+    @override
+    def _drop_collection(self, physical: str):
+        with self.lock:
+            store = self.stores.pop(physical, None)
+        if store is not None:
+            store.close()
+        path = os.path.join(self.path, physical)
+        for directory in (path, path + _COMPACT_SUFFIX, path + _OLD_SUFFIX):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @override
+    @bootstrapped
+    def list_collections(self) -> list[str]:
+        names = set()
+        for name in os.listdir(self.path):
+            # 壓縮用的暫存目錄不是 collection，只回報 (必要時復原) 原本的名稱
+            for suffix in (_COMPACT_SUFFIX, _OLD_SUFFIX):
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+                    break
+            if os.path.isdir(self._collection_path(name)):
+                names.add(name)
+        return sorted(names)
+
+    @override
+    @bootstrapped
+    def insert(self, data: Document, collection_name: str) -> UUID:
+        result = self.insert_many([data], collection_name)
+        if result.errors:
+            raise RuntimeError(result.errors[0])
+        return data.pageId
+
+    @override
+    @bootstrapped
+    def insert_many(self, data: list[Document], collection_name: str, batch_size: int = 100) -> InsertResult:
+        ids: list[UUID | None] = [doc.pageId for doc in data]
+        errors: dict[int, str] = {}
+        batch_size = max(1, batch_size)
+        for target in self._write_targets(collection_name):
+            collection = self._get_collection(target)
+            encoder = self._get_encoder(target)
+            for start in range(0, len(data), batch_size):
+                batch = data[start:start + batch_size]
+                try:
+                    collection.upsert(batch, encoder.encode_batch([doc.content for doc in batch]))
+                except Exception as e:
+                    print(f"Failed to insert batch {start}-{start + len(batch)} into {target}: {e}")
+                    for idx in range(start, start + len(batch)):
+                        ids[idx] = None
+                        errors[idx] = str(e)
+        return InsertResult(ids=ids, errors=errors)
+
+    @override
+    def prepare_embeddings(self, texts: list[str]):
+        if texts:
+            self._get_encoder().encode_batch(texts)
+
+    @override
+    @bootstrapped
+    def update(self, data: Document, collection_name: str):
+        """
+        Use insert to update data
+        """
+        self.insert(data, collection_name)
+
+    @override
+    @bootstrapped
+    def delete(self, collection_name: str, uid: UUID):
+        for target in self._write_targets(collection_name):
+            self._get_collection(target).delete(uid)
+
+    @override
+    @bootstrapped
+    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"] = "multi", limit: int = 3, alpha: float = 0.5) -> list[Document]:
+        """
+        Search the knowledge base
+        Args:
+            query: The query to search for
+            collection_name: The name of the collection to search in
+            mode: The mode to use for the search, "bm25" for BM25, "similarity" for similarity search, "multi" for both fused with Reciprocal Rank Fusion
+            limit: The limit of the search, default is 3
+            alpha: The weight of similarity search in multi mode, 0 is pure BM25 and 1 is pure similarity
+        Returns:
+            A list of documents
+        """
+        physical = self._collection_name(collection_name)
+        try:
+            collection = self._get_collection(physical)
+        except ValueError as collection_error:
+            available_collections = self.list_collections()
+            error_msg = f"找不到集合 '{collection_name}'。"
+            if available_collections:
+                error_msg += f" 可用的集合有：{', '.join(available_collections)}。"
+                error_msg += " 请使用正确的集合名称重试。"
+            else:
+                error_msg += " 目前没有任何可用的集合。"
+            print(f"Collection error: {error_msg}")
+            raise ValueError(error_msg) from collection_error
+        if mode == "bm25":
+            return collection.bm25(query, limit)
+        if mode == "similarity":
+            return collection.search(self._get_encoder(physical).encode(query), limit)
+        return self.hybrid_search(query, collection_name, limit=limit, alpha=alpha)
@@ -1,84 +1,81 @@
-from typing import Literal
+from typing import Any, Iterator, Literal
 from uuid import UUID
 from typing_extensions import override
-from src.component.typing.vectorbase import BaseVectorService, Document
+from src.component.typing.vectorbase import BaseVectorService, bootstrapped, Document, InsertResult
 from qdrant_client import QdrantClient, models
 from qdrant_client.models import  PointStruct, VectorParams, Distance
 
-from src.component.utils import Encoder
+from src.component.utils import Encoder, SparseEncoder, get_encoder
+
+SPARSE_VECTOR_NAME = "bm25"
 
 class QdrantService(BaseVectorService):
     
     def __init__(self) -> None:
         super().__init__()
+        self.client: QdrantClient | None = None
+        self.sparse_encoder = SparseEncoder()
+        print("QdrantServiceImpl initialized.")
+    
+    @override
+    def _bootstrap(self):
+        # 第一次使用時才連線；舊版的集合沒有稀疏向量，會和模型變更一樣遷移到新的集合
         self.connect()
-        self.collections = [self.table_database_name, self.image_database_name, self.label_database_name]
-        self.backup_data = None
-        if self.is_need_recreate:
-            print("start to recreate database")
-            self._backup_data()
-            for collection in self.collections:
-                self.delete_collection(collection)
-        for collection in self.collections:
-            self.create_collection(collection, exist_ok=True)
-        if self.backup_data:
-            for collection in self.collections:
-                for item in self.backup_data[collection]:
-                    self.insert(item, collection)
-        self.config["chromadb"]["vector_config_type"] = self.model_type
-        self.config["chromadb"]["vector_config_model"] = self.model
-        self._save_config(self.config)
-        print("ChromadbServiceImpl initialized.")
+        super()._bootstrap()
     
-    def _backup_data(self):
-        try:
-            data = {}
-            for collection in self.collections:
-                data[collection] = []
-                offset = 0
-                try:
-                    while offset is not None:
-                        obj, offset = self.client.scroll(collection_name=collection, limit=1000, offset=offset)
-                        data[collection] += [self._parse_result(o.payload) for o in obj if o.payload is not None]
-                except Exception as e:
-                    print(f"Failed to get data from collection: {e}")
-                    print(f"skip this collection {collection} no data found")
-                    continue
-            print("backup data completed.")
-            self.backup_data = data
-        except Exception as e:
-            print(f"Failed to backup data: {e}")
-            raise e
+    @override
+    def _migration_target(self) -> dict[str, Any]:
+        return {**super()._migration_target(), "sparse": True}
     
-    def _get_encoder(self) -> Encoder:
-        if self.model_type == "openai":
-            return Encoder(
-                types=self.model_type,
+    def _has_sparse(self, physical: str) -> bool:
+        """
+        遷移完成前，舊版集合沒有稀疏向量
+        """
+        migration = self._migration()
+        if migration is None or physical in {state["shadow"] for state in migration["collections"].values()}:
+            return True
+        return bool(self.config[self.types].get("vector_config_sparse"))
+    
+    @override
+    def _scan_collection(self, physical: str, cursor: Any, batch_size: int) -> Iterator[tuple[list[Document], Any]]:
+        while True:
+            points, offset = self.client.scroll(collection_name=physical, limit=batch_size, offset=cursor, with_payload=True)
+            documents = [self._parse_result(point.payload) for point in points if point.payload is not None]
+            if offset is None:
+                if documents:
+                    yield documents, None
+                return
+            # 游標存進設定檔，UUID 需轉成字串
+            cursor = offset if isinstance(offset, int) else str(offset)
+            yield documents, cursor
+    
+    def _get_encoder(self, physical: str | None = None) -> Encoder:
+        """
+        從行程共用的 Encoder 登錄表取得 Encoder，同一組設定只載入一次模型；
+        指定 physical 時使用該集合建立時的模型 (遷移期間舊集合仍使用舊模型)
+        """
+        model_type, model = self._model_for(physical) if physical else (self.model_type, self.model)
+        if model_type == "openai":
+            return get_encoder(
+                types=model_type,
+                model=model or "text-embedding-3-small",
                 api_key=self.api_key,
-                model_name=self.model or "text-embedding-3-small",
                 api_base=self.baseUrl
             )
-        if self.model_type == "huggingface":
-            print(f"using huggingface embedding function: {self.model}")
-            return Encoder(
-                types=self.model_type,
-                api_key=self.api_key,
-                model=self.model or "sentence-transformers/all-MiniLM-L6-v2"
-            )
-        if self.model_type == "ollama":
-            return Encoder(
-                types=self.model_type,
-                model=self.model,
-                api_base=self.baseUrl or "http://localhost:11434"
+        if model_type == "huggingface":
+            return get_encoder(
+                types=model_type,
+                model=model or "sentence-transformers/all-MiniLM-L6-v2",
+                api_key=self.api_key
             )
-        return Encoder(
-            types=self.model_type,
-            model=self.model,
+        return get_encoder(
+            types="ollama",
+            model=model,
             api_base=self.baseUrl or "http://localhost:11434"
         )
     
-    def _parse_result(self, result: dict) -> list[Document]:
-        docs = []
+    def _parse_result(self, result: dict) -> Document:
+        result = dict(result)
         docId = result.pop("docId")
         pageId = result.pop("pageId")
         content = result.pop("content")
@@ -93,19 +90,32 @@ class QdrantService(BaseVectorService):
         self.client  = QdrantClient(host=self.host or "localhost", port=self.port or 6333)
     
     @override
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+    
+    @override
+    @bootstrapped
     def create_collection(self, name: str, exist_ok: bool=False):
-        encoder = self._get_encoder()
+        physical = self._collection_name(name)
         try:
-            if not self.client.collection_exists(name):
+            if not self.client.collection_exists(physical):
                 self.client.create_collection(
-                    collection_name=name,
+                    collection_name=physical,
                     vectors_config=VectorParams(
-                        size=encoder.get_sentence_embedding_dimension(), 
+                        size=self._embedding_dimension(
+                            *self._model_for(physical),
+                            lambda: self._get_encoder(physical).get_sentence_embedding_dimension()
+                        ), 
                         distance=Distance.COSINE
                     ),
+                    sparse_vectors_config={
+                        # 由 Qdrant 計算 IDF，搭配 SparseEncoder 的詞頻即為 BM25 類的關鍵字搜尋
+                        SPARSE_VECTOR_NAME: models.SparseVectorParams(modifier=models.Modifier.IDF)
+                    },
                 )
                 return
-            raise ValueError(f"Collection {name} already exists")
+            raise ValueError(f"Collection {physical} already exists")
         except Exception as e:
             print(f"Failed to create collection: {e}")
             if exist_ok:
@@ -113,44 +123,95 @@ class QdrantService(BaseVectorService):
             raise e
         
     @override
+    @bootstrapped
     def delete_collection(self, name: str):
-        self.client.delete_collection(name)
+        for physical in self._write_targets(name):
+            self._drop_collection(physical)
+    
+    @override
+    def _drop_collection(self, physical: str):
+        self.client.delete_collection(physical)
         
     @override
+    @bootstrapped
     def list_collections(self) -> list[str]:
-        return self.client.get_collections().collections
+        return [collection.name for collection in self.client.get_collections().collections]
     
+    def _to_points(self, data: list[Document], physical: str) -> list[PointStruct]:
+        vectors = self._get_encoder(physical).encode_batch([d.content for d in data])
+        sparse = self._has_sparse(physical)
+        return [
+            PointStruct(
+                id=d.pageId,
+                vector={
+                    "": vector.tolist(),
+                    **({SPARSE_VECTOR_NAME: self._sparse_vector(d.content)} if sparse else {})
+                },
+                payload={
+                    **d.metadata,
+                    "docId": d.docId.hex,
+                    "pageId": d.pageId.hex,
+                    "content": d.content
+                }
+            )
+            for d, vector in zip(data, vectors)
+        ]
+
+    def _sparse_vector(self, text: str, query: bool = False) -> models.SparseVector:
+        indices, values = self.sparse_encoder.encode_query(text) if query else self.sparse_encoder.encode(text)
+        return models.SparseVector(indices=indices, values=values)
+
     @override
+    @bootstrapped
     def insert(self, data: Document | list[Document], collection_name: str):
         if isinstance(data, Document):
             data = [data]
-        self.client.upsert(
-            collection_name=collection_name,
-            points=[
-                PointStruct(
-                    id=d.pageId,
-                    vector=self._get_encoder().encode(d.content),
-                    payload={
-                        **d.metadata,
-                        "docId": d.docId.hex,
-                        "pageId": d.pageId.hex,
-                        "content": d.content
-                    }
-                )
-                for d in data
-            ],
-        )
+        for target in self._write_targets(collection_name):
+            self.client.upsert(
+                collection_name=target,
+                points=self._to_points(data, target),
+            )
+    
+    @override
+    @bootstrapped
+    def insert_many(self, data: list[Document], collection_name: str, batch_size: int = 100) -> InsertResult:
+        ids: list[UUID | None] = [doc.pageId for doc in data]
+        errors: dict[int, str] = {}
+        batch_size = max(1, batch_size)
+        for target in self._write_targets(collection_name):
+            for start in range(0, len(data), batch_size):
+                batch = data[start:start + batch_size]
+                try:
+                    self.client.upsert(
+                        collection_name=target,
+                        points=self._to_points(batch, target),
+                        wait=True
+                    )
+                except Exception as e:
+                    print(f"Failed to insert batch {start}-{start + len(batch)} into {target}: {e}")
+                    for idx in range(start, start + len(batch)):
+                        ids[idx] = None
+                        errors[idx] = str(e)
+        return InsertResult(ids=ids, errors=errors)
         
     @override
+    def prepare_embeddings(self, texts: list[str]):
+        if texts:
+            self._get_encoder().encode_batch(texts)
+    
+    @override
+    @bootstrapped
     def delete(self, collection_name: str, uid: UUID):
-        self.client.delete(
-            collection_name,
-            points_selector=models.PointIdsList(
-                points=[uid]
+        for target in self._write_targets(collection_name):
+            self.client.delete(
+                target,
+                points_selector=models.PointIdsList(
+                    points=[uid]
+                )
             )
-        )
     
     @override
+    @bootstrapped
     def update(self, data: Document, collection_name: str):
         """
         Use insert to update data
@@ -158,21 +219,24 @@ class QdrantService(BaseVectorService):
         self.insert(data, collection_name)
     
     @override
-    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"] = "multi", limit: int = 3) -> list[Document]:
+    @bootstrapped
+    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"] = "multi", limit: int = 3, alpha: float = 0.5) -> list[Document]:
         """
         Search the knowledge base
         Args:
             query: The query to search for
             collection_name: The name of the collection to search in
-            mode: this vector service only support similarity search
-            limit: The limit of the search, default is 3, if used multi mode, the limit is the limit of each mode
+            mode: The mode to use for the search, "bm25" for sparse keyword search, "similarity" for dense search, "multi" for both fused with RRF in one query
+            limit: The limit of the search, default is 3
+            alpha: Qdrant's RRF fusion is unweighted, only 0 or 1 change the result (pure keyword / pure similarity)
         Returns:
             A list of documents
         """
         try:
             # 尝试获取集合，如果不存在则列出可用的集合
+            physical = self._collection_name(collection_name)
             try:
-                collection = self.client.get_collection(collection_name)
+                collection = self.client.get_collection(physical)
             except Exception as collection_error:
                 # 如果集合不存在，列出所有可用的集合
                 available_collections = self.list_collections()
@@ -184,14 +248,43 @@ class QdrantService(BaseVectorService):
                     error_msg += " 目前没有任何可用的集合。"
                 print(f"Collection error: {error_msg}")
                 raise ValueError(error_msg) from collection_error
-            qembed = self._get_encoder().encode(query)
-            search_result = self.client.query_points(
-                collection_name=collection_name,
-                query=qembed,
-                query_filter=None,
-                limit=limit
-            ).points
-            return self._parse_result(search_result)
+            if mode == "multi" and alpha <= 0:
+                mode = "bm25"
+            elif mode == "multi" and alpha >= 1:
+                mode = "similarity"
+            if not self._has_sparse(physical):
+                # 遷移到有稀疏向量的集合完成前只能做向量搜尋
+                mode = "similarity"
+            encoder = self._get_encoder(physical)
+            if mode == "bm25":
+                search_result = self.client.query_points(
+                    collection_name=physical,
+                    query=self._sparse_vector(query, query=True),
+                    using=SPARSE_VECTOR_NAME,
+                    limit=limit,
+                    with_payload=True
+                ).points
+            elif mode == "similarity":
+                search_result = self.client.query_points(
+                    collection_name=physical,
+                    query=encoder.encode(query),
+                    limit=limit,
+                    with_payload=True
+                ).points
+            else:
+                # 稀疏與稠密檢索在伺服器端各取候選，再以 RRF 融合，只需一次請求
+                candidates = max(limit * 4, 20)
+                search_result = self.client.query_points(
+                    collection_name=physical,
+                    prefetch=[
+                        models.Prefetch(query=self._sparse_vector(query, query=True), using=SPARSE_VECTOR_NAME, limit=candidates),
+                        models.Prefetch(query=encoder.encode(query), limit=candidates),
+                    ],
+                    query=models.FusionQuery(fusion=models.Fusion.RRF),
+                    limit=limit,
+                    with_payload=True
+                ).points
+            return [self._parse_result(point.payload) for point in search_result if point.payload is not None]
         except ValueError:
             # 重新抛出 ValueError（集合不存在）
             raise
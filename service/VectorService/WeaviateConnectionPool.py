@@ -0,0 +1,128 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from typing import Callable, Iterator
+
+from weaviate import WeaviateClient
+
+
+class WeaviateConnectionPool:
+    """
+    執行緒安全的 Weaviate 連線池，連線會被重複使用，並在取出時做健康檢查與失效重連。
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], WeaviateClient],
+        max_size: int = 4,
+        timeout: float = 30.0,
+        health_check_interval: float = 30.0
+    ) -> None:
+        self.factory = factory
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.idle: LifoQueue[tuple[WeaviateClient, float]] = LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _create(self) -> WeaviateClient:
+        try:
+            return self.factory()
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def _discard(self, client: WeaviateClient) -> None:
+        with self.lock:
+            self.created -= 1
+        try:
+            client.close()
+        except Exception as e:
+            print(f"Failed to close Weaviate connection: {e}")
+
+    def _is_healthy(self, client: WeaviateClient) -> bool:
+        try:
+            return client.is_connected() and client.is_ready()
+        except Exception:
+            return False
+
+    def acquire(self) -> WeaviateClient:
+        if self.closed:
+            raise RuntimeError("Weaviate connection pool is closed")
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                client, checked = self.idle.get_nowait()
+            except Empty:
+                with self.lock:
+                    can_create = self.created < self.max_size
+                    if can_create:
+                        self.created += 1
+                if can_create:
+                    return self._create()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Timed out waiting for a Weaviate connection (pool size {self.max_size})")
+                try:
+                    client, checked = self.idle.get(timeout=remaining)
+                except Empty:
+                    continue
+            if time.monotonic() - checked < self.health_check_interval or self._is_healthy(client):
+                return client
+            print("Weaviate connection is unhealthy, reconnecting...")
+            self._discard(client)
+
+    def release(self, client: WeaviateClient, healthy: bool = True) -> None:
+        if self.closed or not healthy:
+            self._discard(client)
+            return
+        self.idle.put((client, time.monotonic()))
+
+    @contextmanager
+    def connection(self) -> Iterator[WeaviateClient]:
+        client = self.acquire()
+        healthy = True
+        try:
+            yield client
+        except Exception:
+            healthy = self._is_healthy(client)
+            raise
+        finally:
+            self.release(client, healthy)
+
+    def close(self) -> None:
+        self.closed = True
+        while True:
+            try:
+                client, _ = self.idle.get_nowait()
+            except Empty:
+                break
+            self._discard(client)
+
+
+_pools: dict[tuple, WeaviateConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_connection_pool(key: tuple, factory: Callable[[], WeaviateClient], **options) -> WeaviateConnectionPool:
+    """
+    依連線設定取得行程共用的連線池
+    """
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.closed:
+            pool = WeaviateConnectionPool(factory, **options)
+            _pools[key] = pool
+        return pool
+
+@atexit.register
+def close_connection_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -1,56 +1,45 @@
-from typing import Literal
+from typing import Any, Iterator, Literal
 from uuid import UUID
 from typing_extensions import override
 from weaviate.collections.classes.internal import Object
 from weaviate.collections.classes.types import WeaviateProperties
 from weaviate.collections.classes.config_vectors import _VectorConfigCreate
-from src.component.typing import BaseVectorService, Document
+from src.component.typing import BaseVectorService, bootstrapped, Document, InsertResult
+from src.service.VectorService.WeaviateConnectionPool import WeaviateConnectionPool, get_connection_pool
 import weaviate as wc
+import os
 
 
 class WeaviateService(BaseVectorService):
     
     def __init__(self) -> None:
         super().__init__()
-        self.collections = [self.table_database_name, self.image_database_name, self.label_database_name]
-        self.backup_data = None
-        if self.is_need_recreate:
-            print("start to recreate database")
-            self._backup_data()
-            for collection in self.collections:
-                self.delete_collection(collection)
-        for collection in self.collections:
-            self.create_collection(collection, exist_ok=True)
-        if self.backup_data:
-            for collection in self.collections:
-                for item in self.backup_data[collection]:
-                    self.insert(item, collection)
-        self.config["weaviate"]["vector_config_type"] = self.model_type
-        self.config["weaviate"]["vector_config_model"] = self.model
-        self._save_config(self.config)
+        # 連線池在借出連線時才建立連線，collection 在第一次使用時才檢查
+        self.pool = self._get_pool()
         print("WeaviateServiceImpl initialized.")
         
-    def _get_vectorizer(self) -> _VectorConfigCreate:
-        if self.model_type == "openai":
+    def _get_vectorizer(self, model_type: str, model: str | None) -> _VectorConfigCreate:
+        if model_type == "openai":
             return wc.classes.config.Configure.Vectors.text2vec_openai(
-                model=self.model,
+                model=model,
                 base_url=self.baseUrl
             )
-        if self.model_type == "huggingface":
+        if model_type == "huggingface":
             return wc.classes.config.Configure.Vectors.text2vec_huggingface(
-                model=self.model,
+                model=model,
                 endpoint_url=self.baseUrl
             )
         return wc.classes.config.Configure.Vectors.text2vec_ollama(
-            model=self.model,
+            model=model,
             api_endpoint=self.baseUrl
         )
         
     def _parse_data(self, data: Document):
         try:
-            pageNumber = str(data.metadata.get("docPage",0) or 0) or "0"
+            # 遷移時讀回的文件 metadata 為 name / PageNumber
+            pageNumber = str(data.metadata.get("docPage", data.metadata.get("PageNumber", 0)) or 0) or "0"
             return {
-                "name": data.metadata.get("labelName") or data.metadata.get("imageName") or data.metadata.get("tableName") or "No Name",
+                "name": data.metadata.get("labelName") or data.metadata.get("imageName") or data.metadata.get("tableName") or data.metadata.get("name") or "No Name",
                 "content": data.content,
                 "PageNumber": int(pageNumber if pageNumber.isdigit() else "0"),
                 "docId": data.docId
@@ -74,49 +63,57 @@ class WeaviateService(BaseVectorService):
             print(f"Failed to parse result: {e}")
             raise e
         
-    def _backup_data(self):
-        try:
+    def _scan_collection(self, physical: str, cursor: Any, batch_size: int) -> Iterator[tuple[list[Document], Any]]:
+        while True:
             with self.connect() as conn:
-                data = {}
-                for collection in self.collections:
-                    coll = conn.collections.get(collection)
-                    data[collection] = []
-                    try:
-                        for item in coll.iterator():
-                            data[collection].append(Document(
-                                docId=UUID(item.properties.get("docId")),
-                                pageId=item.uuid,
-                                content=item.properties.get("content"),
-                                metadata={
-                                    "name": item.properties.get("name"),
-                                    "PageNumber": item.properties.get("PageNumber")
-                                }
-                            ))
-                    except Exception as e:
-                        print(f"Failed to get data from collection: {e}")
-                        print(f"skip this collection {collection} no data found")
-                        continue
-                print("backup data completed.")
-                self.backup_data = data
-        except Exception as e:
-            print(f"Failed to backup data: {e}")
-            raise e
+                collection = conn.collections.get(physical)
+                objects = collection.query.fetch_objects(limit=batch_size, after=cursor).objects
+            if not objects:
+                return
+            cursor = str(objects[-1].uuid)
+            yield [self._parse_result(item) for item in objects], cursor
+            if len(objects) < batch_size:
+                return
         
-    @override
-    def connect(self):
+    def _open_connection(self) -> wc.WeaviateClient:
         try:
             return wc.connect_to_local(host=self.host, port=self.port or 8080, headers=self.headers)
         except Exception as e:
             print(f"Failed to connect to Weaviate: {e}")
             raise e
+    
+    def _get_pool(self) -> WeaviateConnectionPool:
+        key = (self.host, self.port, tuple(sorted((self.headers or {}).items())))
+        return get_connection_pool(
+            key,
+            self._open_connection,
+            max_size=int(os.getenv("VECTOR_POOL_SIZE", "4")),
+            timeout=float(os.getenv("VECTOR_POOL_TIMEOUT", "30")),
+            health_check_interval=float(os.getenv("VECTOR_POOL_HEALTH_CHECK_INTERVAL", "30"))
+        )
         
     @override
+    def connect(self):
+        """
+        從連線池借出一條連線，使用 with 區塊結束後自動歸還
+        """
+        if self.pool.closed:
+            self.pool = self._get_pool()
+        return self.pool.connection()
+    
+    @override
+    def close(self):
+        self.pool.close()
+        
+    @override
+    @bootstrapped
     def create_collection(self, name: str, exist_ok: bool=False):
+        physical = self._collection_name(name)
         try:
             with self.connect() as conn:
                 conn.collections.create(
-                    name, 
-                    vector_config=self._get_vectorizer(),
+                    physical, 
+                    vector_config=self._get_vectorizer(*self._model_for(physical)),
                     properties=[
                         wc.classes.config.Property(name="name", data_type=wc.classes.config.DataType.TEXT),
                         wc.classes.config.Property(name="content", data_type=wc.classes.config.DataType.TEXT),
@@ -131,6 +128,7 @@ class WeaviateService(BaseVectorService):
             raise e
         
     @override
+    @bootstrapped
     def list_collections(self) -> list[str]:
         try:
             with self.connect() as conn:
@@ -140,35 +138,76 @@ class WeaviateService(BaseVectorService):
             raise e
         
     @override
+    @bootstrapped
     def delete_collection(self, name: str):
+        for physical in self._write_targets(name):
+            self._drop_collection(physical)
+    
+    @override
+    def _drop_collection(self, physical: str):
         try:
             with self.connect() as conn:
-                conn.collections.delete(name)
-            print(f"database {name} deleted")
+                conn.collections.delete(physical)
+            print(f"database {physical} deleted")
         except Exception as e:
             print(f"Failed to delete database: {e}")
             raise e
         
     @override
+    @bootstrapped
     def insert(self, data: Document, collection_name: str) -> UUID:
         try:
             with self.connect() as conn:
-                collection = conn.collections.get(collection_name)
-                uid = collection.data.insert(self._parse_data(data))
-                return uid
+                uids = [
+                    conn.collections.get(target).data.insert(self._parse_data(data), uuid=data.pageId)
+                    for target in self._write_targets(collection_name)
+                ]
+                return uids[0]
+        except Exception as e:
+            print(f"Failed to insert data: {e}")
+            raise e
+        
+    @override
+    @bootstrapped
+    def insert_many(self, data: list[Document], collection_name: str, batch_size: int = 100) -> InsertResult:
+        ids: list[UUID | None] = [doc.pageId for doc in data]
+        errors: dict[int, str] = {}
+        index = {doc.pageId: idx for idx, doc in enumerate(data)}
+        batch_size = max(1, batch_size)
+        try:
+            with self.connect() as conn:
+                for target in self._write_targets(collection_name):
+                    collection = conn.collections.get(target)
+                    for start in range(0, len(data), batch_size):
+                        with collection.batch.dynamic() as batch:
+                            for doc in data[start:start + batch_size]:
+                                batch.add_object(properties=self._parse_data(doc), uuid=doc.pageId)
+                        for failed in collection.batch.failed_objects:
+                            uid = failed.original_uuid or getattr(failed.object_, "uuid", None)
+                            idx = index.get(UUID(str(uid))) if uid is not None else None
+                            # 無法對應到是哪一筆時，整批都視為失敗，避免把失敗的物件回報為成功
+                            failed_indexes = [idx] if idx is not None else range(start, min(start + batch_size, len(data)))
+                            for i in failed_indexes:
+                                ids[i] = None
+                                errors[i] = failed.message
         except Exception as e:
             print(f"Failed to insert data: {e}")
             raise e
+        if errors:
+            print(f"Failed to insert {len(errors)} of {len(data)} objects into {collection_name}")
+        return InsertResult(ids=ids, errors=errors)
         
     @override
-    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"]="multi", limit: int=3) -> list[Document]:
+    @bootstrapped
+    def search_knowledge(self, query: str, collection_name: str, mode: Literal["bm25", "similarity", "multi"]="multi", limit: int=3, alpha: float=0.5) -> list[Document]:
         """
         Search the knowledge base
         Args:
             query: The query to search for
             collection_name: The name of the collection to search in
-            mode: The mode to use for the search, "bm25" for BM25, "similarity" for similarity search, "multi" for both
-            limit: The limit of the search, default is 3, if used multi mode, the limit is the limit of each mode
+            mode: The mode to use for the search, "bm25" for BM25, "similarity" for similarity search, "multi" for Weaviate's native hybrid search
+            limit: The limit of the search, default is 3
+            alpha: The weight of similarity search in multi mode, 0 is pure BM25 and 1 is pure similarity
         Returns:
             A list of documents
         """
@@ -176,10 +215,10 @@ class WeaviateService(BaseVectorService):
             with self.connect() as conn:
                 # 尝试获取集合，如果不存在则列出可用的集合
                 try:
-                    collection = conn.collections.get(collection_name)
+                    collection = conn.collections.get(self._collection_name(collection_name))
                 except Exception as collection_error:
                     # 如果集合不存在，列出所有可用的集合
-                    available_collections = self.list_collections()
+                    available_collections = [item.name for item in conn.collections.list_all(simple=True).values()]
                     error_msg = f"找不到集合 '{collection_name}'。"
                     if available_collections:
                         error_msg += f" 可用的集合有：{', '.join(available_collections)}。"
@@ -190,15 +229,13 @@ class WeaviateService(BaseVectorService):
                     raise ValueError(error_msg) from collection_error
                 
                 if mode == "bm25":
-                    bm25 = collection.query.bm25(query, limit=limit).objects
-                    return [self._parse_result(result) for result in bm25]
-                if mode == "similarity":
-                    similar = collection.query.near_text(query, limit=limit).objects
-                    return [self._parse_result(result) for result in similar]
-                if mode == "multi":
-                    bm25_results = self.search_knowledge(query, collection_name, "bm25", limit=limit)
-                    similar_results = self.search_knowledge(query, collection_name, "similarity", limit=limit)
-                    return list[Document](bm25_results + similar_results)
+                    objects = collection.query.bm25(query, limit=limit).objects
+                elif mode == "similarity":
+                    objects = collection.query.near_text(query, limit=limit).objects
+                else:
+                    # 伺服器端一次完成 BM25 與向量搜尋並融合排名，結果不會重複
+                    objects = collection.query.hybrid(query, alpha=alpha, limit=limit).objects
+                return [self._parse_result(result) for result in objects]
         except ValueError:
             # 重新抛出 ValueError（集合不存在）
             raise
@@ -207,21 +244,23 @@ class WeaviateService(BaseVectorService):
             raise e
     
     @override
+    @bootstrapped
     def update(self, data: Document, collection_name: str):
         try:
             with self.connect() as conn:
-                collection = conn.collections.get(collection_name)
-                collection.data.update(uuid=data.pageId, properties=self._parse_data(data))
+                for target in self._write_targets(collection_name):
+                    conn.collections.get(target).data.update(uuid=data.pageId, properties=self._parse_data(data))
         except Exception as e:
             print(f"Failed to update data: {e}")
             raise e
         
     @override
+    @bootstrapped
     def delete(self, collection_name: str, uid: UUID):
         try:
             with self.connect() as conn:
-                collection = conn.collections.get(collection_name)
-                collection.data.delete_by_id(uid)
+                for target in self._write_targets(collection_name):
+                    conn.collections.get(target).data.delete_by_id(uid)
         except Exception as e:
             print(f"Failed to delete data: {e}")
             raise e
\ No newline at end of file
@@ -1,22 +1,84 @@
 from dotenv import load_dotenv
+import threading
 import os
 
 from src.component.typing.vectorbase import BaseVectorService
-from src.service.VectorService.WeaviateService import WeaviateService
-from src.service.VectorService.QdrantService import QdrantService
-from src.service.VectorService.ChromadbService import ChromadbService
 
 load_dotenv('config/.env')
 
+_instances: dict[tuple, BaseVectorService] = {}
+_lock = threading.Lock()
+
 class VectorFactory:
 
-    def get_vector(self) -> BaseVectorService:
-        types = os.getenv("VECTOR_TYPE",'weaviate').lower()
-        if types == 'weaviate':
-            return WeaviateService()
-        elif types == 'qdrant':
+    def _get_key(self, types: str) -> tuple:
+        return (
+            types,
+            os.getenv("VECTOR_HOST"),
+            os.getenv("VECTOR_PORT"),
+            os.getenv("VECTOR_API_KEY"),
+            os.getenv("VECTOR_MODEL"),
+            os.getenv("VECTOR_MODEL_TYPE","ollama").lower(),
+            os.getenv("VECTOR_MODEL_BASE_URL"),
+            os.getenv("CONFIG_PATH","config/config.json"),
+            os.getenv("VECTOR_LOCAL_PATH","config/vector_store"),
+            os.getenv("VECTOR_QUERY_CACHE","false").lower()
+        )
+
+    def _create(self, types: str) -> BaseVectorService:
+        # 各後端的 client 套件很重，只載入實際選用的後端
+        if types == 'qdrant':
+            from src.service.VectorService.QdrantService import QdrantService
             return QdrantService()
         elif types == 'chromadb':
+            from src.service.VectorService.ChromadbService import ChromadbService
             return ChromadbService()
+        elif types == 'local':
+            from src.service.VectorService.LocalVectorService import LocalVectorService
+            return LocalVectorService()
         else:
-            return WeaviateService()
\ No newline at end of file
+            from src.service.VectorService.WeaviateService import WeaviateService
+            return WeaviateService()
+
+    def _wrap_cache(self, service: BaseVectorService) -> BaseVectorService:
+        """
+        VECTOR_QUERY_CACHE 開啟時在 service 外包一層搜尋結果快取
+        """
+        if os.getenv("VECTOR_QUERY_CACHE","false").lower() not in ("1", "true", "yes"):
+            return service
+        from src.service.VectorService.CachedVectorService import CachedVectorService
+        return CachedVectorService(
+            service,
+            max_items=int(os.getenv("VECTOR_QUERY_CACHE_SIZE","1024")),
+            ttl=float(os.getenv("VECTOR_QUERY_CACHE_TTL","300")),
+            semantic_threshold=float(os.getenv("VECTOR_QUERY_CACHE_SEMANTIC","0"))
+        )
+
+    def get_vector(self) -> BaseVectorService:
+        """
+        同一組設定在行程中只建立一次 vector service
+        """
+        types = os.getenv("VECTOR_TYPE",'weaviate').lower()
+        key = self._get_key(types)
+        with _lock:
+            service = _instances.get(key)
+            if service is None:
+                service = self._create(types)
+                service.warm_up()
+                service = self._wrap_cache(service)
+                _instances[key] = service
+            return service
+
+    @staticmethod
+    def reset() -> None:
+        """
+        關閉並清除所有快取的 vector service
+        """
+        with _lock:
+            services = list(_instances.values())
+            _instances.clear()
+        for service in services:
+            try:
+                service.close()
+            except Exception as e:
+                print(f"Failed to close vector service: {e}")
\ No newline at end of file
@@ -1,6 +1,5 @@
 from typing import Literal
 from src.service.WebService.SearchService.base import BaseSearchService
-from src.service.WebService.SearchService.SerpSearchService import SerpSearchService
 
 class SearchFactory:
     
@@ -9,4 +8,6 @@ class SearchFactory:
     
     def get_search(self, searchType: Literal['serp']='serp') -> BaseSearchService:
         if searchType == 'serp':
+            # serpapi 只在選用時載入
+            from src.service.WebService.SearchService.SerpSearchService import SerpSearchService
             return SerpSearchService()
\ No newline at end of file
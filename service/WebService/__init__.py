@@ -1,4 +1,4 @@
-from src.component.typing import *
+from src.component.typing import searchResultType
 from src.service.WebService.SearchService import SearchFactory
 
 class WebService:
@@ -1,15 +1,55 @@
-from src.service.ChatService import llamaFactory
-from src.service.WebService import WebService
-from src.service.VectorService import VectorFactory
-from typing import Literal
+import sys
+from typing import TYPE_CHECKING, Literal
+import atexit
+
+if TYPE_CHECKING:
+    from src.service.ChatService import llamaFactory
+    from src.service.WebService import WebService
+    from src.service.VectorService import VectorFactory
+
+_exports = {
+    "llamaFactory": "src.service.ChatService",
+    "WebService": "src.service.WebService",
+    "VectorFactory": "src.service.VectorService",
+}
+
+def __getattr__(name: str):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    return getattr(import_module(module), name)
+
 class Service:
 
     def get_service(self, name:Literal['chat','web','vector','vision']='chat'):
+        # 各 factory 在第一次選用時才載入，只用 WebService 的行程不會載入向量庫與 LLM 套件
         if name == 'chat':
+            from src.service.ChatService import llamaFactory
             return llamaFactory().get_llm()
         if name == 'web':
+            from src.service.WebService import WebService
             return WebService()
         if name == 'vector':
+            from src.service.VectorService import VectorFactory
             return VectorFactory().get_vector()
         if name == 'vision':
-            return llamaFactory().get_vlm()
\ No newline at end of file
+            from src.service.ChatService import llamaFactory
+            return llamaFactory().get_vlm()
+
+    @staticmethod
+    def reset() -> None:
+        """
+        關閉所有快取的 service 並清除，下次 get_service 時依目前設定重新建立
+        """
+        # 尚未載入的 factory 沒有任何快取，不需要為了清除而載入
+        if "src.service.ChatService" in sys.modules:
+            sys.modules["src.service.ChatService"].llamaFactory.reset()
+        if "src.service.VectorService" in sys.modules:
+            sys.modules["src.service.VectorService"].VectorFactory.reset()
+
+    @staticmethod
+    def close() -> None:
+        Service.reset()
+
+atexit.register(Service.close)
\ No newline at end of file